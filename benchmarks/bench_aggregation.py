@@ -0,0 +1,76 @@
+"""Porównanie agregacji process_data_db z poprzednią wersją opartą na 16 kolumnach pomocniczych.
+
+Mierzy czas i szczytowe zużycie pamięci (tracemalloc) na syntetycznych danych pojazdów.
+Uruchomienie (z katalogu nadrzędnego repozytorium):
+    python -m Inz.benchmarks.bench_aggregation [liczba_pojazdów ...]
+"""
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from Inz.wykres import process_data_db
+
+DEFAULT_SIZES = [1_000_000, 10_000_000]
+
+
+def make_vehicles(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'Id': np.arange(count),
+        'Data': pd.Timestamp('2025-01-01') + pd.to_timedelta(np.sort(rng.integers(0, 31 * 86400, count)), unit='s'),
+        'Kategoria': rng.choice(['H', 'L'], count, p=[0.2, 0.8]),
+        'Pas ruchu': rng.choice([1, 2], count, p=[0.55, 0.45]),
+        'Prędkość': rng.integers(20, 160, count),
+        'Przestrzeń między poprzedzającym pojazdem w dziesiętnych częściach sekundy': rng.integers(1, 600, count),
+        'Długość pojazdu w cm': rng.integers(300, 1800, count),
+        'Kierunek pod prąd': rng.choice([0, 1], count, p=[0.999, 0.001]),
+        'Numer odcinka': '114_A_1_145',
+    })
+
+
+def legacy_process_data_db(df):
+    # Poprzednia implementacja: kolumny pomocnicze na poziomie pojazdów i jedno szerokie groupby
+    df["Data 15min"] = df["Data"].dt.floor("15min")
+    aggregations = {
+        "Przestrzeń między poprzedzającym pojazdem w dziesiętnych częściach sekundy": "mean",
+        "Kierunek pod prąd": "sum",
+    }
+    for lane in (1, 2):
+        mask_lane = df['Pas ruchu'] == lane
+        df[f'Liczba na pasie {lane}'] = mask_lane.astype(int)
+        aggregations[f'Liczba na pasie {lane}'] = "sum"
+        for category in ('H', 'L'):
+            mask = mask_lane & (df['Kategoria'] == category)
+            df[f'Liczba samochodów {category} Pas {lane}'] = mask.astype(int)
+            df[f'Średnia prędkość {category} Pas {lane}'] = df['Prędkość'].where(mask)
+            df[f'Średnia długość {category} Pas {lane}'] = df['Długość pojazdu w cm'].where(mask)
+            aggregations[f'Liczba samochodów {category} Pas {lane}'] = "sum"
+            aggregations[f'Średnia prędkość {category} Pas {lane}'] = "mean"
+            aggregations[f'Średnia długość {category} Pas {lane}'] = "mean"
+    return df.groupby(["Data 15min", "Numer odcinka"]).agg(aggregations).reset_index()
+
+
+def measure(function, df):
+    tracemalloc.start()
+    start = time.perf_counter()
+    function(df)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 2 ** 20
+
+
+def main(sizes):
+    print(f"{'pojazdy':>12} {'wersja':>10} {'czas [s]':>10} {'szczyt [MiB]':>14}")
+    for count in sizes:
+        vehicles = make_vehicles(count)
+        input_mib = vehicles.memory_usage(deep=True).sum() / 2 ** 20
+        for name, function in [('poprzednia', legacy_process_data_db), ('obecna', process_data_db)]:
+            elapsed, peak = measure(function, vehicles.copy())
+            print(f"{count:>12} {name:>10} {elapsed:>10.2f} {peak:>14.1f}")
+        print(f"{'':>12} {'wejście':>10} {'':>10} {input_mib:>14.1f}")
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,273 @@
+"""Pomiar całej ścieżki danych: wczytanie pliku, agregacja, zapis do bazy i trasy HTTP /upload oraz /plot.
+
+Dla każdego etapu zapisywany jest czas, szczytowe RSS procesu i liczba wierszy na sekundę. Wyniki trafiają
+do pliku JSON, który można porównać z wynikami z innego commita (--compare).
+
+Etapy bazodanowe wymagają PostgreSQL. Z opcją --throwaway tworzona jest jednorazowa baza, usuwana po pomiarze;
+bez niej używana jest baza BENCH_DB_NAME. Bez żadnej z nich mierzone są tylko etapy bez bazy.
+Uruchomienie (z katalogu nadrzędnego repozytorium):
+    BENCH_DB_USER=postgres BENCH_DB_PASSWORD=... python -m Inz.benchmarks.bench_e2e --throwaway \\
+        --sizes 100000 1000000 --formats csv xlsx
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+import pandas as pd
+import psycopg2
+from flask import session
+from werkzeug.datastructures import FileStorage
+from Inz import wykres
+from Inz.wykres import (app, cipher, load_data, load_aggregated_data, process_data_db, update_database,
+                        update_database_with_confirmation, fetch_data_from_db, fetch_period_profiles,
+                        load_reference_data, resource_path_mr_number_info, format_section_label, plot_cache)
+from Inz.benchmarks.generate_data import generate_file, XLSX_MAX_ROWS
+
+DEFAULT_SIZES = [100_000, 1_000_000]
+DEFAULT_FORMATS = ['csv', 'xlsx']
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+class RssSampler:
+    """Mierzy szczytowe RSS procesu w trakcie bloku (próbkowanie /proc na Linuksie)."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def current():
+        try:
+            with open('/proc/self/statm') as statm:
+                return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError):
+            # Poza Linuksem dostępne jest tylko maksimum z całego życia procesu
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.current())
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+
+def measure(results, stage, rows, function, **labels):
+    with RssSampler() as rss:
+        start = time.perf_counter()
+        value = function()
+        elapsed = time.perf_counter() - start
+    result = {'stage': stage, **labels, 'rows': rows, 'seconds': round(elapsed, 4),
+              'rows_per_second': round(rows / elapsed, 1) if elapsed > 0 else None,
+              'peak_rss_mib': round(rss.peak / 2 ** 20, 1)}
+    results.append(result)
+    print(f"{stage:<34} {labels.get('format', ''):>5} {rows:>10} {elapsed:>9.3f} s "
+          f"{result['rows_per_second'] or 0:>12.0f} w/s {result['peak_rss_mib']:>8.1f} MiB")
+    return value
+
+
+def upload_file(path):
+    return FileStorage(stream=open(path, 'rb'), filename=os.path.basename(path))
+
+
+def database_settings():
+    return {
+        'db_name': os.getenv('BENCH_DB_NAME'),
+        'db_user': os.getenv('BENCH_DB_USER', 'postgres'),
+        'db_password': os.getenv('BENCH_DB_PASSWORD', ''),
+        'db_host': os.getenv('BENCH_DB_HOST', 'localhost'),
+        'db_port': os.getenv('BENCH_DB_PORT', '5432'),
+    }
+
+
+def _admin_connection(settings):
+    conn = psycopg2.connect(dbname=os.getenv('BENCH_DB_MAINTENANCE', 'postgres'), user=settings['db_user'],
+                            password=settings['db_password'], host=settings['db_host'], port=settings['db_port'])
+    conn.autocommit = True
+    return conn
+
+
+def create_throwaway_database(settings):
+    name = f"inz_bench_{uuid.uuid4().hex[:8]}"
+    conn = _admin_connection(settings)
+    with conn.cursor() as cursor:
+        cursor.execute(f'CREATE DATABASE "{name}"')
+    conn.close()
+    return name
+
+
+def drop_throwaway_database(settings):
+    # Połączenia z puli aplikacji muszą zostać zamknięte przed usunięciem bazy
+    for pool in list(wykres._pools.values()):
+        pool.closeall()
+    wykres._pools.clear()
+    conn = _admin_connection(settings)
+    with conn.cursor() as cursor:
+        cursor.execute(f'DROP DATABASE IF EXISTS "{settings["db_name"]}"')
+    conn.close()
+
+
+def login(target, settings):
+    target['db_name'] = settings['db_name']
+    target['db_user'] = settings['db_user']
+    target['db_password'] = cipher.encrypt(settings['db_password'].encode()).decode()
+    target['db_host'] = settings['db_host']
+    target['db_port'] = settings['db_port']
+
+
+def bench_offline(results, path, file_format, vehicles):
+    labels = {'format': file_format, 'vehicles': vehicles}
+    df, error = measure(results, 'load_data', vehicles, lambda: load_data(upload_file(path)), **labels)
+    if error:
+        raise RuntimeError(error)
+    processed = measure(results, 'process_data_db', vehicles, lambda: process_data_db(df), **labels)
+    del df
+    measure(results, 'load_aggregated_data', vehicles, lambda: load_aggregated_data(upload_file(path)), **labels)
+    return processed
+
+
+def bench_database(results, settings, processed, path, file_format, vehicles, section, label):
+    labels = {'format': file_format, 'vehicles': vehicles}
+    rows = len(processed)
+    start_date, end_date = processed['Data 15min'].min(), processed['Data 15min'].max()
+    start_date, end_date = f"{start_date:%Y-%m-%d}", f"{end_date:%Y-%m-%d}"
+
+    with app.test_request_context():
+        login(session, settings)
+        measure(results, 'update_database (konflikty)', rows, lambda: update_database(processed), **labels)
+        measure(results, 'update_database_with_confirmation', rows,
+                lambda: update_database_with_confirmation(processed, overwrite_request=False), **labels)
+        measure(results, 'update_database_with_confirmation (nadpis.)', rows,
+                lambda: update_database_with_confirmation(processed, overwrite_request=True), **labels)
+        measure(results, 'fetch_data_from_db', rows,
+                lambda: fetch_data_from_db(start_date, end_date, section), **labels)
+        measure(results, 'fetch_period_profiles', rows,
+                lambda: fetch_period_profiles([('Okres 1', start_date, end_date)], [section], 'both'),
+                **labels)
+
+    client = app.test_client()
+    with client.session_transaction() as client_session:
+        login(client_session, settings)
+
+    def post_upload():
+        with open(path, 'rb') as file:
+            response = client.post('/upload', data={'file': (file, os.path.basename(path))},
+                                   content_type='multipart/form-data')
+        return response.get_json()
+
+    # Dane są już w bazie, więc /upload kończy się prośbą o potwierdzenie nadpisania
+    measure(results, 'POST /upload', vehicles, post_upload, **labels)
+
+    form = {'start_date_1': start_date, 'end_date_1': end_date, 'car_type': 'both', 'section_number': label}
+    for sql_aggregation in (True, False):
+        wykres.PLOT_SQL_AGGREGATION = sql_aggregation
+        plot_cache.clear()
+        stage = f"POST /plot ({'SQL' if sql_aggregation else 'pandas'})"
+        measure(results, stage, rows, lambda: client.post('/plot', data=form).get_json(), **labels)
+    wykres.PLOT_SQL_AGGREGATION = True
+    measure(results, 'POST /plot (pamięć podręczna)', rows, lambda: client.post('/plot', data=form).get_json(),
+            **labels)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(RESULTS_DIR)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    previous = {(r['stage'], r.get('format'), r.get('vehicles')): r for r in baseline['results']}
+    print(f"\nPorównanie z {baseline_path} (commit {baseline.get('commit')}):")
+    for result in results:
+        old = previous.get((result['stage'], result.get('format'), result.get('vehicles')))
+        if old and old['seconds']:
+            print(f"{result['stage']:<34} {result.get('format', ''):>5} {result['vehicles']:>10} "
+                  f"{result['seconds'] / old['seconds']:>7.2f}x czasu {result['peak_rss_mib'] - old['peak_rss_mib']:>+8.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pomiar wydajności całej ścieżki danych.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="liczby pojazdów w pliku")
+    parser.add_argument('--formats', nargs='+', choices=['csv', 'xlsx'], default=DEFAULT_FORMATS)
+    parser.add_argument('--days', type=int, default=7, help="liczba dni pomiaru w pliku")
+    parser.add_argument('--throwaway', action='store_true', help="utwórz i usuń jednorazową bazę danych")
+    parser.add_argument('--output', help="plik wynikowy JSON (domyślnie benchmarks/results/)")
+    parser.add_argument('--compare', help="plik JSON z wcześniejszymi wynikami do porównania")
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    settings = database_settings()
+    if args.throwaway:
+        settings['db_name'] = create_throwaway_database(settings)
+    use_database = bool(settings['db_name'])
+
+    # Odcinek z arkusza referencyjnego, aby /plot mógł przetłumaczyć etykietę na numer odcinka
+    reference = load_reference_data(resource_path_mr_number_info())
+    section, info = next(iter(reference.by_id.items()))
+    label = format_section_label(section, info)
+
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            for vehicles in args.sizes:
+                for file_format in args.formats:
+                    if file_format == 'xlsx' and vehicles > XLSX_MAX_ROWS:
+                        print(f"pominięto xlsx dla {vehicles} pojazdów (limit arkusza)")
+                        continue
+                    # Każdy rozmiar trafia na osobny miesiąc, aby zapis nie nakładał się na poprzednie dane
+                    start = pd.Timestamp('2024-01-01') + pd.DateOffset(months=len(results) % 120)
+                    path = generate_file(os.path.join(directory, f"{vehicles}_{file_format}"), vehicles, file_format,
+                                         section=section, start=start, days=args.days)
+                    processed = bench_offline(results, path, file_format, vehicles)
+                    if use_database:
+                        bench_database(results, settings, processed, path, file_format, vehicles, section, label)
+    finally:
+        if args.throwaway:
+            drop_throwaway_database(settings)
+
+    report = {
+        'commit': git_commit(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'database': use_database,
+        'parameters': {'sizes': args.sizes, 'formats': args.formats, 'days': args.days},
+        'results': results,
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"e2e-{report['commit'] or 'nocommit'}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as output_file:
+        json.dump(report, output_file, indent=2, ensure_ascii=False)
+    print(f"\nWyniki zapisano w {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Porównanie zapisu do tabeli pojazdy: pojedyncze INSERT-y kontra COPY + INSERT ... SELECT.
+
+Uruchomienie (z katalogu nadrzędnego repozytorium, na jednorazowej bazie danych):
+    BENCH_DB_NAME=bench BENCH_DB_USER=postgres BENCH_DB_PASSWORD=... python -m Inz.benchmarks.bench_ingest
+"""
+import os
+import time
+import numpy as np
+import pandas as pd
+from flask import session
+from Inz.wykres import app, cipher, connect_db, update_database, update_database_with_confirmation, POJAZDY_COLUMNS, \
+    POJAZDY_HISTOGRAM_COLUMNS
+
+ROW_COUNTS = [100, 1_000, 10_000]
+
+
+def make_aggregated_frame(rows, section):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'Data 15min': pd.date_range('2024-01-01', periods=rows, freq='15min'),
+                       'Numer odcinka': section})
+    for column in list(POJAZDY_COLUMNS)[2:]:
+        if column in POJAZDY_HISTOGRAM_COLUMNS:
+            # Poprawne literały tablic PostgreSQL, jak z finalize_aggregates
+            df[column] = ['{' + ','.join(map(str, counts)) + '}' for counts in rng.integers(0, 20, (rows, 30)).tolist()]
+        elif column.startswith('Liczba'):
+            df[column] = rng.integers(0, 200, rows)
+        else:
+            df[column] = rng.uniform(0, 500, rows).round(1)
+    return df
+
+
+def login():
+    session['db_name'] = os.environ['BENCH_DB_NAME']
+    session['db_user'] = os.getenv('BENCH_DB_USER', 'postgres')
+    session['db_password'] = cipher.encrypt(os.getenv('BENCH_DB_PASSWORD', '').encode()).decode()
+    session['db_host'] = os.getenv('BENCH_DB_HOST', 'localhost')
+    session['db_port'] = os.getenv('BENCH_DB_PORT', '5432')
+
+
+def delete_section(section):
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM pojazdy WHERE numer_odcinka = %s", (section,))
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def main():
+    with app.test_request_context():
+        login()
+        # Pierwsze połączenie wykonuje migracje schematu (tabela pojazdy)
+        update_database(make_aggregated_frame(1, 'BENCH_INIT'))
+
+        print(f"{'wiersze':>8} {'tryb':>8} {'nadpisanie':>10} {'czas [s]':>10} {'wiersze/s':>12}")
+        for rows in ROW_COUNTS:
+            for bulk in (False, True):
+                section = f"BENCH_{rows}_{'COPY' if bulk else 'INSERT'}"
+                df = make_aggregated_frame(rows, section)
+                for overwrite in (False, True):
+                    start = time.perf_counter()
+                    update_database_with_confirmation(df, overwrite_request=overwrite, bulk=bulk)
+                    elapsed = time.perf_counter() - start
+                    print(f"{rows:>8} {'COPY' if bulk else 'INSERT':>8} {str(overwrite):>10} "
+                          f"{elapsed:>10.3f} {rows / elapsed:>12.0f}")
+                delete_section(section)
+
+
+if __name__ == '__main__':
+    main()
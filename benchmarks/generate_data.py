@@ -0,0 +1,104 @@
+"""Generator syntetycznych plików *_POJAZDY.xlsx / *_POJAZDY.csv w formacie przyjmowanym przez /upload.
+
+Natężenie ruchu zmienia się w ciągu doby (szczyty poranny i popołudniowy, mniejszy ruch w weekendy),
+a prędkość, długość i odstęp między pojazdami zależą od kategorii (H - ciężkie, L - lekkie).
+Uruchomienie (z katalogu nadrzędnego repozytorium):
+    python -m Inz.benchmarks.generate_data --vehicles 500000 --format csv --output /tmp/pojazdy
+"""
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+DEFAULT_SECTION = '114_A_1_145'
+HEADWAY_COLUMN = 'Przestrzeń między poprzedzającym pojazdem w dziesiętnych częściach sekundy'
+# Maksymalna liczba wierszy arkusza Excel (bez nagłówka)
+XLSX_MAX_ROWS = 1_048_575
+
+# Względne natężenie ruchu w kolejnych godzinach doby
+HOURLY_PROFILE = np.array([0.2, 0.12, 0.1, 0.1, 0.2, 0.5, 1.2, 1.9, 1.8, 1.3, 1.1, 1.1,
+                           1.2, 1.2, 1.3, 1.6, 1.9, 1.8, 1.4, 1.0, 0.8, 0.6, 0.45, 0.3])
+WEEKEND_FACTOR = 0.6
+
+
+def generate_vehicles(vehicles, start='2025-01-01', days=1, lanes=2, heavy_share=0.2, wrong_way_rate=0.001,
+                      seed=0):
+    """Zwraca ramkę pojazdów z kolumnami pliku źródłowego, posortowaną po czasie przejazdu."""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp(start).normalize()
+
+    # Losowanie godziny przejazdu z wagami zależnymi od pory dnia i dnia tygodnia
+    hours = pd.date_range(start, periods=days * 24, freq='h')
+    weights = HOURLY_PROFILE[hours.hour] * np.where(hours.dayofweek >= 5, WEEKEND_FACTOR, 1.0)
+    hour_index = np.sort(rng.choice(len(hours), size=vehicles, p=weights / weights.sum()))
+    seconds = hour_index * 3600 + rng.integers(0, 3600, vehicles)
+    seconds.sort()
+
+    heavy = rng.random(vehicles) < heavy_share
+    # Pojazdy ciężkie częściej jadą prawym pasem (1)
+    lane_weights = np.linspace(1.5, 1.0, lanes)
+    lane = rng.choice(np.arange(1, lanes + 1), size=vehicles, p=lane_weights / lane_weights.sum())
+    lane[heavy & (rng.random(vehicles) < 0.8)] = 1
+
+    speed = np.where(heavy, rng.normal(82, 7, vehicles), rng.normal(112, 16, vehicles))
+    length = np.where(heavy, rng.uniform(800, 1800, vehicles), rng.normal(450, 40, vehicles))
+    headway = rng.exponential(np.where(heavy, 45, 25), vehicles) + 5
+
+    return pd.DataFrame({
+        'Id': np.arange(1, vehicles + 1),
+        'Data': start + pd.to_timedelta(seconds, unit='s'),
+        'Kategoria': np.where(heavy, 'H', 'L'),
+        'Pas ruchu': lane,
+        'Prędkość': np.clip(speed, 5, 220).round().astype(int),
+        HEADWAY_COLUMN: headway.round().astype(int),
+        'Długość pojazdu w cm': np.clip(length, 250, 2500).round().astype(int),
+        'Kierunek pod prąd': (rng.random(vehicles) < wrong_way_rate).astype(int),
+    })
+
+
+def file_name(section, start, file_format):
+    return f"{section}_{pd.Timestamp(start):%Y-%m-%d}_POJAZDY.{file_format}"
+
+
+def write_vehicles(df, path):
+    """Zapisuje pojazdy do pliku .csv lub .xlsx (format wynika z rozszerzenia)."""
+    if path.endswith('.csv'):
+        df.to_csv(path, index=False, date_format='%Y-%m-%d %H:%M:%S')
+    elif path.endswith('.xlsx'):
+        if len(df) > XLSX_MAX_ROWS:
+            raise ValueError(f"Arkusz Excel mieści najwyżej {XLSX_MAX_ROWS} pojazdów.")
+        out = df.assign(Data=df['Data'].dt.strftime('%Y-%m-%d %H:%M:%S'))
+        out.to_excel(path, index=False)
+    else:
+        raise ValueError(f"Nieobsługiwany format pliku: {path}")
+    return path
+
+
+def generate_file(directory, vehicles, file_format='csv', section=DEFAULT_SECTION, start='2025-01-01', **options):
+    os.makedirs(directory, exist_ok=True)
+    df = generate_vehicles(vehicles, start=start, **options)
+    return write_vehicles(df, os.path.join(directory, file_name(section, start, file_format)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generuje syntetyczne pliki z danymi pojazdów.")
+    parser.add_argument('--vehicles', type=int, default=100_000, help="liczba pojazdów w pliku")
+    parser.add_argument('--format', choices=['csv', 'xlsx'], default='csv')
+    parser.add_argument('--output', default='.', help="katalog docelowy")
+    parser.add_argument('--section', default=DEFAULT_SECTION, help="numer odcinka w nazwie pliku")
+    parser.add_argument('--start', default='2025-01-01', help="pierwszy dzień pomiaru (RRRR-MM-DD)")
+    parser.add_argument('--days', type=int, default=1)
+    parser.add_argument('--lanes', type=int, default=2)
+    parser.add_argument('--heavy-share', type=float, default=0.2, help="udział pojazdów kategorii H")
+    parser.add_argument('--wrong-way-rate', type=float, default=0.001, help="udział pojazdów jadących pod prąd")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    path = generate_file(args.output, args.vehicles, args.format, section=args.section, start=args.start,
+                         days=args.days, lanes=args.lanes, heavy_share=args.heavy_share,
+                         wrong_way_rate=args.wrong_way_rate, seed=args.seed)
+    print(path)
+
+
+if __name__ == '__main__':
+    main()
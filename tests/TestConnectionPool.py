@@ -0,0 +1,188 @@
+import unittest
+from unittest.mock import patch, MagicMock
+from flask import session, g
+from datetime import datetime
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INERROR
+from psycopg2.pool import PoolError
+from Inz.wykres import ConnectionPool, connect_db, cipher, app, migrate_schema, ensure_pojazdy_partitions, \
+    _migrate_partitioned_pojazdy, get_pool
+
+
+def make_connection():
+    conn = MagicMock()
+    conn.closed = 0
+    conn.get_transaction_status.return_value = TRANSACTION_STATUS_IDLE
+    return conn
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    @patch("Inz.wykres.psycopg2.connect")
+    def test_connection_is_reused(self, mock_connect):
+        mock_connect.side_effect = lambda **kwargs: make_connection()
+        pool = ConnectionPool({'dbname': 'test_db'}, max_size=2)
+
+        conn = pool.getconn()
+        pool.putconn(conn)
+        # Drugie wypożyczenie powinno zwrócić to samo połączenie bez ponownego łączenia
+        self.assertIs(pool.getconn(), conn)
+        mock_connect.assert_called_once_with(dbname='test_db')
+
+    @patch("Inz.wykres.psycopg2.connect")
+    def test_pool_is_bounded(self, mock_connect):
+        mock_connect.side_effect = lambda **kwargs: make_connection()
+        pool = ConnectionPool({'dbname': 'test_db'}, max_size=1, checkout_timeout=0.01)
+
+        pool.getconn()
+        with self.assertRaises(PoolError):
+            pool.getconn()
+
+    @patch("Inz.wykres.psycopg2.connect")
+    def test_failed_transaction_is_rolled_back(self, mock_connect):
+        conn = make_connection()
+        conn.get_transaction_status.return_value = TRANSACTION_STATUS_INERROR
+        mock_connect.return_value = conn
+        pool = ConnectionPool({'dbname': 'test_db'})
+
+        pool.putconn(pool.getconn())
+        conn.rollback.assert_called_once()
+
+    @patch("Inz.wykres.psycopg2.connect")
+    def test_idle_connections_are_evicted(self, mock_connect):
+        first, second = make_connection(), make_connection()
+        mock_connect.side_effect = [first, second]
+        pool = ConnectionPool({'dbname': 'test_db'}, idle_timeout=-1)
+
+        pool.putconn(pool.getconn())
+        self.assertIs(pool.getconn(), second)
+        first.close.assert_called_once()
+
+    @patch("Inz.wykres.psycopg2.connect")
+    def test_dead_connection_is_replaced(self, mock_connect):
+        dead, fresh = make_connection(), make_connection()
+        dead.cursor.return_value.__enter__.return_value.execute.side_effect = \
+            psycopg2.OperationalError("server closed the connection")
+        mock_connect.side_effect = [dead, fresh]
+        pool = ConnectionPool({'dbname': 'test_db'}, healthcheck_after=-1)
+
+        pool.putconn(pool.getconn())
+        self.assertIs(pool.getconn(), fresh)
+
+
+class TestConnectDbRequestScope(unittest.TestCase):
+
+    @patch("Inz.wykres.migrate_schema")
+    @patch("Inz.wykres.psycopg2.connect")
+    def test_one_connection_per_request(self, mock_connect, mock_migrate):
+        conn = make_connection()
+        mock_connect.return_value = conn
+        with app.test_request_context():
+            session['db_name'] = "pool_db"
+            session['db_user'] = "pool_user"
+            session['db_password'] = cipher.encrypt(b"pool_password").decode()
+            session['db_host'] = "localhost"
+            session['db_port'] = "5432"
+
+            first = connect_db()
+            first.close()
+            second = connect_db()
+
+            # Funkcje pomocnicze w obrębie żądania dzielą jedno połączenie
+            self.assertIs(first, second)
+            mock_connect.assert_called_once()
+        # Po zakończeniu żądania połączenie wraca do puli, a nie jest zamykane
+        conn.close.assert_not_called()
+
+
+class TestSchemaMigrations(unittest.TestCase):
+
+    def test_pending_migrations_are_applied_in_order(self):
+        conn = make_connection()
+        cursor = conn.cursor.return_value.__enter__.return_value
+        # brak wersji, brak tabeli pojazdy, brak obu tabel agregatów
+        cursor.fetchone.side_effect = [(0,), None, (False,), (False,)]
+
+        self.assertEqual(migrate_schema(conn), 5)
+        sql = [call[0][0] for call in cursor.execute.call_args_list]
+        self.assertTrue(any("PARTITION BY RANGE (data_15min)" in query for query in sql))
+        self.assertTrue(any("PRIMARY KEY (numer_odcinka, data_15min)" in query for query in sql))
+        self.assertTrue(any("USING brin (data_15min)" in query for query in sql))
+        self.assertTrue(any("ADD COLUMN IF NOT EXISTS histogram_predkosci_h_pas_1 INTEGER[]" in query for query in sql))
+        self.assertTrue(any("ALTER TABLE IF EXISTS temp_data" in query for query in sql))
+        self.assertTrue(any("CREATE TABLE IF NOT EXISTS pojazdy_godzinowe" in query for query in sql))
+        self.assertTrue(any("INSERT INTO pojazdy_dzienne" in query for query in sql))
+        versions = [call[0][1][0] for call in cursor.execute.call_args_list if "INSERT INTO schema_version" in call[0][0]]
+        self.assertEqual(versions, [1, 2, 3, 4, 5])
+        conn.commit.assert_called_once()
+
+    def test_legacy_table_is_moved_to_partitions(self):
+        conn = make_connection()
+        cursor = conn.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = ('r',)
+        cursor.fetchall.side_effect = [[(datetime(2025, 1, 1),), (datetime(2025, 2, 1),)], []]
+
+        _migrate_partitioned_pojazdy(cursor)
+
+        sql = [call[0][0] for call in cursor.execute.call_args_list]
+        self.assertIn("ALTER TABLE pojazdy RENAME TO pojazdy_legacy", sql[1])
+        self.assertTrue(any("pojazdy_2025_01 PARTITION OF pojazdy" in query for query in sql))
+        self.assertTrue(any("pojazdy_2025_02 PARTITION OF pojazdy" in query for query in sql))
+        self.assertTrue(any("FROM pojazdy_legacy" in query and "INSERT INTO pojazdy" in query for query in sql))
+        self.assertEqual(sql[-1], "DROP TABLE pojazdy_legacy")
+
+    def test_up_to_date_schema_is_left_alone(self):
+        conn = make_connection()
+        cursor = conn.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = (5,)
+
+        migrate_schema(conn)
+        self.assertFalse(any("INSERT INTO schema_version" in call[0][0] for call in cursor.execute.call_args_list))
+
+    @patch("Inz.wykres.migrate_schema")
+    @patch("Inz.wykres.psycopg2.connect")
+    def test_migrations_run_once_per_database(self, mock_connect, mock_migrate):
+        mock_connect.side_effect = lambda **kwargs: make_connection()
+        with app.app_context():
+            g.db_credentials = ("migrations_db", "user", cipher.encrypt(b"secret").decode(), "localhost", "5432")
+            connect_db()
+        with app.app_context():
+            g.db_credentials = ("migrations_db", "user", cipher.encrypt(b"secret").decode(), "localhost", "5432")
+            connect_db()
+        mock_migrate.assert_called_once()
+
+    @patch("Inz.wykres.migrate_schema", side_effect=psycopg2.ProgrammingError("permission denied"))
+    @patch("Inz.wykres.psycopg2.connect")
+    def test_failed_migration_is_not_retried_on_every_connection(self, mock_connect, mock_migrate):
+        mock_connect.side_effect = lambda **kwargs: make_connection()
+        credentials = ("failing_migrations_db", "user", cipher.encrypt(b"secret").decode(), "localhost", "5432")
+        with patch.object(app.logger, "exception") as mock_log:
+            for _ in range(3):
+                with app.app_context():
+                    g.db_credentials = credentials
+                    connect_db()
+            mock_migrate.assert_called_once()
+
+            # Po upływie odstępu migracja jest ponawiana, ale ten sam błąd nie trafia ponownie do logu
+            get_pool(*credentials).schema_retry_at = 0.0
+            with app.app_context():
+                g.db_credentials = credentials
+                connect_db()
+        self.assertEqual(mock_migrate.call_count, 2)
+        mock_log.assert_called_once()
+
+    def test_existing_partitions_are_not_recreated(self):
+        cursor = MagicMock()
+        cursor.fetchall.return_value = [("pojazdy_2025_01",)]
+
+        ensure_pojazdy_partitions(cursor, [datetime(2025, 1, 20, 12), datetime(2025, 3, 1)])
+
+        sql = [call[0] for call in cursor.execute.call_args_list]
+        created = [query for query, *params in sql if "PARTITION OF" in query]
+        self.assertEqual(len(created), 1)
+        self.assertIn("pojazdy_2025_03", created[0])
+        self.assertEqual(sql[-1][1], (datetime(2025, 3, 1), datetime(2025, 4, 1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -19,9 +19,10 @@ class TestDatabaseConnection(unittest.TestCase):
         self.app.config['SESSION_COOKIE_HTTPONLY'] = False
         self.app.config['SESSION_COOKIE_SAMESITE'] = None
 
+    @patch("Inz.wykres.migrate_schema")
     @patch("psycopg2.connect")
     @patch("Inz.wykres.cipher.decrypt", return_value=b"test_password")
-    def test_connect_db_encrypt(self, mock_decrypt, mock_connect):
+    def test_connect_db_encrypt(self, mock_decrypt, mock_connect, mock_migrate):
         with self.app.test_request_context():
             session['db_name'] = "test_db"
             session['db_user'] = "test_user"
@@ -36,7 +37,7 @@ class TestDatabaseConnection(unittest.TestCase):
             conn = connect_db()
 
             # Sprawdzamy, czy połączenie zostało wykonane z odpowiednimi parametrami
-            self.assertEqual(conn, mock_connection)
+            self.assertEqual(conn.raw, mock_connection)
             mock_connect.assert_called_once_with(
                 dbname=session['db_name'],
                 user=session['db_user'],
@@ -0,0 +1,124 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import gzip
+import pandas as pd
+from Inz.wykres import app, csv_row_chunks
+
+
+class TestCsvRowChunks(unittest.TestCase):
+
+    def test_rows_are_split_into_chunks(self):
+        chunks = list(csv_row_chunks(([i, 'x' * 10] for i in range(100)), chunk_bytes=100))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b''.join(chunks).decode().splitlines()[99], '99,' + 'x' * 10)
+
+
+class ExportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        app.config['WTF_CSRF_ENABLED'] = False
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['db_name'] = 'test_db'
+
+    @patch('Inz.wykres.reverse_format_section', return_value=('101', None))
+    @patch('Inz.wykres.fetch_period_profiles')
+    def test_plot_export(self, mock_fetch, mock_reverse):
+        mock_fetch.return_value = (pd.DataFrame({'Okres': [0, 1], 'numer_odcinka': ['101', '101'], 'godzina': [7, 7],
+                                                 'Liczba samochodów': [12.5, 12.5]}), None)
+        query = {'start_date_1': '2025-01-01', 'end_date_1': '2025-01-31', 'start_date_2': '2025-02-01',
+                 'end_date_2': '2025-02-28', 'car_type': 'both', 'section_number': '101 - A1'}
+
+        response = self.client.get('/export/plot.csv', query_string=query)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/csv'))
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(lines[0], 'Okres,Data początkowa,Data końcowa,Czas,Średnia liczba samochodów,'
+                                   'Typ samochodu,Numer MR')
+        self.assertEqual(lines[1:], ['Okres 1,2025-01-01,2025-01-31,07:00:00,12.5,Oba,101',
+                                     'Okres 2,2025-02-01,2025-02-28,07:00:00,12.5,Oba,101'])
+
+    @patch('Inz.wykres.reverse_format_section', return_value=('101', None))
+    @patch('Inz.wykres.fetch_period_profiles',
+           return_value=(pd.DataFrame(columns=['Okres', 'numer_odcinka', 'godzina', 'Liczba samochodów']), None))
+    def test_plot_export_without_data(self, mock_fetch, mock_reverse):
+        response = self.client.get('/export/plot.csv', query_string={
+            'start_date_1': '2025-01-01', 'end_date_1': '2025-01-31', 'car_type': 'both', 'section_number': 'x'})
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('error', response.get_json())
+
+    def make_connection(self, rows):
+        conn = MagicMock()
+        cursor = conn.cursor.return_value.__enter__.return_value
+        cursor.mogrify.return_value = b"SELECT data_15min FROM pojazdy WHERE numer_odcinka = '101'"
+
+        def copy_expert(sql, file):
+            for row in rows:
+                file.write(row)
+
+        cursor.copy_expert.side_effect = copy_expert
+        return conn, cursor
+
+    @patch('Inz.wykres.reverse_format_section', return_value=('101', None))
+    @patch('Inz.wykres.connect_db')
+    def test_raw_export_streams_copy_output(self, mock_connect_db, mock_reverse):
+        rows = [b'data_15min,numer_odcinka\n'] + [f'2025-01-01 00:{i % 60:02d}:00,101\n'.encode()
+                                                   for i in range(1000)]
+        conn, cursor = self.make_connection(rows)
+        mock_connect_db.return_value = conn
+
+        with patch('Inz.wykres.EXPORT_CHUNK_BYTES', 1024):
+            response = self.client.get('/export/pojazdy.csv', query_string={
+                'start_date': '2025-01-01', 'end_date': '2025-01-31', 'section_number': '101 - A1'})
+            self.assertTrue(response.is_streamed)
+            body = response.get_data()
+
+        self.assertEqual(body, b''.join(rows))
+        sql = cursor.copy_expert.call_args[0][0]
+        self.assertTrue(sql.startswith("COPY (SELECT data_15min FROM pojazdy"))
+        self.assertIn("TO STDOUT WITH (FORMAT csv, HEADER)", sql)
+        self.assertEqual(cursor.mogrify.call_args[0][1], ['101', '2025-01-01', '2025-01-31'])
+        conn.commit.assert_called_once()
+        self.assertIn('pojazdy_101_2025-01-01_2025-01-31.csv', response.headers['Content-Disposition'])
+
+    @patch('Inz.wykres.connect_db')
+    def test_raw_export_gzip(self, mock_connect_db):
+        rows = [b'a,b\n', b'1,2\n']
+        conn, cursor = self.make_connection(rows)
+        mock_connect_db.return_value = conn
+        query = {'start_date': '2025-01-01', 'end_date': '2025-01-31'}
+
+        response = self.client.get('/export/pojazdy.csv', query_string=query, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.get_data()), b'a,b\n1,2\n')
+
+        # gzip;q=0 oznacza, że klient nie przyjmuje gzip
+        response = self.client.get('/export/pojazdy.csv', query_string=query,
+                                   headers={'Accept-Encoding': 'br, gzip;q=0'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.get_data(), b'a,b\n1,2\n')
+
+        response = self.client.get('/export/pojazdy.csv', query_string={**query, 'compress': 'gzip'})
+        self.assertEqual(response.content_type, 'application/gzip')
+        self.assertIn('.csv.gz', response.headers['Content-Disposition'])
+        self.assertEqual(gzip.decompress(response.get_data()), b'a,b\n1,2\n')
+
+    @patch('Inz.wykres.connect_db')
+    def test_raw_export_database_error_is_raised(self, mock_connect_db):
+        conn, cursor = self.make_connection([])
+        cursor.copy_expert.side_effect = RuntimeError("błąd COPY")
+        mock_connect_db.return_value = conn
+
+        with self.assertRaises(RuntimeError):
+            self.client.get('/export/pojazdy.csv', query_string={'start_date': '2025-01-01',
+                                                                  'end_date': '2025-01-31'}).get_data()
+        conn.rollback.assert_called()
+
+    def test_raw_export_requires_dates(self):
+        response = self.client.get('/export/pojazdy.csv', query_string={'start_date': '2025-01-01'})
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
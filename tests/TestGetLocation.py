@@ -2,7 +2,7 @@ import unittest
 from unittest.mock import patch, MagicMock
 import pandas as pd
 import json
-from Inz.wykres import app
+from Inz.wykres import app, ReferenceData
 
 
 class TestGetLocationEndpoint(unittest.TestCase):
@@ -34,26 +34,16 @@ class TestGetLocationEndpoint(unittest.TestCase):
         self.assertEqual(data['error'], 'Błąd formatu')
 
     @patch('Inz.wykres.reverse_format_section')
-    @patch('Inz.wykres.pd.read_excel')
-    @patch('Inz.wykres.pd.ExcelFile')
-    def test_location_found(self, mock_excel_file, mock_read_excel, mock_reverse_format):
+    @patch('Inz.wykres.load_reference_data')
+    def test_location_found(self, mock_reference_data, mock_reverse_format):
         """Test, gdy lokalizacja zostanie znaleziona."""
         # Ustawiamy, że reverse_format_section zwraca przetworzony numer
         mock_reverse_format.return_value = ("145", None)
 
-        # Przygotowujemy przykładowy DataFrame symulujący dane z arkusza
-        df_found = pd.DataFrame({
-            'id_mr': ['145'],
-            'n_wgs84': [52.2297],
-            'e_wgs84': [21.0122]
-        })
-        # Upewniamy się, że pd.read_excel zawsze zwraca nasz przykładowy DataFrame
-        mock_read_excel.return_value = df_found
-
-        # Tworzymy fałszywy obiekt ExcelFile z jedną nazwą arkusza
-        fake_excel = MagicMock()
-        fake_excel.sheet_names = ['Sheet1']
-        mock_excel_file.return_value = fake_excel
+        # Przygotowujemy dane referencyjne z jednym punktem MR
+        reference = ReferenceData()
+        reference.add('145', 'A1', '300+430', 'Skoszewy', 52.2297, 21.0122)
+        mock_reference_data.return_value = reference
 
         response = self.client.get('/get_location?section_number=145 (A1, km 300+430, Skoszewy)')
         self.assertEqual(response.status_code, 200)
@@ -65,24 +55,15 @@ class TestGetLocationEndpoint(unittest.TestCase):
         self.assertEqual(data['E_wgs84'], 21.0122)
 
     @patch('Inz.wykres.reverse_format_section')
-    @patch('Inz.wykres.pd.read_excel')
-    @patch('Inz.wykres.pd.ExcelFile')
-    def test_location_not_found(self, mock_excel_file, mock_read_excel, mock_reverse_format):
+    @patch('Inz.wykres.load_reference_data')
+    def test_location_not_found(self, mock_reference_data, mock_reverse_format):
         """Test, gdy lokalizacja dla podanego numeru MR nie zostanie znaleziona."""
         # Ustawiamy, że reverse_format_section zwraca numer, którego nie ma w danych
         mock_reverse_format.return_value = ("999", None)
 
-        # Przygotowujemy DataFrame, w którym nie ma rekordu dla numeru "999"
-        df_no_match = pd.DataFrame({
-            'id_mr': ['145'],
-            'n_wgs84': [52.2297],
-            'e_wgs84': [21.0122]
-        })
-        mock_read_excel.return_value = df_no_match
-
-        fake_excel = MagicMock()
-        fake_excel.sheet_names = ['Sheet1']
-        mock_excel_file.return_value = fake_excel
+        reference = ReferenceData()
+        reference.add('145', 'A1', '300+430', 'Skoszewy', 52.2297, 21.0122)
+        mock_reference_data.return_value = reference
 
         response = self.client.get('/get_location?section_number=999 (A1, km 300+430, Skoszewy)')
         self.assertEqual(response.status_code, 404)
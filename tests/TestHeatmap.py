@@ -0,0 +1,81 @@
+import unittest
+from unittest.mock import patch
+import numpy as np
+from Inz.wykres import fetch_week_heatmap
+from TestPlot import PlotFormRouteTestCase
+
+
+class TestFetchWeekHeatmap(unittest.TestCase):
+
+    @patch('Inz.wykres.connect_db')
+    def test_hourly_matrix_from_rollup(self, mock_connect_db):
+        cursor = mock_connect_db.return_value.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = [True]
+        # dzień (0 - poniedziałek), pole, średnia dla oba, H, L
+        cursor.fetchall.return_value = [(0, 7, 12.25, 2.0, 10.25), (6, 23, 3.0, None, 3.0)]
+
+        matrices, error = fetch_week_heatmap('2025-01-01', '2025-01-31', '101')
+
+        self.assertIsNone(error)
+        self.assertEqual(sorted(matrices), ['H', 'L', 'both'])
+        self.assertEqual(matrices['both'].shape, (7, 24))
+        self.assertEqual(matrices['both'][0, 7], 12.2)
+        self.assertEqual(matrices['L'][6, 23], 3.0)
+        self.assertTrue(np.isnan(matrices['H'][6, 23]))
+        self.assertEqual(np.count_nonzero(~np.isnan(matrices['both'])), 2)
+
+        sql, params = cursor.execute.call_args[0]
+        self.assertIn('pojazdy_godzinowe', sql)
+        self.assertIn('isodow', sql)
+        self.assertIn('liczba_samochodow_h', sql)
+        self.assertEqual(params, ['101', '2025-01-01', '2025-01-31', 60])
+
+    @patch('Inz.wykres.connect_db')
+    def test_quarter_hour_matrix_reads_raw_rows(self, mock_connect_db):
+        cursor = mock_connect_db.return_value.cursor.return_value.__enter__.return_value
+        cursor.fetchall.return_value = [(2, 95, 1.0, 0.0, 1.0)]
+
+        matrices, error = fetch_week_heatmap(None, None, '101', resolution=15)
+
+        self.assertEqual(matrices['both'].shape, (7, 96))
+        self.assertEqual(matrices['both'][2, 95], 1.0)
+        # Tabela agregatów godzinowych nie jest sprawdzana
+        self.assertEqual(cursor.execute.call_count, 1)
+        sql, params = cursor.execute.call_args[0]
+        self.assertIn('FROM pojazdy', sql)
+        self.assertNotIn("date_trunc('hour'", sql)
+        self.assertEqual(params, ['101', 15])
+
+    @patch('Inz.wykres.connect_db')
+    def test_no_data(self, mock_connect_db):
+        cursor = mock_connect_db.return_value.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = [False]
+        cursor.fetchall.return_value = []
+        self.assertEqual(fetch_week_heatmap('2025-01-01', '2025-01-31', '101'), (None, None))
+
+
+class TestHeatmapRoute(PlotFormRouteTestCase):
+
+    @patch('Inz.wykres.fetch_week_heatmap')
+    def test_heatmap_payload_is_cached(self, mock_fetch):
+        matrix = np.full((7, 24), np.nan)
+        matrix[1, 8] = 4.5
+        mock_fetch.return_value = ({'both': matrix, 'H': matrix, 'L': matrix}, None)
+
+        heatmap = self.client.post('/plot/heatmap', data=self.form).get_json()['heatmap']
+        self.client.post('/plot/heatmap', data=self.form)
+
+        mock_fetch.assert_called_once_with('2025-01-01', '2025-01-31', '101', 60)
+        self.assertEqual(len(heatmap['x']), 24)
+        self.assertEqual(heatmap['x'][8], '08:00')
+        self.assertEqual(heatmap['y'][0], 'Poniedziałek')
+        self.assertEqual(heatmap['z']['H'][1][8], 4.5)
+        self.assertIsNone(heatmap['z']['H'][0][0])
+
+    def test_invalid_resolution(self):
+        response = self.client.post('/plot/heatmap', data={**self.form, 'resolution': '30'})
+        self.assertIn('rozdzielczość', response.get_json()['error'])
+
+
+if __name__ == '__main__':
+    unittest.main()
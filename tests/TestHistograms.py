@@ -0,0 +1,128 @@
+import unittest
+from unittest.mock import patch
+import numpy as np
+import pandas as pd
+from Inz.wykres import histogram_counts, histogram_percentiles, aggregate_partial, \
+    finalize_aggregates, _array_literals, fetch_histogram, SPEED_HISTOGRAM_EDGES, SPEED_COLUMN, LENGTH_COLUMN, HEADWAY_COLUMN, \
+    WRONG_WAY_COLUMN
+from TestPlot import PlotFormRouteTestCase
+
+
+def vehicles(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'Data': pd.Timestamp('2025-01-01') + pd.to_timedelta(rng.integers(0, 4 * 3600, n), unit='s'),
+        'Numer odcinka': '101',
+        'Pas ruchu': rng.integers(1, 3, n),
+        'Kategoria': rng.choice(['H', 'L'], n),
+        SPEED_COLUMN: rng.normal(90, 20, n).round(),
+        LENGTH_COLUMN: rng.normal(500, 300, n).round(),
+        HEADWAY_COLUMN: rng.integers(1, 100, n),
+        WRONG_WAY_COLUMN: rng.integers(0, 2, n),
+    })
+
+
+class TestHistogramCounts(unittest.TestCase):
+
+    def test_matches_naive_counting(self):
+        rng = np.random.default_rng(1)
+        values = rng.uniform(-10, 300, 2000)
+        values[::50] = np.nan
+        group_ids = rng.integers(0, 3, 2000)
+
+        counts = histogram_counts(values, SPEED_HISTOGRAM_EDGES, group_ids, 3)
+
+        for group in range(3):
+            # Wartości spoza zakresu trafiają do skrajnych przedziałów
+            clipped = np.clip(values[(group_ids == group) & ~np.isnan(values)], 0, SPEED_HISTOGRAM_EDGES[-1] - 1)
+            expected, _ = np.histogram(clipped, SPEED_HISTOGRAM_EDGES)
+            self.assertEqual(counts[group].tolist(), expected.tolist())
+
+    def test_chunks_merge_like_whole_file(self):
+        df = vehicles(3000)
+        whole = finalize_aggregates(aggregate_partial(df))
+        merged = finalize_aggregates([aggregate_partial(df.iloc[:1000]), aggregate_partial(df.iloc[1000:])])
+        pd.testing.assert_frame_equal(merged, whole)
+
+        histogram = whole['Histogram prędkości L Pas 1'].iloc[0]
+        self.assertTrue(histogram.startswith('{') and histogram.endswith('}'))
+        # Suma przedziałów równa liczbie pojazdów z prędkością
+        self.assertEqual(sum(map(int, histogram[1:-1].split(','))), whole['Liczba samochodów L Pas 1'].iloc[0])
+
+
+class TestArrayLiterals(unittest.TestCase):
+
+    def test_matches_joining_rows(self):
+        rng = np.random.default_rng(3)
+        counts = rng.poisson(2, (200, 12)) * rng.choice([1, 10, 1000, 123457], (200, 1))
+        counts[::3, 5:] = 0
+        counts[::7] = 0
+
+        expected = []
+        for row in counts.tolist():
+            while row and row[-1] == 0:
+                row.pop()
+            expected.append('{' + ','.join(map(str, row)) + '}' if row else None)
+        self.assertEqual(_array_literals(counts), expected)
+        self.assertEqual(_array_literals(np.array([[0, 7, 0], [0, 0, 0]])), ['{0,7}', None])
+        self.assertEqual(_array_literals(np.zeros((0, 3), dtype=np.int64)), [])
+
+
+class TestHistogramPercentiles(unittest.TestCase):
+
+    def test_within_one_bin_of_exact(self):
+        values = np.random.default_rng(2).normal(95, 15, 50000)
+        counts, _ = np.histogram(values, SPEED_HISTOGRAM_EDGES)
+        for p, estimate in zip((15, 50, 85), histogram_percentiles(counts, SPEED_HISTOGRAM_EDGES, (15, 50, 85))):
+            self.assertLess(abs(estimate - np.percentile(values, p)), 5)
+
+    def test_interpolation_and_empty(self):
+        edges = np.array([0, 10, 20, 30])
+        self.assertEqual(histogram_percentiles([0, 4, 4], edges, [0, 50, 75, 100]), [10.0, 20.0, 25.0, 30.0])
+        self.assertEqual(histogram_percentiles([0, 0, 0], edges, [85]), [None])
+
+
+class TestFetchHistogram(unittest.TestCase):
+
+    @patch('Inz.wykres.connect_db')
+    def test_sums_columns_in_sql(self, mock_connect_db):
+        cursor = mock_connect_db.return_value.cursor.return_value.__enter__.return_value
+        cursor.fetchall.return_value = [(1, 3), (18, 7)]
+
+        counts, error = fetch_histogram('speed', '2025-01-01', '2025-01-31', '101', lanes=(1,), categories=('H', 'L'))
+
+        self.assertIsNone(error)
+        self.assertEqual(len(counts), len(SPEED_HISTOGRAM_EDGES) - 1)
+        self.assertEqual((counts[0], counts[17], counts.sum()), (3, 7, 10))
+        sql, params = cursor.execute.call_args[0]
+        self.assertIn('unnest(p.histogram_predkosci_h_pas_1, p.histogram_predkosci_l_pas_1) WITH ORDINALITY', sql)
+        self.assertNotIn('pas_2', sql)
+        self.assertEqual(params, ['101', '2025-01-01', '2025-01-31'])
+
+
+class TestPercentilesRoute(PlotFormRouteTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.form['car_type'] = 'L'
+
+    @patch('Inz.wykres.fetch_histogram')
+    def test_v85_is_cached(self, mock_fetch):
+        counts = np.zeros(len(SPEED_HISTOGRAM_EDGES) - 1, dtype=np.int64)
+        counts[[17, 18]] = [85, 15]
+        mock_fetch.return_value = (counts, None)
+
+        histogram = self.client.post('/plot/percentiles', data={**self.form, 'lane': '2'}).get_json()['histogram']
+        self.client.post('/plot/percentiles', data={**self.form, 'lane': '2'})
+
+        mock_fetch.assert_called_once_with('speed', '2025-01-01', '2025-01-31', '101', (2,), ('L',))
+        self.assertEqual(histogram['count'], 100)
+        self.assertEqual(histogram['percentiles'], [{'p': 85.0, 'value': 90.0}])
+
+    def test_invalid_parameters(self):
+        for field in ({'measure': 'headway'}, {'lane': '3'}, {'p': '101'}, {'p': 'x'}):
+            self.assertIn('error', self.client.post('/plot/percentiles', data={**self.form, **field}).get_json())
+
+
+if __name__ == '__main__':
+    unittest.main()
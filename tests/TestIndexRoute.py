@@ -10,11 +10,12 @@ class TestIndexRoute(unittest.TestCase):
         # Zamockowanie funkcji connect_db, by nie wykonywała rzeczywistego połączenia z bazą danych
         mock_connect_db.return_value = None
 
-        # Mockowanie zmiennej DATABASE_NAME, aby testować różne przypadki
-        with patch('Inz.wykres.DATABASE_NAME', 'test_db'):
+        # Nazwa bazy danych pochodzi z sesji, aby testować różne przypadki
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess['db_name'] = 'test_db'
             # Symulowanie żądania GET do aplikacji
-            with app.test_client() as client:
-                response = client.get('/')  # Wysłanie zapytania GET na stronę główną
+            response = client.get('/')  # Wysłanie zapytania GET na stronę główną
 
             # Sprawdzanie, czy odpowiedź ma kod statusu 200 (OK)
             self.assertEqual(response.status_code, 200)
@@ -22,11 +23,13 @@ class TestIndexRoute(unittest.TestCase):
             # Sprawdzanie, czy odpowiedź zawiera oczekiwany komunikat z nazwą bazy danych
             self.assertIn("Obecnie używana baza danych: test_db", response.data.decode())
 
-        # Testowanie przypadku, gdy DATABASE_NAME jest pusty
-        with patch('Inz.wykres.DATABASE_NAME', None):
-            with app.test_client() as client:
-                response = client.get('/')  # Wysłanie zapytania GET na stronę główną
+        # Testowanie przypadku, gdy w sesji nie ma nazwy bazy danych
+        with app.test_client() as client:
+            response = client.get('/')  # Wysłanie zapytania GET na stronę główną
 
-            # Sprawdzamy, czy odpowiedź zawiera komunikat o braku przypisanej bazy danych
-            self.assertEqual(response.status_code, 200)
-            self.assertIn("Baza danych nie jest przypisana", response.data.decode())
+        # Sprawdzamy, czy odpowiedź zawiera komunikat o braku przypisanej bazy danych
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Baza danych nie jest przypisana", response.data.decode())
+
+        # Wyświetlenie strony głównej nie powinno otwierać połączenia z bazą
+        mock_connect_db.assert_not_called()
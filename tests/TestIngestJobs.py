@@ -0,0 +1,157 @@
+import unittest
+from unittest.mock import patch, MagicMock
+from io import BytesIO
+import tempfile
+import pandas as pd
+from Inz.wykres import app, ParseCache, IngestJob, _jobs, _purge_jobs
+
+
+class ImmediateExecutor:
+    """Wykonuje zadania od razu, aby testy nie zależały od wątków."""
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+class IngestJobTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = app
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.client = self.app.test_client()
+
+        executor = patch('Inz.wykres.get_job_executor', return_value=ImmediateExecutor())
+        spool_dir = patch('Inz.wykres.JOB_SPOOL_DIR', tempfile.mkdtemp())
+        # Wyniki z zamockowanego wczytywania nie mogą trafić do wspólnej pamięci podręcznej
+        cache = patch('Inz.wykres.parse_cache', ParseCache(None))
+        executor.start()
+        spool_dir.start()
+        cache.start()
+        self.addCleanup(executor.stop)
+        self.addCleanup(spool_dir.stop)
+        self.addCleanup(cache.stop)
+
+        self.set_session(self.client)
+
+    @staticmethod
+    def set_session(client, db_name='test_db'):
+        with client.session_transaction() as sess:
+            sess['db_name'] = db_name
+            sess['db_user'] = 'user'
+            sess['db_password'] = 'secret'
+            sess['db_host'] = 'localhost'
+            sess['db_port'] = '5432'
+
+    def submit(self, file_name='MR_123_2024-01-01_POJAZDY.xlsx'):
+        data = {'file': (BytesIO(b'file_data'), file_name)}
+        return self.client.post('/jobs', data=data, content_type='multipart/form-data')
+
+    @patch('Inz.wykres.update_database_with_confirmation')
+    @patch('Inz.wykres.update_database', return_value=[])
+    @patch('Inz.wykres.process_data_db')
+    @patch('Inz.wykres.load_data')
+    def test_job_completes(self, mock_load_data, mock_process_data, mock_update_db, mock_write):
+        mock_load_data.return_value = (pd.DataFrame({'Id': range(5)}), None)
+        mock_process_data.return_value = pd.DataFrame({'a': range(2)})
+
+        response = self.submit()
+        self.assertEqual(response.status_code, 202)
+        job_id = response.get_json()['job_id']
+
+        job = self.client.get(f'/jobs/{job_id}').get_json()
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['vehicles'], 5)
+        self.assertEqual(job['rows'], 2)
+        self.assertIn('agregacja', job['stages'])
+        mock_write.assert_called_once()
+
+    @patch('Inz.wykres.update_database_with_confirmation')
+    @patch('Inz.wykres.get_data_from_db')
+    @patch('Inz.wykres.save_data_to_db', return_value='temp-1')
+    @patch('Inz.wykres.create_temp_data_table')
+    @patch('Inz.wykres.update_database')
+    @patch('Inz.wykres.process_data_db')
+    @patch('Inz.wykres.load_data')
+    def test_job_awaits_confirmation(self, mock_load_data, mock_process_data, mock_update_db,
+                                     mock_create_temp, mock_save, mock_get_temp, mock_write):
+        mock_load_data.return_value = (pd.DataFrame({'Id': range(5)}), None)
+        mock_process_data.return_value = pd.DataFrame({'a': range(2)})
+        mock_update_db.return_value = [('2024-01-01 00:00:00', '123')]
+        mock_get_temp.return_value = pd.DataFrame({'a': range(2)})
+
+        job_id = self.submit().get_json()['job_id']
+        job = self.client.get(f'/jobs/{job_id}').get_json()
+        self.assertEqual(job['status'], 'awaiting_confirmation')
+        self.assertTrue(job['requires_confirmation'])
+        self.assertEqual(job['temp_id'], 'temp-1')
+        mock_write.assert_not_called()
+
+        response = self.client.post(f'/jobs/{job_id}/confirm', json={'overwrite_request': True})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.client.get(f'/jobs/{job_id}').get_json()['status'], 'done')
+        mock_get_temp.assert_called_once_with('temp-1')
+        self.assertTrue(mock_write.call_args.kwargs['overwrite_request'])
+
+    @patch('Inz.wykres.save_data_to_db', return_value='temp-1')
+    @patch('Inz.wykres.create_temp_data_table')
+    @patch('Inz.wykres.update_database', return_value=[('2024-01-01 00:00:00', '123')])
+    @patch('Inz.wykres.process_data_db', return_value=pd.DataFrame({'a': range(2)}))
+    @patch('Inz.wykres.load_data', return_value=(pd.DataFrame({'Id': range(5)}), None))
+    def test_job_is_confirmed_once(self, mock_load_data, mock_process_data, mock_update_db, mock_create_temp,
+                                   mock_save):
+        job_id = self.submit().get_json()['job_id']
+
+        with patch('Inz.wykres.get_job_executor') as mock_executor:
+            first = self.client.post(f'/jobs/{job_id}/confirm', json={'overwrite_request': True})
+            second = self.client.post(f'/jobs/{job_id}/confirm', json={'overwrite_request': True})
+
+        self.assertEqual((first.status_code, second.status_code), (202, 409))
+        self.assertEqual(first.get_json()['status'], 'queued')
+        mock_executor.return_value.submit.assert_called_once()
+
+    def test_purge_keeps_unfinished_jobs(self):
+        jobs = {status: IngestJob('MR_123_2024-01-01_POJAZDY.xlsx', None, None)
+                for status in ('queued', 'running', 'done')}
+        for status, job in jobs.items():
+            job.status = status
+            job.created = 0
+        jobs['done'].finished = 0
+        _jobs.update({job.id: job for job in jobs.values()})
+        self.addCleanup(lambda: [_jobs.pop(job.id, None) for job in jobs.values()])
+
+        _purge_jobs()
+
+        self.assertIn(jobs['queued'].id, _jobs)
+        self.assertIn(jobs['running'].id, _jobs)
+        self.assertNotIn(jobs['done'].id, _jobs)
+
+    @patch('Inz.wykres.load_data')
+    def test_job_reports_load_error(self, mock_load_data):
+        mock_load_data.return_value = (None, "Brak wymaganych kolumn: Data")
+
+        job_id = self.submit().get_json()['job_id']
+        job = self.client.get(f'/jobs/{job_id}').get_json()
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(job['error'], "Brak wymaganych kolumn: Data")
+
+    def test_invalid_file_name(self):
+        response = self.submit('plik.xlsx')
+        self.assertIn('error', response.get_json())
+
+    def test_submit_without_database(self):
+        client = self.app.test_client()
+        data = {'file': (BytesIO(b'file_data'), 'MR_123_2024-01-01_POJAZDY.xlsx')}
+        response = client.post('/jobs', data=data, content_type='multipart/form-data')
+        self.assertIn('error', response.get_json())
+
+    @patch('Inz.wykres.load_data', return_value=(None, "Błąd"))
+    def test_job_hidden_from_other_sessions(self, mock_load_data):
+        job_id = self.submit().get_json()['job_id']
+
+        other = self.app.test_client()
+        self.set_session(other, db_name='other_db')
+        self.assertEqual(other.get(f'/jobs/{job_id}').status_code, 404)
+        self.assertEqual(self.client.get('/jobs/unknown').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+from unittest.mock import patch
+from io import BytesIO
+import pandas as pd
+from Inz.wykres import app, Histogram, stage_durations, stage_rows, timed, plot_cache, load_data
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_buckets_are_cumulative(self):
+        histogram = Histogram('test_seconds', "Test.", (0.1, 1))
+        for value in (0.05, 0.5, 0.5, 3):
+            histogram.observe('parse', value)
+
+        counts, total, count = histogram.snapshot('parse')
+        self.assertEqual(counts, [1, 3, 4])
+        self.assertAlmostEqual(total, 4.05)
+        self.assertEqual(count, 4)
+
+        lines = histogram.render()
+        self.assertIn('test_seconds_bucket{stage="parse",le="1"} 3', lines)
+        self.assertIn('test_seconds_bucket{stage="parse",le="+Inf"} 4', lines)
+        self.assertIn('test_seconds_count{stage="parse"} 4', lines)
+
+    def test_timed_records_rows_of_returned_frame(self):
+        stage_rows.clear()
+
+        @timed('test_stage')
+        def produce():
+            return pd.DataFrame({'a': range(7)}), None
+
+        produce()
+        counts, total, count = stage_rows.snapshot('test_stage')
+        self.assertEqual((total, count), (7, 1))
+        self.assertEqual(stage_durations.snapshot('test_stage')[2], 1)
+
+    def test_load_data_records_parse_and_validation(self):
+        stage_durations.clear()
+        stage_rows.clear()
+        df = pd.DataFrame({'Id': [1], 'Data': ['2024-01-01 00:00:00'], 'Kategoria': ['L'], 'Pas ruchu': [1],
+                           'Prędkość': [100], 'Długość pojazdu w cm': [400], 'Kierunek pod prąd': [0],
+                           'Przestrzeń między poprzedzającym pojazdem w dziesiętnych częściach sekundy': [20]})
+        file = BytesIO(df.to_csv(index=False).encode())
+        file.filename = 'MR_123_2024-01-01_POJAZDY.csv'
+
+        result, error = load_data(file)
+
+        self.assertIsNone(error)
+        self.assertEqual(stage_rows.snapshot('parse')[1], 1)
+        self.assertIsNotNone(stage_durations.snapshot('validate'))
+
+
+class TestMetricsRoutes(unittest.TestCase):
+
+    def setUp(self):
+        app.config['WTF_CSRF_ENABLED'] = False
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['db_name'] = 'test_db'
+        plot_cache.clear()
+        stage_durations.clear()
+        stage_rows.clear()
+
+    @patch('Inz.wykres.reverse_format_section', return_value=('101', None))
+    @patch('Inz.wykres.fetch_period_profiles')
+    def test_export_sends_server_timing_and_metrics(self, mock_fetch, mock_reverse):
+        mock_fetch.return_value = (pd.DataFrame({'Okres': [0], 'numer_odcinka': ['101'], 'godzina': [7],
+                                                 'Liczba samochodów': [12.5]}), None)
+        form = {'start_date_1': '2025-01-01', 'end_date_1': '2025-01-31', 'car_type': 'H',
+                'section_number': '101 - A1'}
+
+        response = self.client.get('/export/plot.csv', query_string=form)
+
+        # CSV jest strumieniowany, więc w nagłówku są tylko etapy sprzed wysłania odpowiedzi
+        server_timing = response.headers['Server-Timing']
+        response.get_data()
+        self.assertIn('total;dur=', server_timing)
+        self.assertNotIn('csv_build', server_timing)
+
+        metrics = self.client.get('/metrics')
+        self.assertTrue(metrics.content_type.startswith('text/plain'))
+        text = metrics.get_data(as_text=True)
+        self.assertIn('inz_stage_duration_seconds_count{stage="csv_build"} 1', text)
+        self.assertIn('inz_plot_cache_misses_total 0', text)
+        self.assertIn('inz_jobs{status="running"}', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import unittest
+from unittest.mock import patch
+from io import BytesIO
+import os
+import tempfile
+import time
+import pandas as pd
+from Inz.wykres import ParseCache, parse_cache_key, load_aggregated_data, PARSE_PIPELINE_VERSION
+
+
+def make_file(content, file_name='114_A_1_145_2025-01-20_POJAZDY.csv'):
+    file = BytesIO(content)
+    file.filename = file_name
+    return file
+
+
+class TestParseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ParseCache(self.directory)
+        self.df = pd.DataFrame({'Data 15min': pd.to_datetime(['2025-01-20 12:00:00']),
+                                'Numer odcinka': ['114_A_1_145'], 'Liczba na pasie 1': [3]})
+
+    def test_round_trip(self):
+        self.assertIsNone(self.cache.get('abc'))
+        self.cache.put('abc', self.df)
+
+        cached = self.cache.get('abc')
+        pd.testing.assert_frame_equal(cached, self.df, check_dtype=False)
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.put('a', self.df)
+        entry_size = self.cache.stats()['bytes']
+        cache = ParseCache(self.directory, max_bytes=2 * entry_size)
+        cache.put('b', self.df)
+        # Czas ostatniego użycia to czas modyfikacji pliku
+        past = time.time() - 60
+        os.utime(os.path.join(self.directory, 'b.npz'), (past, past))
+        os.utime(os.path.join(self.directory, 'a.npz'), (past - 60, past - 60))
+        cache.get('a')
+        cache.put('c', self.df)
+
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_corrupted_entry_is_a_miss(self):
+        with open(os.path.join(self.directory, 'bad.npz'), 'wb') as file:
+            file.write(b'not a frame')
+        self.assertIsNone(self.cache.get('bad'))
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'bad.npz')))
+
+    def test_disabled_cache(self):
+        cache = ParseCache(None)
+        cache.put('a', self.df)
+        self.assertIsNone(cache.get('a'))
+
+
+class TestParseCacheKey(unittest.TestCase):
+
+    def test_key_depends_on_content_section_and_version(self):
+        key = parse_cache_key(make_file(b'abc'))
+        self.assertEqual(key, parse_cache_key(make_file(b'abc')))
+        self.assertNotEqual(key, parse_cache_key(make_file(b'abd')))
+        self.assertNotEqual(key, parse_cache_key(make_file(b'abc', '114_A_1_146_2025-01-20_POJAZDY.csv')))
+        with patch('Inz.wykres.PARSE_PIPELINE_VERSION', PARSE_PIPELINE_VERSION + 1):
+            self.assertNotEqual(key, parse_cache_key(make_file(b'abc')))
+
+    def test_invalid_file_name_has_no_key(self):
+        self.assertIsNone(parse_cache_key(make_file(b'abc', 'plik.csv')))
+
+    def test_stream_position_is_restored(self):
+        file = make_file(b'abc')
+        parse_cache_key(file)
+        self.assertEqual(file.read(), b'abc')
+
+
+class TestLoadAggregatedDataCache(unittest.TestCase):
+
+    def setUp(self):
+        cache = patch('Inz.wykres.parse_cache', ParseCache(tempfile.mkdtemp()))
+        cache.start()
+        self.addCleanup(cache.stop)
+        df = pd.DataFrame({
+            'Id': [1, 2],
+            'Data': ['2025-01-20 12:00:00', '2025-01-20 12:20:00'],
+            'Kategoria': ['H', 'L'],
+            'Pas ruchu': [1, 2],
+            'Prędkość': [80, 110],
+            'Przestrzeń między poprzedzającym pojazdem w dziesiętnych częściach sekundy': [10, 20],
+            'Długość pojazdu w cm': [1200, 450],
+            'Kierunek pod prąd': [0, 0],
+        })
+        self.content = df.to_csv(index=False).encode()
+
+    def test_repeated_upload_skips_parsing(self):
+        first, error = load_aggregated_data(make_file(self.content))
+        self.assertIsNone(error)
+
+        with patch('Inz.wykres.aggregate_file') as mock_aggregate:
+            second, error = load_aggregated_data(make_file(self.content))
+
+        mock_aggregate.assert_not_called()
+        self.assertIsNone(error)
+        pd.testing.assert_frame_equal(second, first, check_dtype=False)
+
+    def test_errors_are_not_cached(self):
+        broken = self.content.replace(b'Kategoria', b'Typ')
+        self.assertIsNotNone(load_aggregated_data(make_file(broken))[1])
+        self.assertIsNotNone(load_aggregated_data(make_file(broken))[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
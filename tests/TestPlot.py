@@ -3,7 +3,9 @@ import os
 import pandas as pd
 from unittest.mock import patch, MagicMock
 import psycopg2
-from Inz.wykres import process_data, fetch_data_from_db, get_sections, reverse_format_section, resource_path_mr_number_info, BASE_DIR, app
+from datetime import datetime
+from Inz.wykres import process_data, process_rollup, fetch_data_from_db, get_sections, reverse_format_section, resource_path_mr_number_info, BASE_DIR, app, plot_cache, \
+    fetch_period_profiles, hour_of_day_profile
 
 
 class PlotRouteTestCase(unittest.TestCase):
@@ -13,6 +15,13 @@ class PlotRouteTestCase(unittest.TestCase):
         self.app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for testing
         self.client = self.app.test_client()
 
+        # Każdy test zaczyna z pustą pamięcią podręczną wykresów
+        plot_cache.clear()
+        # Bez tabeli agregatów wykres liczony jest z tabeli pojazdy
+        rollup = patch('Inz.wykres.fetch_hourly_rollup', return_value=(None, None))
+        rollup.start()
+        self.addCleanup(rollup.stop)
+
     def test_no_database_assigned(self):
         """Test braku przypisanej bazy danych"""
         response = self.client.post('/plot', data={})
@@ -116,7 +125,8 @@ class PlotRouteTestCase(unittest.TestCase):
 
         # **🟢 Sprawdzamy, czy odpowiedź zawiera dane wykresu**
         self.assertIn("chart_data", json_data)
-        self.assertIn("csv_data", json_data)
+        # CSV nie jest już dołączany do odpowiedzi - dostępny jest pod /export/plot.csv
+        self.assertNotIn("csv_data", json_data)
 
         # **🟢 Sprawdzamy, czy dane wykresu są poprawne**
         self.assertIn("x", json_data["chart_data"])
@@ -238,6 +248,22 @@ class PlotRouteTestCase(unittest.TestCase):
 
 
 
+class PlotFormRouteTestCase(unittest.TestCase):
+    """Wspólne przygotowanie testów tras przyjmujących pola formularza wykresu (odcinek 101, okres 1)."""
+
+    def setUp(self):
+        app.config['WTF_CSRF_ENABLED'] = False
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['db_name'] = 'test_db'
+        plot_cache.clear()
+        self.form = {'start_date_1': '2025-01-01', 'end_date_1': '2025-01-31', 'car_type': 'both',
+                     'section_number': '101 - A1'}
+        reverse = patch('Inz.wykres.reverse_format_section', return_value=('101', None))
+        reverse.start()
+        self.addCleanup(reverse.stop)
+
+
 class TestProcessDataPlot(unittest.TestCase):
 
     def setUp(self):
@@ -330,35 +356,57 @@ class TestProcessDataPlot(unittest.TestCase):
 class TestFetchDataFromDB(unittest.TestCase):
 
     @patch("Inz.wykres.connect_db")
-    @patch("Inz.wykres.pd.read_sql_query")
-    def test_fetch_data_from_db_success(self, mock_read_sql, mock_connect_db):
-        # Przygotowanie fałszywego połączenia i DataFrame'a
+    def test_fetch_data_from_db_success(self, mock_connect_db):
+        # Przygotowanie fałszywego połączenia i kursora
         mock_conn = MagicMock()
         mock_connect_db.return_value = mock_conn
+        mock_cursor = mock_conn.cursor.return_value.__enter__.return_value
+        mock_cursor.fetchall.return_value = [
+            (datetime(2025, 1, 1, 0, 0), "section1", 12.5, 7),
+            (datetime(2025, 1, 1, 0, 15), "section1", None, 3),
+        ]
 
-        df_fake = pd.DataFrame({
-            "data_15min": ["2025-01-01 00:00:00"],
-            "numer_odcinka": ["section1"]
-        })
-        mock_read_sql.return_value = df_fake
-
-        # Wywołanie funkcji z podaniem warunków
+        # Wywołanie funkcji z podaniem warunków i wybranych kolumn
         df, error = fetch_data_from_db(start_date="2025-01-01",
                                        end_date="2025-01-02",
-                                       section_number="section1")
-
-        # Weryfikacja, czy zapytanie SQL zawiera oczekiwane warunki
-        args, _ = mock_read_sql.call_args
-        query_arg = args[0]
-        self.assertIn("data_15min BETWEEN '2025-01-01 00:00:00' AND '2025-01-02 23:59:59'", query_arg)
-        self.assertIn("numer_odcinka = 'section1'", query_arg)
+                                       section_number="section1",
+                                       columns=["data_15min", "numer_odcinka", "srednia_predkosc_h_pas_1",
+                                                "liczba_na_pasie_1"])
+
+        # Warunki przekazywane są jako parametry zapytania, a nie wklejane do tekstu SQL
+        query_arg, params = mock_cursor.execute.call_args[0]
+        self.assertIn("data_15min BETWEEN %s AND %s", query_arg)
+        self.assertIn("numer_odcinka = %s", query_arg)
         self.assertIn("ORDER BY data_15min", query_arg)
+        self.assertIn("srednia_predkosc_h_pas_1::float8", query_arg)
+        self.assertNotIn("liczba_na_pasie_2", query_arg)
+        self.assertEqual(params, ["2025-01-01 00:00:00", "2025-01-02 23:59:59", "section1"])
 
         self.assertIsNone(error)
-        self.assertTrue(df.equals(df_fake))
+        self.assertEqual(df["srednia_predkosc_h_pas_1"].dtype, "float64")
+        self.assertTrue(pd.isna(df["srednia_predkosc_h_pas_1"].iloc[1]))
+        self.assertEqual(df["liczba_na_pasie_1"].dtype, "int32")
+        self.assertEqual(df["data_15min"].dtype.kind, "M")
         # Sprawdzamy, czy połączenie zostało zamknięte
         mock_conn.close.assert_called_once()
 
+    @patch("Inz.wykres.connect_db")
+    def test_fetch_data_from_db_all_columns(self, mock_connect_db):
+        mock_cursor = mock_connect_db.return_value.cursor.return_value.__enter__.return_value
+        mock_cursor.fetchall.return_value = []
+
+        df, error = fetch_data_from_db()
+
+        self.assertIsNone(error)
+        self.assertEqual(len(df.columns), 18)
+        self.assertTrue(df.empty)
+        self.assertEqual(mock_cursor.execute.call_args[0][1], [])
+
+    def test_fetch_data_from_db_unknown_column(self):
+        df, error = fetch_data_from_db(columns=["data_15min; DROP TABLE pojazdy"])
+        self.assertIsNone(df)
+        self.assertIn("Nieznane kolumny", error)
+
     @patch("Inz.wykres.connect_db")
     def test_fetch_data_from_db_connection_error(self, mock_connect_db):
         # Symulacja błędu połączenia (psycopg2.Error)
@@ -368,13 +416,13 @@ class TestFetchDataFromDB(unittest.TestCase):
         self.assertEqual(error, "Connection failed")
 
     @patch("Inz.wykres.connect_db")
-    @patch("Inz.wykres.pd.read_sql_query")
-    def test_fetch_data_from_db_sql_error(self, mock_read_sql, mock_connect_db):
+    def test_fetch_data_from_db_sql_error(self, mock_connect_db):
         # Przygotowanie fałszywego połączenia
         mock_conn = MagicMock()
         mock_connect_db.return_value = mock_conn
         # Wymuszenie błędu podczas wykonywania zapytania SQL
-        mock_read_sql.side_effect = pd.io.sql.DatabaseError("SQL error occurred")
+        mock_conn.cursor.return_value.__enter__.return_value.execute.side_effect = \
+            psycopg2.Error("SQL error occurred")
         df, error = fetch_data_from_db()
         self.assertIsNone(df)
         self.assertEqual(error, "SQL error occurred")
@@ -622,4 +670,258 @@ class TestResourcePathMrNumberInfo(unittest.TestCase):
     def test_resource_path_mr_number_info(self):
         expected_path = os.path.join(BASE_DIR, 'WK_1000_A1M-5000_A2E.xlsx')
         actual_path = resource_path_mr_number_info()
-        self.assertEqual(actual_path, expected_path)
\ No newline at end of file
+        self.assertEqual(actual_path, expected_path)
+
+def rollup_from_raw(df):
+    """Odpowiednik zapytania wypełniającego pojazdy_godzinowe, liczony w pandas."""
+    raw = df.assign(okres=df['data_15min'].dt.floor('h'),
+                    liczba_samochodow=df['liczba_na_pasie_1'] + df['liczba_na_pasie_2'],
+                    liczba_samochodow_h=df['liczba_samochodow_h_pas_1'] + df['liczba_samochodow_h_pas_2'],
+                    liczba_samochodow_l=df['liczba_samochodow_l_pas_1'] + df['liczba_samochodow_l_pas_2'])
+    return raw.groupby(['okres', 'numer_odcinka'])[
+        ['liczba_samochodow', 'liczba_samochodow_h', 'liczba_samochodow_l']].sum().reset_index()
+
+
+class TestProcessRollup(unittest.TestCase):
+
+    def setUp(self):
+        timestamps = pd.date_range('2025-01-19 22:00', periods=16, freq='15min')
+        self.df_raw = pd.DataFrame({
+            'data_15min': timestamps,
+            'numer_odcinka': '101',
+            'liczba_samochodow_h_pas_1': range(16),
+            'liczba_samochodow_h_pas_2': range(1, 17),
+            'liczba_samochodow_l_pas_1': range(2, 18),
+            'liczba_samochodow_l_pas_2': range(3, 19),
+            'liczba_na_pasie_1': range(10, 26),
+            'liczba_na_pasie_2': range(20, 36),
+        })
+
+    def test_same_result_as_process_data(self):
+        # Wynik z agregatów godzinowych musi być identyczny jak z surowych danych 15-minutowych
+        rollup = rollup_from_raw(self.df_raw)
+        for car_type in ('H', 'L', 'both'):
+            for day_of_week in (None, 'Sunday', 'Monday', 'Friday'):
+                expected, _ = process_data(self.df_raw.copy(), car_type, day_of_week)
+                result, error = process_rollup(rollup, car_type, day_of_week)
+                self.assertIsNone(error)
+                pd.testing.assert_series_equal(result['Liczba samochodów'], expected['Liczba samochodów'],
+                                               check_dtype=False, check_index_type=False)
+
+    def test_sections_are_summed_per_hour(self):
+        other = self.df_raw.assign(numer_odcinka='102')
+        rollup = rollup_from_raw(pd.concat([self.df_raw, other]))
+        expected, _ = process_data(pd.concat([self.df_raw, other]), 'both')
+        result, _ = process_rollup(rollup, 'both')
+        self.assertEqual(result['Liczba samochodów'].tolist(), expected['Liczba samochodów'].tolist())
+
+
+class PlotRollupRouteTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.client = self.app.test_client()
+        plot_cache.clear()
+
+    @patch('Inz.wykres.fetch_data_from_db')
+    @patch('Inz.wykres.fetch_hourly_rollup')
+    def test_plot_reads_rollup(self, mock_rollup, mock_fetch_data):
+        with self.client.session_transaction() as sess:
+            sess['db_name'] = 'test_db'
+        mock_rollup.return_value = (pd.DataFrame({
+            'okres': pd.to_datetime(['2023-01-02 07:00', '2023-01-03 07:00']),
+            'numer_odcinka': ['101', '101'],
+            'liczba_samochodow': [10, 20],
+            'liczba_samochodow_h': [1, 2],
+            'liczba_samochodow_l': [9, 18],
+        }), None)
+
+        response = self.client.post('/plot', data={
+            'start_date_1': '2023-01-01',
+            'end_date_1': '2023-01-31',
+            'car_type': 'both'
+        })
+
+        chart_data = response.get_json()['chart_data']
+        self.assertEqual(chart_data['x'], ['07:00:00'])
+        self.assertEqual(chart_data['y1'], [15.0])
+        mock_fetch_data.assert_not_called()
+
+
+class TestHourOfDayProfile(PlotFormRouteTestCase):
+
+    @patch('Inz.wykres.fetch_data_from_db')
+    @patch('Inz.wykres.fetch_period_profiles')
+    def test_plot_uses_sql_profile(self, mock_fetch, mock_fetch_data):
+        mock_fetch.return_value = (pd.DataFrame({'Okres': [0], 'numer_odcinka': ['101'], 'godzina': [7],
+                                                 'Liczba samochodów': [12.5]}), None)
+
+        response = self.client.post('/plot', data={**self.form, 'start_date_1': '2023-01-01',
+                                                   'end_date_1': '2023-01-31', 'car_type': 'L'})
+
+        chart_data = response.get_json()['chart_data']
+        self.assertEqual(chart_data['x'], ['07:00:00'])
+        self.assertEqual(chart_data['y1'], [12.5])
+        self.assertIn('Numer MR: 101', chart_data['labels']['title'])
+        mock_fetch.assert_called_once_with([('Okres 1', '2023-01-01', '2023-01-31')], ['101'], 'L', None)
+        mock_fetch_data.assert_not_called()
+
+
+class TestSectionComparison(PlotFormRouteTestCase):
+
+    @staticmethod
+    def profiles():
+        return pd.DataFrame({
+            'Okres': [0] * 48,
+            'numer_odcinka': ['101'] * 24 + ['102'] * 24,
+            'godzina': list(range(24)) * 2,
+            'Liczba samochodów': [float(i % 5) for i in range(24)] + [float(i % 7) for i in range(24)],
+        })
+
+    @patch('Inz.wykres.connect_db')
+    def test_hour_of_day_average_in_sql(self, mock_connect_db):
+        cursor = mock_connect_db.return_value.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = [True]
+        # okres, odcinek, godzina doby, średnia sum godzinowych
+        cursor.fetchall.return_value = [(0, '101', 7, 22.46), (0, '101', 8, 3.0)]
+
+        df, error = fetch_period_profiles([('Okres 1', '2025-01-01', '2025-01-31')], ['101'], 'H', 'Monday')
+
+        self.assertIsNone(error)
+        self.assertEqual(df['godzina'].tolist(), [7, 8])
+        self.assertEqual(df['Liczba samochodów'].tolist(), [22.5, 3.0])
+        sql, params = cursor.execute.call_args[0]
+        self.assertIn('pojazdy_godzinowe', sql)
+        self.assertIn('AVG(liczba)', sql)
+        self.assertIn('extract(hour FROM okres)', sql)
+        self.assertIn('extract(dow FROM okres) = %s', sql)
+        # Poniedziałek w PostgreSQL ma numer 1
+        self.assertEqual(params[-2:], [1, 1])
+
+    @patch('Inz.wykres.connect_db')
+    def test_sections_fetched_with_one_query(self, mock_connect_db):
+        cursor = mock_connect_db.return_value.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = [True]
+        cursor.fetchall.return_value = [(0, '101', 7, 5.0)]
+
+        df, error = fetch_period_profiles([('Okres 1', '2025-01-01', '2025-01-31')], ['101', '102'], 'L')
+
+        self.assertIsNone(error)
+        self.assertEqual(df.columns.tolist(), ['Okres', 'numer_odcinka', 'godzina', 'Liczba samochodów'])
+        sql, params = cursor.execute.call_args[0]
+        self.assertIn('numer_odcinka = ANY(%s)', sql)
+        self.assertIn('liczba_samochodow_l', sql)
+        self.assertEqual(params, [0, '2025-01-01', '2025-01-31', ['101', '102'], datetime(2025, 1, 1).date(),
+                                  datetime(2025, 1, 31).date(), None, None])
+
+    @patch('Inz.wykres.reverse_format_section')
+    @patch('Inz.wykres.fetch_period_profiles')
+    def test_plot_returns_series_per_section(self, mock_fetch, mock_reverse):
+        mock_reverse.side_effect = lambda path, label: ({'A': '101', 'B': '102'}.get(label), None)
+        mock_fetch.return_value = (self.profiles(), None)
+
+        response = self.client.post('/plot', data={**self.form, 'section_number': 'A', 'section_numbers': ['B', 'A']})
+        chart_data = response.get_json()['chart_data']
+
+        mock_fetch.assert_called_once_with([('Okres 1', '2025-01-01', '2025-01-31')], ['101', '102'], 'both', None)
+        self.assertEqual([series['section'] for series in chart_data['series']], ['101', '102'])
+        self.assertEqual(len(chart_data['x']), 24)
+        self.assertEqual(chart_data['x'][0], '00:00:00')
+        self.assertIn('101, 102', chart_data['labels']['title'])
+
+        # Zapis danych jednego z odcinków unieważnia wykres porównania
+        self.assertEqual(plot_cache.stats()['entries'], 1)
+        plot_cache.invalidate(None, '102', datetime(2025, 1, 10).date(), datetime(2025, 1, 10).date())
+        self.assertEqual(plot_cache.stats()['entries'], 0)
+
+    @patch('Inz.wykres.reverse_format_section', return_value=(None, "No matching ID_MR found in the Excel data."))
+    def test_unknown_section_in_comparison(self, mock_reverse):
+        response = self.client.post('/plot', data={**self.form, 'section_number': 'A', 'section_numbers': ['B']})
+        self.assertIn('Nie znaleziono odcinka', response.get_json()['error'])
+
+
+class TestPlotPeriods(PlotFormRouteTestCase):
+
+    @patch('Inz.wykres.connect_db')
+    def test_periods_are_joined_as_values_in_one_query(self, mock_connect_db):
+        cursor = mock_connect_db.return_value.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = [False]
+        cursor.fetchall.return_value = [(0, None, 7, 5.0), (2, None, 7, 7.0)]
+        periods = [('Okres 1', '2025-01-01', '2025-01-31'), ('Okres 2', '2025-02-01', '2025-02-28'),
+                   ('Okres 3', '2025-03-01', '2025-03-31')]
+
+        df, error = fetch_period_profiles(periods)
+
+        self.assertIsNone(error)
+        self.assertEqual(cursor.execute.call_count, 2)  # sprawdzenie tabeli i jedno zapytanie danych
+        sql, params = cursor.execute.call_args[0]
+        self.assertIn('VALUES (%s, %s::date, %s::date), (%s, %s::date, %s::date), (%s, %s::date, %s::date)',
+                      sql)
+        self.assertIn('JOIN pojazdy p', sql)
+        self.assertNotIn('ANY(%s)', sql)
+        self.assertEqual(params[:9], [0, '2025-01-01', '2025-01-31', 1, '2025-02-01', '2025-02-28',
+                                      2, '2025-03-01', '2025-03-31'])
+        # Zakres obejmujący wszystkie okresy
+        self.assertEqual(params[9:11], [datetime(2025, 1, 1).date(), datetime(2025, 3, 31).date()])
+        self.assertEqual(df['numer_odcinka'].unique().tolist(), ['wszystkie'])
+
+    @patch('Inz.wykres.fetch_period_profiles')
+    def test_plot_with_many_periods(self, mock_fetch):
+        mock_fetch.return_value = (pd.DataFrame({
+            'Okres': [0, 0, 1, 2, 2], 'numer_odcinka': ['101'] * 5, 'godzina': [7, 8, 7, 7, 8],
+            'Liczba samochodów': [1.0, 2.0, 3.0, 4.0, 5.0]}), None)
+        form = {'car_type': 'both', 'section_number': '101 - A1'}
+        for number in range(1, 11):
+            form.update({f'start_date_{number}': f'2025-01-{number:02d}',
+                         f'end_date_{number}': f'2025-01-{number:02d}'})
+        form['start_date_11'] = '2025-02-01'  # okres bez daty końcowej jest pomijany
+
+        chart_data = self.client.post('/plot', data=form).get_json()['chart_data']
+
+        periods = mock_fetch.call_args[0][0]
+        self.assertEqual([period[0] for period in periods], [f'Okres {number}' for number in range(1, 11)])
+        self.assertEqual(mock_fetch.call_args[0][1], ['101'])
+        self.assertEqual(len(chart_data['series']), 10)
+        self.assertEqual(chart_data['series'][0]['y'], [1.0, 2.0])
+        self.assertEqual(chart_data['series'][1]['y'], [3.0, None])
+        self.assertEqual(chart_data['series'][3]['y'], [None, None])
+        self.assertEqual(chart_data['series'][2]['name'], 'Okres 3 (2025-01-03 - 2025-01-03)')
+        self.assertEqual(len(chart_data['periods']), 10)
+
+        # Zapis danych z dowolnego okresu unieważnia wykres
+        plot_cache.invalidate(None, '101', datetime(2025, 1, 9).date(), datetime(2025, 1, 9).date())
+        self.assertEqual(plot_cache.stats()['entries'], 0)
+
+    @patch('Inz.wykres.fetch_period_profiles')
+    def test_two_periods_use_one_query(self, mock_fetch):
+        mock_fetch.return_value = (pd.DataFrame({
+            'Okres': [0, 0, 1], 'numer_odcinka': ['101'] * 3, 'godzina': [7, 8, 7],
+            'Liczba samochodów': [1.0, 2.0, 3.0]}), None)
+        form = {**self.form, 'car_type': 'H', 'start_date_2': '2025-02-01', 'end_date_2': '2025-02-28'}
+
+        chart_data = self.client.post('/plot', data=form).get_json()['chart_data']
+
+        mock_fetch.assert_called_once_with([('Okres 1', '2025-01-01', '2025-01-31'),
+                                            ('Okres 2', '2025-02-01', '2025-02-28')], ['101'], 'H', None)
+        self.assertEqual(chart_data['x'], ['07:00:00', '08:00:00'])
+        self.assertEqual((chart_data['y1'], chart_data['y2']), ([1.0, 2.0], [3.0]))
+
+    @patch('Inz.wykres.fetch_period_profiles', return_value=(None, 'connection refused'))
+    def test_database_error_is_reported(self, mock_fetch):
+        response = self.client.post('/plot', data={**self.form, 'car_type': 'H'})
+        self.assertEqual(response.get_json()['error'], 'Błąd przetwarzania danych: connection refused')
+
+    def test_too_many_periods(self):
+        form = {'car_type': 'both', 'start_date_1': '2025-01-01', 'end_date_1': '2025-01-01'}
+        for number in range(2, 4):
+            form.update({f'start_date_{number}': '2025-01-01', f'end_date_{number}': '2025-01-02'})
+        with patch('Inz.wykres.PLOT_MAX_PERIODS', 2):
+            response = self.client.post('/plot', data=form)
+        self.assertIn('najwyżej 2', response.get_json()['error'])
+
+    def test_invalid_date_in_later_period(self):
+        response = self.client.post('/plot', data={'car_type': 'both', 'start_date_1': '2025-01-01',
+                                                   'end_date_1': '2025-01-02', 'start_date_3': '2025-13-01',
+                                                   'end_date_3': '2025-01-02'})
+        self.assertIn('Nieprawidłowy format daty', response.get_json()['error'])
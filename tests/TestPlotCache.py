@@ -0,0 +1,91 @@
+import unittest
+from unittest.mock import patch
+from datetime import date, datetime
+import pandas as pd
+from Inz.wykres import PlotCache, plot_cache, invalidate_plot_cache, app
+
+
+class TestPlotCache(unittest.TestCase):
+
+    def test_hit_and_miss_counters(self):
+        cache = PlotCache()
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', {'x': 1}, 'db', '101', [None])
+        self.assertEqual(cache.get('a'), {'x': 1})
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = PlotCache(max_bytes=40)
+        cache.put('a', {'x': 'a' * 10}, 'db', '101', [None])
+        cache.put('b', {'x': 'b' * 10}, 'db', '101', [None])
+        cache.get('a')  # "a" staje się ostatnio używanym wpisem
+        cache.put('c', {'x': 'c' * 10}, 'db', '101', [None])
+
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertLessEqual(cache.stats()['bytes'], 40)
+
+    def test_expired_entry_is_a_miss(self):
+        cache = PlotCache(ttl=-1)
+        cache.put('a', {'x': 1}, 'db', '101', [None])
+        self.assertIsNone(cache.get('a'))
+
+    def test_invalidation_matches_section_and_dates(self):
+        cache = PlotCache()
+        january = (date(2025, 1, 1), date(2025, 1, 31))
+        march = (date(2025, 3, 1), date(2025, 3, 31))
+        cache.put('jan', {}, 'db', '101', [january])
+        cache.put('jan-mar', {}, 'db', '101', [january, march])
+        cache.put('other-section', {}, 'db', '102', [march])
+        cache.put('other-db', {}, 'db2', '101', [march])
+        cache.put('all-sections', {}, 'db', None, [None])
+
+        cache.invalidate('db', '101', date(2025, 3, 10), date(2025, 3, 11))
+
+        self.assertIsNotNone(cache.get('jan'))
+        self.assertIsNone(cache.get('jan-mar'))
+        self.assertIsNotNone(cache.get('other-section'))
+        self.assertIsNotNone(cache.get('other-db'))
+        self.assertIsNone(cache.get('all-sections'))
+        self.assertEqual(cache.stats()['invalidations'], 2)
+
+    def test_written_rows_invalidate_cache(self):
+        plot_cache.clear()
+        plot_cache.put('key', {}, None, '101', [(date(2025, 1, 20), date(2025, 1, 20))])
+        df = pd.DataFrame({'Data 15min': [datetime(2025, 1, 20, 12, 0)], 'Numer odcinka': ['101']})
+
+        invalidate_plot_cache(df)
+
+        self.assertIsNone(plot_cache.get('key'))
+
+
+class TestPlotRouteCache(unittest.TestCase):
+
+    def setUp(self):
+        app.config['WTF_CSRF_ENABLED'] = False
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['db_name'] = 'test_db'
+        plot_cache.clear()
+
+    @patch('Inz.wykres.reverse_format_section', return_value=('101', None))
+    @patch('Inz.wykres.fetch_period_profiles')
+    def test_repeated_request_is_served_from_cache(self, mock_fetch, mock_reverse):
+        mock_fetch.return_value = (pd.DataFrame({'Okres': [0], 'numer_odcinka': ['101'], 'godzina': [7],
+                                                 'Liczba samochodów': [12.5]}), None)
+        form = {'start_date_1': '2025-01-01', 'end_date_1': '2025-01-31', 'car_type': 'H',
+                'section_number': '101 - A1', 'day_of_week': ''}
+
+        first = self.client.post('/plot', data=form).get_json()
+        second = self.client.post('/plot', data=form).get_json()
+
+        self.assertEqual(first, second)
+        mock_fetch.assert_called_once()
+        stats = self.client.get('/plot/cache').get_json()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+from Inz.wykres import load_reference_data, format_section_label, resource_path_mr_number_info
+
+
+class TestReferenceData(unittest.TestCase):
+
+    def setUp(self):
+        # Kopia arkusza referencyjnego, aby móc zmieniać datę modyfikacji pliku
+        self.tmp_dir = tempfile.mkdtemp()
+        self.excel_path = os.path.join(self.tmp_dir, 'reference.xlsx')
+        shutil.copy(resource_path_mr_number_info(), self.excel_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_indexes_reference_workbook(self):
+        reference = load_reference_data(self.excel_path)
+
+        info = reference.by_id['101_A_1_141']
+        self.assertEqual(info['droga'], 'A1')
+        self.assertEqual(info['pikietaż'], '291+240')
+        self.assertEqual(info['lokalizacja'], 'w. Łódź PN')
+        self.assertIsNotNone(info['N_wgs84'])
+
+        # Etykieta z listy odcinków prowadzi z powrotem do ID_MR
+        label = format_section_label('101_A_1_141', info)
+        self.assertEqual(reference.by_label[label], '101_A_1_141')
+
+    def test_workbook_is_parsed_once(self):
+        first = load_reference_data(self.excel_path)
+        with patch('Inz.wykres.pd.ExcelFile') as mock_excel_file:
+            second = load_reference_data(self.excel_path)
+
+        self.assertIs(first, second)
+        mock_excel_file.assert_not_called()
+
+    def test_changed_workbook_is_reloaded(self):
+        first = load_reference_data(self.excel_path)
+        stat = os.stat(self.excel_path)
+        os.utime(self.excel_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+        second = load_reference_data(self.excel_path)
+        self.assertIsNot(first, second)
+        self.assertEqual(first.by_label, second.by_label)
+
+
+if __name__ == '__main__':
+    unittest.main()
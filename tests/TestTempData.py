@@ -1,14 +1,15 @@
 import unittest
 from unittest.mock import patch, MagicMock
-import pickle
 import pandas as pd
-from Inz.wykres import create_temp_data_table, save_data_to_db, get_data_from_db
+from Inz.wykres import create_temp_data_table, save_data_to_db, get_data_from_db, encode_frame, decode_frame, \
+    sweep_temp_data, TempDataFormatError
 
 
 class TestDatabaseFunctions(unittest.TestCase):
 
+    @patch("Inz.wykres.start_temp_data_sweeper")
     @patch("Inz.wykres.connect_db")
-    def test_create_temp_data_table(self, mock_connect_db):
+    def test_create_temp_data_table(self, mock_connect_db, mock_start_sweeper):
         # Przygotowanie mocka połączenia i kursora
         mock_conn = MagicMock()
         mock_cursor = MagicMock()
@@ -24,11 +25,12 @@ class TestDatabaseFunctions(unittest.TestCase):
             for call_arg in (call[0] for call in mock_cursor.execute.call_args_list)
         )
         self.assertTrue(create_table_called, "CREATE TABLE query was not called")
+        # Kolumny starszych tabel dodaje migracja schematu, a nie każde żądanie
+        self.assertFalse(any("ALTER TABLE" in call[0][0] for call in mock_cursor.execute.call_args_list))
 
-        # Sprawdzenie, czy zapytanie usuwania przeterminowanych rekordów zostało wykonane
-        mock_cursor.execute.assert_any_call(
-            "DELETE FROM temp_data WHERE expiration < CURRENT_TIMESTAMP - INTERVAL '5 minutes'"
-        )
+        # Przeterminowane rekordy usuwa wątek w tle, a nie żądanie
+        self.assertFalse(any("DELETE" in call[0][0] for call in mock_cursor.execute.call_args_list))
+        mock_start_sweeper.assert_called_once()
 
         # Sprawdzenie, czy commit został wykonany
         mock_conn.commit.assert_called_once()
@@ -49,6 +51,11 @@ class TestDatabaseFunctions(unittest.TestCase):
 
         mock_cursor.execute.assert_called_once()
         self.assertEqual(temp_id, 1)
+        # Zapisywany jest format kolumnowy wraz z rozmiarami
+        params = mock_cursor.execute.call_args[0][1]
+        self.assertTrue(decode_frame(params[0]).equals(df))
+        self.assertEqual(params[3], 3)
+        self.assertEqual(params[5], len(bytes(params[0])))
         mock_conn.commit.assert_called()
         mock_cursor.close.assert_called()
         mock_conn.close.assert_called()
@@ -59,7 +66,7 @@ class TestDatabaseFunctions(unittest.TestCase):
         mock_cursor = mock_conn.cursor.return_value
         mock_connect_db.return_value = mock_conn
         df = pd.DataFrame({"col1": [1, 2, 3]})
-        serialized_df = pickle.dumps(df)
+        serialized_df = encode_frame(df)
         mock_cursor.fetchone.return_value = [serialized_df]
 
         result_df = get_data_from_db(1)
@@ -90,3 +97,54 @@ class TestDatabaseFunctions(unittest.TestCase):
         # Sprawdzamy, czy kursor i połączenie zostały zamknięte
         mock_cursor.close.assert_called()
         mock_conn.close.assert_called()
+
+
+class TestTempDataFormat(unittest.TestCase):
+
+    def test_round_trip(self):
+        df = pd.DataFrame({
+            "data_15min": pd.to_datetime(["2025-01-20 12:00:00", "2025-01-20 12:15:00"]),
+            "numer_odcinka": ["101", None],
+            "liczba": [3, 4],
+            "predkosc": [80.5, float("nan")],
+        })
+        result = decode_frame(encode_frame(df))
+        pd.testing.assert_frame_equal(result, df, check_dtype=False)
+        self.assertEqual(result["data_15min"].dtype.kind, "M")
+
+    def test_unknown_payload_is_rejected(self):
+        with self.assertRaises(TempDataFormatError):
+            decode_frame(b"\x80\x04pickled")
+
+    def test_unsupported_version_is_rejected(self):
+        payload = bytearray(encode_frame(pd.DataFrame({"a": [1]})))
+        payload[4:6] = (99).to_bytes(2, "big")
+        with self.assertRaises(TempDataFormatError):
+            decode_frame(bytes(payload))
+
+    @patch("Inz.wykres.connect_db")
+    def test_get_data_from_db_legacy_payload(self, mock_connect_db):
+        mock_cursor = mock_connect_db.return_value.cursor.return_value
+        mock_cursor.fetchone.return_value = [b"\x80\x04legacy"]
+        self.assertIsNone(get_data_from_db(1))
+
+
+class TestTempDataSweeper(unittest.TestCase):
+
+    def test_sweep_deletes_expired_rows(self):
+        pool = MagicMock()
+        cursor = pool.getconn.return_value.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = [True]
+        cursor.rowcount = 2
+
+        self.assertEqual(sweep_temp_data([pool]), 2)
+        self.assertIn("DELETE FROM temp_data", cursor.execute.call_args[0][0])
+        pool.putconn.assert_called_once_with(pool.getconn.return_value)
+
+    def test_sweep_skips_database_without_table(self):
+        pool = MagicMock()
+        cursor = pool.getconn.return_value.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = [False]
+
+        self.assertEqual(sweep_temp_data([pool]), 0)
+        cursor.execute.assert_called_once()
@@ -0,0 +1,97 @@
+import unittest
+from unittest.mock import patch
+from datetime import datetime
+import numpy as np
+from Inz.wykres import lttb, fetch_time_series
+from TestPlot import PlotFormRouteTestCase
+
+
+class TestLttb(unittest.TestCase):
+
+    def test_selects_threshold_points_and_keeps_ends(self):
+        x = np.arange(10000, dtype=np.float64)
+        y = np.sin(x / 300)
+        selected = lttb(x, y, 500)
+        self.assertEqual(len(selected), 500)
+        self.assertEqual((selected[0], selected[-1]), (0, 9999))
+        self.assertTrue((np.diff(selected) > 0).all())
+
+    def test_spike_is_kept(self):
+        y = np.zeros(5000)
+        y[1234] = 100
+        self.assertIn(1234, lttb(np.arange(5000), y, 100))
+
+    def test_short_series_is_returned_whole(self):
+        self.assertEqual(lttb(np.arange(10), np.arange(10), 100).tolist(), list(range(10)))
+
+    def test_matches_reference_on_small_series(self):
+        x = np.arange(8, dtype=np.float64)
+        y = np.array([0, 5, 1, 1, 9, 0, 2, 3], dtype=np.float64)
+        # Kubełki [1, 3), [3, 5), [5, 7) - wynik zgodny z referencyjną implementacją LTTB
+        self.assertEqual(lttb(x, y, 5).tolist(), [0, 1, 4, 5, 7])
+
+
+class TestTimeSeriesRoute(PlotFormRouteTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.form.update(start_date_1='2024-01-01', end_date_1='2024-12-31', car_type='L')
+        times = np.arange(np.datetime64('2024-01-01T00:00'), np.datetime64('2025-01-01T00:00'),
+                          np.timedelta64(15, 'm')).astype('datetime64[s]')
+        self.series = (times, np.random.default_rng(0).random(len(times)) * 100, None)
+
+    @patch('Inz.wykres.fetch_time_series')
+    def test_year_is_downsampled(self, mock_fetch):
+        mock_fetch.return_value = self.series
+
+        series = self.client.post('/plot/timeseries', data={**self.form, 'points': '800'}).get_json()['timeseries']
+
+        mock_fetch.assert_called_once_with(datetime(2024, 1, 1), datetime(2025, 1, 1), '101', 'L')
+        self.assertEqual(series['raw_points'], 35136)
+        self.assertEqual(len(series['x']), 800)
+        self.assertEqual(series['x'][0], '2024-01-01T00:00')
+        self.assertEqual(series['x'][-1], '2024-12-31T23:45')
+
+    @patch('Inz.wykres.fetch_time_series')
+    def test_points_are_clamped(self, mock_fetch):
+        mock_fetch.return_value = self.series
+
+        for points, expected in (('0', 3), ('-5', 3), ('100000', 5000)):
+            series = self.client.post('/plot/timeseries', data={**self.form, 'points': points}).get_json()
+            self.assertEqual(len(series['timeseries']['x']), expected)
+
+    @patch('Inz.wykres.fetch_time_series')
+    def test_zoom_window_is_queried(self, mock_fetch):
+        times, values, _ = self.series
+        mock_fetch.return_value = (times[:96], values[:96], None)
+
+        series = self.client.post('/plot/timeseries', data={
+            **self.form, 'start': '2024-01-01 00:00:00.000', 'end': '2024-01-02'}).get_json()['timeseries']
+
+        mock_fetch.assert_called_once_with(datetime(2024, 1, 1), datetime(2024, 1, 2), '101', 'L')
+        # Okno mniejsze niż liczba punktów wraca w pełnej rozdzielczości
+        self.assertEqual(len(series['x']), 96)
+
+    def test_reversed_window(self):
+        response = self.client.post('/plot/timeseries', data={**self.form, 'start': '2024-02-01',
+                                                               'end': '2024-01-01'})
+        self.assertIn('error', response.get_json())
+
+    @patch('Inz.wykres.connect_db')
+    def test_fetch_query(self, mock_connect_db):
+        cursor = mock_connect_db.return_value.cursor.return_value.__enter__.return_value
+        cursor.fetchall.return_value = [(datetime(2024, 1, 1, 0, 15), 4.0), (datetime(2024, 1, 1, 0, 30), None)]
+
+        times, values, error = fetch_time_series(datetime(2024, 1, 1), datetime(2024, 1, 2), '101', 'H')
+
+        self.assertIsNone(error)
+        self.assertEqual(str(times[0]), '2024-01-01T00:15:00')
+        self.assertTrue(np.isnan(values[1]))
+        sql, params = cursor.execute.call_args[0]
+        self.assertIn('liczba_samochodow_h_pas_1', sql)
+        self.assertIn('ORDER BY 1', sql)
+        self.assertEqual(params, [datetime(2024, 1, 1), datetime(2024, 1, 2), '101'])
+
+
+if __name__ == '__main__':
+    unittest.main()
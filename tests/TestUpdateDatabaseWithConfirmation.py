@@ -2,7 +2,16 @@ import unittest
 from unittest.mock import patch, MagicMock
 import pandas as pd
 from datetime import datetime
-from Inz.wykres import update_database_with_confirmation  # Załóżmy, że funkcja jest w myapp.py
+from Inz.wykres import update_database_with_confirmation, POJAZDY_COLUMNS  # Załóżmy, że funkcja jest w myapp.py
+
+
+def pojazdy_inserts(mock_cursor):
+    return [call[0] for call in mock_cursor.execute.call_args_list if 'INSERT INTO pojazdy (' in call[0][0]]
+
+
+def rollup_refreshes(mock_cursor):
+    return [call[0] for call in mock_cursor.execute.call_args_list
+            if 'INSERT INTO pojazdy_' in call[0][0] and 'ON CONFLICT' in call[0][0]]
 
 
 class TestUpdateDatabaseWithConfirmation(unittest.TestCase):
@@ -42,10 +51,13 @@ class TestUpdateDatabaseWithConfirmation(unittest.TestCase):
         update_database_with_confirmation(df, overwrite_request=True)
 
         # Sprawdzenie, czy wykonano odpowiednią liczbę zapytań SQL
-        self.assertEqual(mock_cursor.execute.call_count, 1)
+        inserts = pojazdy_inserts(mock_cursor)
+        self.assertEqual(len(inserts), 1)
         # Sprawdzanie, czy zapytanie zawiera "ON CONFLICT" (co oznacza nadpisanie)
-        args, kwargs = mock_cursor.execute.call_args
+        args = inserts[0]
         self.assertIn('ON CONFLICT (data_15min, numer_odcinka) DO UPDATE SET', args[0])
+        # Agregaty godzinowe i dzienne są aktualizowane w tej samej transakcji
+        self.assertTrue(rollup_refreshes(mock_cursor))
 
     @patch('Inz.wykres.connect_db')  # Mockowanie funkcji connect_db
     def test_update_database_with_confirmation_no_overwrite(self, mock_connect_db):
@@ -82,7 +94,73 @@ class TestUpdateDatabaseWithConfirmation(unittest.TestCase):
         update_database_with_confirmation(df, overwrite_request=False)
 
         # Sprawdzenie, czy wykonano odpowiednią liczbę zapytań SQL
-        self.assertEqual(mock_cursor.execute.call_count, 1)
+        inserts = pojazdy_inserts(mock_cursor)
+        self.assertEqual(len(inserts), 1)
         # Sprawdzanie, czy zapytanie zawiera "DO NOTHING" (co oznacza brak nadpisania)
-        args, kwargs = mock_cursor.execute.call_args
+        args = inserts[0]
         self.assertIn('ON CONFLICT (data_15min, numer_odcinka) DO NOTHING', args[0])
+
+    @patch('Inz.wykres.connect_db')
+    def test_update_database_with_confirmation_bulk(self, mock_connect_db):
+        # Duże ramki danych trafiają do bazy przez COPY i jedno zapytanie scalające
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_connect_db.return_value = mock_conn
+        mock_conn.cursor.return_value = mock_cursor
+
+        df = pd.DataFrame({
+            'Data 15min': pd.date_range('2025-01-20', periods=3, freq='15min'),
+            'Numer odcinka': ['12345'] * 3,
+            'Średnia przestrzeń między pojazdem': [2.5, 2.0, 1.5],
+            'Liczba samochodów jadąca pod prąd': [0, 1, 0],
+            'Liczba na pasie 1': [10, 11, 12],
+            'Liczba samochodów H Pas 1': [3, 4, 5],
+            'Średnia prędkość H Pas 1': [60.0, None, 62.5],
+            'Średnia długość H Pas 1': [450.0, None, 455.0],
+            'Liczba samochodów L Pas 1': [4, 5, 6],
+            'Średnia prędkość L Pas 1': [55.0, 56.0, 57.0],
+            'Średnia długość L Pas 1': [400.0, 401.0, 402.0],
+            'Liczba na pasie 2': [12, 13, 14],
+            'Liczba samochodów H Pas 2': [6, 7, 8],
+            'Średnia prędkość H Pas 2': [70.0, 71.0, 72.0],
+            'Średnia długość H Pas 2': [460.0, 461.0, 462.0],
+            'Liczba samochodów L Pas 2': [7, 8, 9],
+            'Średnia prędkość L Pas 2': [65.0, 66.0, 67.0],
+            'Średnia długość L Pas 2': [420.0, 421.0, 422.0]
+        })
+
+        update_database_with_confirmation(df, overwrite_request=True, bulk=True)
+
+        # COPY wykonywany jest raz, niezależnie od liczby wierszy
+        mock_cursor.copy_expert.assert_called_once()
+        copy_sql, buffer = mock_cursor.copy_expert.call_args[0]
+        self.assertIn('COPY pojazdy_staging', copy_sql)
+        lines = buffer.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith('2025-01-20 00:00:00,12345,2.5,0,10,3,60.0,450.0'))
+        self.assertIn(',NaN,NaN,', lines[1])
+
+        args = pojazdy_inserts(mock_cursor)[0]
+        self.assertIn('SELECT', args[0])
+        self.assertIn('ON CONFLICT (data_15min, numer_odcinka) DO UPDATE SET', args[0])
+        mock_conn.commit.assert_called_once()
+
+    @patch('Inz.wykres.connect_db')
+    def test_rollups_refreshed_for_touched_periods(self, mock_connect_db):
+        mock_cursor = MagicMock()
+        mock_connect_db.return_value.cursor.return_value = mock_cursor
+
+        df = pd.DataFrame({column: [0, 0, 0] for column in POJAZDY_COLUMNS})
+        df['Data 15min'] = pd.to_datetime(['2025-01-20 12:00', '2025-01-20 12:45', '2025-01-20 13:15'])
+        df['Numer odcinka'] = '12345'
+        update_database_with_confirmation(df, overwrite_request=True, bulk=True)
+
+        refreshes = rollup_refreshes(mock_cursor)
+        self.assertEqual(len(refreshes), 2)
+        hourly = next(params for sql, params in refreshes if 'pojazdy_godzinowe' in sql)
+        daily = next(params for sql, params in refreshes if 'pojazdy_dzienne' in sql)
+        self.assertEqual(hourly[0], [datetime(2025, 1, 20, 12), datetime(2025, 1, 20, 13)])
+        self.assertEqual(daily, ([datetime(2025, 1, 20)], ['12345']))
+        # Tabele agregatów tworzy migracja schematu, a nie zapis
+        sql = [call[0][0] for call in mock_cursor.execute.call_args_list]
+        self.assertFalse(any('to_regclass' in query or 'IF NOT EXISTS pojazdy_godzinowe' in query for query in sql))
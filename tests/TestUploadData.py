@@ -1,14 +1,20 @@
 import unittest
 from unittest.mock import patch, MagicMock
 from datetime import datetime
+import numpy as np
 import pandas as pd
 from io import BytesIO
+import tempfile
 from datetime import timedelta
-from Inz.wykres import load_data, process_data_db, update_database
+from Inz.wykres import load_data, load_aggregated_data, process_data_db, update_database, ParseCache, \
+    compact_vehicle_frame
 
 
 class TestDataProcessing(unittest.TestCase):
     def setUp(self):
+        cache = patch('Inz.wykres.parse_cache', ParseCache(tempfile.mkdtemp()))
+        cache.start()
+        self.addCleanup(cache.stop)
         self.valid_file_name = "114_A_145_2025-01-20_POJAZDY.xlsx"
         self.invalid_file_name = "invalid_file.xlsx"
         self.valid_data = {
@@ -87,6 +93,109 @@ class TestDataProcessing(unittest.TestCase):
         self.assertIsNotNone(error)
         self.assertIn("Niepotrzebne kolumny", error)
 
+    def make_csv(self, df, sep=',', decimal='.'):
+        file_mock = BytesIO(df.to_csv(index=False, sep=sep, decimal=decimal).encode('utf-8'))
+        file_mock.filename = self.valid_file_name.replace('.xlsx', '.csv')
+        return file_mock
+
+    def test_load_data_csv(self):
+        df, error = load_data(self.make_csv(self.df_valid))
+        self.assertIsNone(error)
+        self.assertEqual(len(df), 2)
+        self.assertEqual(df.attrs['Numer odcinka'], '114_A_145')
+        self.assertNotIn('Numer odcinka', df.columns)
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(df['Data']))
+
+    def test_load_data_xlsx_compact_dtypes(self):
+        file_mock = BytesIO()
+        self.df_valid.to_excel(file_mock, index=False, engine='openpyxl')
+        file_mock.seek(0)
+        file_mock.filename = self.valid_file_name
+
+        df, error = load_data(file_mock)
+        self.assertIsNone(error)
+        self.assertNotIn('Id', df.columns)
+        self.assertEqual(df.attrs['Numer odcinka'], '114_A_145')
+        self.assertIsInstance(df['Kategoria'].dtype, pd.CategoricalDtype)
+        self.assertEqual(df['Pas ruchu'].dtype, 'int8')
+        self.assertEqual(df['Prędkość'].dtype, 'float64')
+
+        processed = process_data_db(df)
+        self.assertEqual(processed['Numer odcinka'].tolist(), ['114_A_145', '114_A_145'])
+        self.assertEqual(processed['Średnia prędkość H Pas 1'].iloc[0], 50)
+
+    def test_load_data_csv_extra_columns(self):
+        df_invalid = self.df_valid.copy()
+        df_invalid['Dodatkowa kolumna'] = 'wartość domyślna'
+
+        df, error = load_data(self.make_csv(df_invalid))
+        self.assertIsNone(df)
+        self.assertIn("Niepotrzebne kolumny", error)
+
+    def test_load_aggregated_data_csv_matches_xlsx(self):
+        # Dane z kilku kubełków 15-minutowych, czytane fragmentami po 3 wiersze
+        df = pd.DataFrame({
+            'Id': range(8),
+            'Data': pd.date_range('2024-01-01 12:00:00', periods=8, freq='7min'),
+            'Kategoria': ['H', 'L', 'L', 'H', 'L', 'H', 'L', 'L'],
+            'Pas ruchu': [1, 2, 1, 2, 1, 1, 2, 2],
+            'Prędkość': [50.5, 60, 70, 80, 90, 100, 110, 120],
+            'Przestrzeń między poprzedzającym pojazdem w dziesiętnych częściach sekundy': [1, 2, 3, 4, 5, 6, 7, 8],
+            'Długość pojazdu w cm': [400, 450, 500, 550, 600, 650, 700, 750],
+            'Kierunek pod prąd': [0, 1, 0, 0, 1, 0, 0, 0],
+        })
+        xlsx_mock = BytesIO()
+        df.to_excel(xlsx_mock, index=False, engine='openpyxl')
+        xlsx_mock.seek(0)
+        xlsx_mock.filename = self.valid_file_name
+
+        expected, error = load_aggregated_data(xlsx_mock)
+        self.assertIsNone(error)
+        with patch("Inz.wykres.CSV_CHUNK_ROWS", 3):
+            for sep, decimal in [(',', '.'), (';', ',')]:
+                result, error = load_aggregated_data(self.make_csv(df, sep=sep, decimal=decimal))
+                self.assertIsNone(error)
+                pd.testing.assert_frame_equal(result, expected)
+
+    def test_csv_empty_integer_cells_match_xlsx(self):
+        # Puste pola w kolumnach całkowitych tylko w jednym z fragmentów
+        df = pd.DataFrame({
+            'Id': range(6),
+            'Data': pd.date_range('2024-01-01 12:00:00', periods=6, freq='7min'),
+            'Kategoria': ['H', 'L', 'L', 'H', 'L', 'H'],
+            'Pas ruchu': [1, 2, 1, None, 1, 2],
+            'Prędkość': [50, 60, 70, 80, 90, 100],
+            'Przestrzeń między poprzedzającym pojazdem w dziesiętnych częściach sekundy': [1, 2, 3, 4, 5, 6],
+            'Długość pojazdu w cm': [400, 450, 500, 550, 600, 650],
+            'Kierunek pod prąd': [0, 1, 0, 0, None, 1],
+        })
+        xlsx_mock = BytesIO()
+        df.to_excel(xlsx_mock, index=False, engine='openpyxl')
+        xlsx_mock.seek(0)
+        xlsx_mock.filename = self.valid_file_name
+        expected, error = load_aggregated_data(xlsx_mock)
+        self.assertIsNone(error)
+
+        with patch("Inz.wykres.CSV_CHUNK_ROWS", 3):
+            result, error = load_aggregated_data(self.make_csv(df))
+            self.assertIsNone(error)
+            pd.testing.assert_frame_equal(result, expected)
+
+            df, error = load_data(self.make_csv(df))
+        self.assertIsNone(error)
+        self.assertEqual(df['Pas ruchu'].dtype, 'float64')
+        self.assertEqual(df['Kierunek pod prąd'].isna().sum(), 1)
+
+    def test_load_aggregated_data_csv_missing_columns(self):
+        result, error = load_aggregated_data(self.make_csv(self.df_valid.drop(columns=['Kategoria'])))
+        self.assertIsNone(result)
+        self.assertIn("Brakujące kolumny", error)
+
+    def test_load_aggregated_data_csv_empty(self):
+        with self.assertRaises(ValueError) as context:
+            load_aggregated_data(self.make_csv(self.df_valid.iloc[0:0]))
+        self.assertEqual(str(context.exception), "DataFrame jest pusty.")
+
     def test_process_data_db_valid(self):
         self.df_valid["Data 15min"] = self.df_valid["Data"].apply(
             lambda x: x - timedelta(minutes=x.minute % 15, seconds=x.second, microseconds=x.microsecond))
@@ -97,6 +206,35 @@ class TestDataProcessing(unittest.TestCase):
         self.assertIn("Liczba na pasie 1", df_processed.columns)
         self.assertIn("Średnia prędkość H Pas 1", df_processed.columns)
 
+    def test_compact_dtypes_keep_float64_means(self):
+        # Ułamkowe prędkości: średnie po compact_vehicle_frame muszą być takie jak z danych float64
+        rng = np.random.default_rng(0)
+        n = 20000
+        df = pd.DataFrame({
+            'Id': range(n),
+            # Ok. 23 tys. małych grup (60 dni x 96 kubełków x pas x kategoria)
+            'Data': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 60 * 86400, n), unit='s'),
+            'Kategoria': rng.choice(['H', 'L'], n),
+            'Pas ruchu': rng.integers(1, 3, n),
+            # Jedno miejsce po przecinku - średnie często leżą na granicy zaokrąglenia do 0,1
+            'Prędkość': rng.integers(400, 1300, n) / 10,
+            'Przestrzeń między poprzedzającym pojazdem w dziesiętnych częściach sekundy': rng.uniform(1, 100, n),
+            'Długość pojazdu w cm': rng.integers(3000, 18000, n) / 10,
+            'Kierunek pod prąd': rng.integers(0, 2, n),
+            'Numer odcinka': '123_MR',
+        })
+        processed = process_data_db(compact_vehicle_frame(df)).set_index('Data 15min')
+
+        groups = df.groupby([df['Data'].dt.floor('15min'), 'Pas ruchu', 'Kategoria'])
+        for column, name in [('Prędkość', 'Średnia prędkość'), ('Długość pojazdu w cm', 'Średnia długość')]:
+            expected = groups[column].mean().round(1)
+            for lane in (1, 2):
+                for category in ('H', 'L'):
+                    pd.testing.assert_series_equal(
+                        processed[f'{name} {category} Pas {lane}'],
+                        expected.xs((lane, category), level=['Pas ruchu', 'Kategoria']).reindex(processed.index),
+                        check_names=False, check_index_type=False, check_freq=False)
+
     def test_process_data_db_empty_dataframe(self):
         df_empty = pd.DataFrame()
         with self.assertRaises(ValueError) as context:
@@ -109,20 +247,38 @@ class TestDataProcessing(unittest.TestCase):
         self.assertEqual(str(context.exception), "Oczekiwano obiektu DataFrame.")
 
     @patch("Inz.wykres.connect_db")
-    @patch("Inz.wykres.connect")
-    def test_update_database_existing_record(self, mock_cursor, mock_connect_db):
+    def test_update_database_existing_record(self, mock_connect_db):
         # Mocking database connection and cursor
-        mock_conn = MagicMock()
-        mock_cursor.return_value = mock_conn.cursor.return_value
-        mock_cursor.return_value.fetchone.return_value = {'data_15min': '2025-01-30 12:00:00', 'numer_odcinka': '12345'}
+        mock_cursor = mock_connect_db.return_value.cursor.return_value
+        mock_cursor.fetchall.return_value = [(datetime(2025, 1, 30, 12, 0), '12345')]
 
         df = pd.DataFrame({
-            'Data 15min': [datetime(2025, 1, 30, 12, 0)],
-            'Numer odcinka': ['12345'],
-            'Średnia przestrzeń między pojazdem': [1.5]
+            'Data 15min': [datetime(2025, 1, 30, 12, 0), datetime(2025, 1, 30, 12, 15)],
+            'Numer odcinka': ['12345', '12345'],
+            'Średnia przestrzeń między pojazdem': [1.5, 2.5]
         })
 
         existing_records = update_database(df)
 
-        # Ensure existing_records is True since the record exists
+        # Ensure the conflicting key is reported
         self.assertTrue(existing_records)
+        self.assertEqual(existing_records, [(datetime(2025, 1, 30, 12, 0), '12345')])
+
+        # All keys are checked with a single query; the table itself is created by schema migrations
+        self.assertEqual(mock_cursor.execute.call_count, 1)
+        query, params = mock_cursor.execute.call_args[0]
+        self.assertIn("unnest", query)
+        self.assertEqual(params[0], [datetime(2025, 1, 30, 12, 0), datetime(2025, 1, 30, 12, 15)])
+        self.assertEqual(params[1], ['12345', '12345'])
+
+    @patch("Inz.wykres.connect_db")
+    def test_update_database_no_conflicts(self, mock_connect_db):
+        mock_cursor = mock_connect_db.return_value.cursor.return_value
+        mock_cursor.fetchall.return_value = []
+
+        df = pd.DataFrame({
+            'Data 15min': [datetime(2025, 1, 30, 12, 0)],
+            'Numer odcinka': ['12345'],
+        })
+
+        self.assertEqual(update_database(df), [])
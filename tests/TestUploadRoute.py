@@ -1,7 +1,9 @@
 import unittest
 from unittest.mock import patch, MagicMock
+import zipfile
 from io import BytesIO
-from Inz.wykres import app
+import pandas as pd
+from Inz.wykres import app, get_upload_executor
 
 
 class UploadTestCase(unittest.TestCase):
@@ -96,7 +98,7 @@ class UploadTestCase(unittest.TestCase):
 
         mock_load_data.return_value = (MagicMock(), None)
         mock_process_data.return_value = MagicMock()
-        mock_update_db.return_value = True  # Istniejące rekordy
+        mock_update_db.return_value = [('2025-01-20 12:00:00', '145')]  # Istniejące rekordy
         mock_save_data.return_value = "temp_id_123"
 
         data = {
@@ -111,6 +113,7 @@ class UploadTestCase(unittest.TestCase):
         self.assertEqual(json_data['message'], "Znaleziono istniejące rekordy. Czy chcesz je nadpisać?")
         self.assertTrue(json_data['requires_confirmation'])
         self.assertEqual(json_data['temp_id'], "temp_id_123")
+        self.assertEqual(json_data['conflicts'], 1)
 
     @patch('Inz.wykres.load_data')
     @patch('Inz.wykres.process_data_db')
@@ -211,3 +214,105 @@ class DisconnectDBTestCase(unittest.TestCase):
         json_data = response.get_json()
         self.assertFalse(json_data['success'])
         self.assertEqual(json_data['message'], 'Nie ma aktywnego połączenia z bazą danych.')
+
+
+class UploadBatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = app
+        self.app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for testing
+        self.client = self.app.test_client()
+
+        self.app.config['SESSION_COOKIE_SECURE'] = False
+        self.app.config['SESSION_COOKIE_HTTPONLY'] = False
+        self.app.config['SESSION_COOKIE_SAMESITE'] = None
+
+        with self.client.session_transaction() as sess:
+            sess['db_name'] = 'test_db'
+
+    def make_csv(self, day):
+        df = pd.DataFrame({
+            'Id': [1, 2],
+            'Data': [f'{day} 12:00:00', f'{day} 12:20:00'],
+            'Kategoria': ['H', 'L'],
+            'Pas ruchu': [1, 2],
+            'Prędkość': [50, 60],
+            'Przestrzeń między poprzedzającym pojazdem w dziesiętnych częściach sekundy': [1, 2],
+            'Długość pojazdu w cm': [400, 450],
+            'Kierunek pod prąd': [0, 1],
+        })
+        return df.to_csv(index=False).encode('utf-8')
+
+    @patch('Inz.wykres.UPLOAD_WORKERS', 1)
+    @patch('Inz.wykres.update_database', return_value=[])
+    @patch('Inz.wykres.update_database_with_confirmation')
+    def test_upload_batch_success(self, mock_update_db_with_confirmation, mock_update_db):
+        """Test przesłania kilku plików - jedno sprawdzenie konfliktów i jeden zapis"""
+        data = {
+            'files': [
+                (BytesIO(self.make_csv('2025-01-20')), '114_A_1_145_2025-01-20_POJAZDY.csv'),
+                (BytesIO(self.make_csv('2025-01-21')), '114_A_1_145_2025-01-21_POJAZDY.csv'),
+                (BytesIO(b'file_data'), 'plik.csv'),
+            ]
+        }
+
+        response = self.client.post('/upload_batch', data=data, content_type='multipart/form-data')
+
+        json_data = response.get_json()
+        self.assertTrue(json_data['success'])
+        self.assertEqual([file.get('rows') for file in json_data['files']], [2, 2, None])
+        self.assertIn("Niepoprawny schemat nazwy pliku", json_data['files'][2]['error'])
+
+        mock_update_db.assert_called_once()
+        mock_update_db_with_confirmation.assert_called_once()
+        stored_df = mock_update_db_with_confirmation.call_args[0][0]
+        self.assertEqual(len(stored_df), 4)
+
+    @patch('Inz.wykres.UPLOAD_WORKERS', 1)
+    @patch('Inz.wykres.update_database', return_value=[('2025-01-20 12:00:00', '114_A_1_145')])
+    @patch('Inz.wykres.create_temp_data_table')
+    @patch('Inz.wykres.save_data_to_db', return_value=7)
+    def test_upload_batch_zip_with_conflicts(self, mock_save_data, mock_create_table, mock_update_db):
+        """Test archiwum zip, gdy w bazie istnieją już rekordy"""
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            zip_file.writestr('dane/114_A_1_145_2025-01-20_POJAZDY.csv', self.make_csv('2025-01-20'))
+        archive.seek(0)
+
+        response = self.client.post('/upload_batch', data={'files': [(archive, 'dane.zip')]},
+                                    content_type='multipart/form-data')
+
+        json_data = response.get_json()
+        self.assertTrue(json_data['requires_confirmation'])
+        self.assertEqual(json_data['temp_id'], 7)
+        self.assertEqual(json_data['files'], [{'file': '114_A_1_145_2025-01-20_POJAZDY.csv', 'rows': 2}])
+
+    @patch('Inz.wykres.UPLOAD_WORKERS', 1)
+    @patch('Inz.wykres.update_database', return_value=[])
+    @patch('Inz.wykres.update_database_with_confirmation')
+    def test_upload_batch_reports_duplicate_keys(self, mock_update_db_with_confirmation, mock_update_db):
+        """Te same przedziały w dwóch plikach - zapisywany jest ostatni, pierwszy plik je raportuje"""
+        name = '114_A_1_145_2025-01-20_POJAZDY.csv'
+        data = {'files': [(BytesIO(self.make_csv('2025-01-20')), name),
+                          (BytesIO(self.make_csv('2025-01-20')), name)]}
+
+        json_data = self.client.post('/upload_batch', data=data, content_type='multipart/form-data').get_json()
+
+        self.assertEqual(json_data['files'][0]['duplicates'], [['114_A_1_145', '2025-01-20 12:00:00'],
+                                                               ['114_A_1_145', '2025-01-20 12:15:00']])
+        self.assertNotIn('duplicates', json_data['files'][1])
+        self.assertEqual(len(mock_update_db_with_confirmation.call_args[0][0]), 2)
+
+    @patch('Inz.wykres._upload_executor', None)
+    @patch('Inz.wykres.ProcessPoolExecutor')
+    def test_upload_executor_uses_spawn(self, mock_executor):
+        get_upload_executor()
+        self.assertEqual(mock_executor.call_args.kwargs['mp_context'].get_start_method(), 'spawn')
+
+    def test_upload_batch_all_files_invalid(self):
+        data = {'files': [(BytesIO(b'not a zip'), 'dane.zip')]}
+
+        response = self.client.post('/upload_batch', data=data, content_type='multipart/form-data')
+
+        json_data = response.get_json()
+        self.assertEqual(json_data['error'], "Żaden plik nie został poprawnie przetworzony.")
+        self.assertEqual(json_data['files'], [{'file': 'dane.zip', 'error': "Niepoprawne archiwum zip."}])
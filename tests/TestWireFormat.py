@@ -0,0 +1,130 @@
+import unittest
+from unittest.mock import patch
+import gzip
+import json
+import re
+import pandas as pd
+from Inz.wykres import app, plot_cache, time_axis, columnar_chart, pa, brotli, COLUMNAR_MIMETYPE, \
+    ARROW_STREAM_MIMETYPE
+
+
+def profile(values):
+    return pd.DataFrame({'Okres': 0, 'numer_odcinka': '101', 'godzina': range(len(values)),
+                         'Liczba samochodów': values})
+
+
+class TestColumnarChart(unittest.TestCase):
+
+    def test_evenly_spaced_axis_is_implicit(self):
+        self.assertEqual(time_axis(['07:00:00', '08:00:00', '09:00:00']),
+                         {'kind': 'time', 'start': 25200, 'step': 3600, 'count': 3})
+
+    def test_gaps_keep_explicit_axis(self):
+        self.assertEqual(time_axis(['07:00:00', '09:00:00', '10:00:00']),
+                         {'values': ['07:00:00', '09:00:00', '10:00:00']})
+        self.assertEqual(time_axis(['07:00:00']), {'values': ['07:00:00']})
+
+    def test_series_become_columns(self):
+        chart_data = {'x': ['00:00:00', '01:00:00'], 'labels': {'title': 't'},
+                      'series': [{'name': '101', 'section': '101', 'period': 'Okres 1', 'y': [1.0, None]}]}
+        columnar = columnar_chart(chart_data)
+        self.assertEqual(columnar['columns'], [{'key': 'series', 'name': '101', 'section': '101',
+                                                'period': 'Okres 1', 'values': [1.0, None]}])
+        self.assertEqual(columnar['labels'], {'title': 't'})
+        self.assertNotIn('x', columnar)
+
+
+class WireFormatTestCase(unittest.TestCase):
+
+    def setUp(self):
+        app.config['WTF_CSRF_ENABLED'] = False
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['db_name'] = 'test_db'
+        plot_cache.clear()
+        self.form = {'start_date_1': '2025-01-01', 'end_date_1': '2025-01-31', 'car_type': 'both',
+                     'section_number': '101 - A1'}
+
+    def post_plot(self, **headers):
+        with patch('Inz.wykres.reverse_format_section', return_value=('101', None)), \
+                patch('Inz.wykres.fetch_period_profiles', return_value=(profile([1.5] * 24), None)):
+            return self.client.post('/plot', data=self.form, headers=headers)
+
+    def test_default_response_is_plain_json(self):
+        response = self.post_plot()
+        self.assertEqual(response.mimetype, 'application/json')
+        self.assertEqual(response.get_json()['chart_data']['y1'], [1.5] * 24)
+
+    def test_columnar_response(self):
+        response = self.post_plot(Accept=f'{COLUMNAR_MIMETYPE}, application/json;q=0.5')
+        self.assertEqual(response.mimetype, COLUMNAR_MIMETYPE)
+        self.assertIn('Accept', response.headers['Vary'])
+        data = json.loads(response.get_data())
+        self.assertEqual(data['axis'], {'kind': 'time', 'start': 0, 'step': 3600, 'count': 24})
+        self.assertEqual(data['columns'], [{'key': 'y1', 'values': [1.5] * 24}])
+        self.assertEqual(data['start_date_1'], '2025-01-01')
+
+    @patch('Inz.wykres.pa', None)
+    def test_arrow_without_pyarrow_falls_back_to_columnar(self):
+        response = self.post_plot(Accept=f'{ARROW_STREAM_MIMETYPE}, {COLUMNAR_MIMETYPE};q=0.9')
+        self.assertEqual(response.mimetype, COLUMNAR_MIMETYPE)
+
+    @unittest.skipIf(pa is None, "brak pyarrow")
+    def test_arrow_response(self):
+        response = self.post_plot(Accept=ARROW_STREAM_MIMETYPE)
+        self.assertEqual(response.mimetype, ARROW_STREAM_MIMETYPE)
+        table = pa.ipc.open_stream(response.get_data()).read_all()
+        self.assertEqual(table.column('c0').to_pylist(), [1.5] * 24)
+        meta = json.loads(table.schema.metadata[b'chart'])
+        self.assertEqual(meta['axis']['count'], 24)
+        self.assertEqual(meta['columns'], [{'key': 'y1'}])
+
+    def test_page_fetch_sends_csrf_token(self):
+        app.config['WTF_CSRF_ENABLED'] = True
+        self.addCleanup(app.config.update, WTF_CSRF_ENABLED=False)
+        token = re.search(r'var csrf_token = "([^"]+)"', self.client.get('/').get_data(as_text=True)).group(1)
+        headers = {'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8', 'Accept': COLUMNAR_MIMETYPE}
+
+        # Tak jak formularz wykresu: fetch z nagłówkiem X-CSRFToken, bez pola csrf_token w treści
+        response = self.post_plot(**headers, **{'X-CSRFToken': token})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, COLUMNAR_MIMETYPE)
+
+        self.assertEqual(self.post_plot(**headers).status_code, 400)
+
+    def test_large_body_is_gzipped(self):
+        with patch('Inz.wykres.brotli', None), patch('Inz.wykres.COMPRESS_MIN_BYTES', 100):
+            response = self.post_plot(**{'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(response.get_data()))['chart_data']['y1'], [1.5] * 24)
+
+    @unittest.skipIf(brotli is None, "brak brotli")
+    def test_brotli_is_preferred(self):
+        with patch('Inz.wykres.COMPRESS_MIN_BYTES', 100):
+            response = self.post_plot(**{'Accept-Encoding': 'gzip, br'})
+        self.assertEqual(response.headers['Content-Encoding'], 'br')
+        self.assertIn('chart_data', json.loads(brotli.decompress(response.get_data())))
+
+    def test_small_body_is_not_compressed(self):
+        with patch('Inz.wykres.COMPRESS_MIN_BYTES', 10 ** 6):
+            response = self.post_plot(**{'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    @patch('Inz.wykres.pd.read_sql_query', return_value=pd.DataFrame({'numer_odcinka': ['114_A_1_145']}))
+    @patch('Inz.wykres.connect_db')
+    @patch('Inz.wykres.load_reference_data')
+    @patch('Inz.wykres.os.path.isfile', return_value=True)
+    def test_sections_columnar(self, mock_isfile, mock_reference, mock_connect_db, mock_read_sql):
+        mock_reference.return_value.by_id = {'114_A_1_145': {'droga': 'A1', 'pikietaż': '10+200',
+                                                             'lokalizacja': 'Gdańsk'}}
+        response = self.client.get('/get_sections', headers={'Accept': COLUMNAR_MIMETYPE})
+        self.assertEqual(json.loads(response.get_data())['columns'],
+                         {'numer': ['145'], 'droga': ['A1'], 'km': ['10+200'], 'lokalizacja': ['Gdańsk']})
+
+        response = self.client.get('/get_sections')
+        self.assertEqual(response.get_json(), ['145 (A1, km 10+200, Gdańsk)'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,20 +1,50 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, g, has_request_context, \
+    has_app_context, Response, stream_with_context
 from flask_wtf.csrf import CSRFProtect
+import click
 from cryptography.fernet import Fernet
+import numpy as np
 import pandas as pd
 from pandas.io.sql import DatabaseError
 import io
+import json
 import time
-import pickle
 import csv
 import re
+import bisect
+import hashlib
+import struct
 import os
 import warnings
-from datetime import datetime, timedelta
+import threading
+import tempfile
+import uuid
+import queue
+import zipfile
+import zlib
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+from functools import lru_cache, partial, wraps
+from itertools import accumulate
+from datetime import datetime, timedelta, time as dt_time
 from dotenv import load_dotenv
 import psycopg2
 from psycopg2 import OperationalError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import PoolError
+
+# Opcjonalne: format Arrow IPC i kompresja brotli odpowiedzi
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 warnings.filterwarnings("ignore", category=UserWarning, message="pandas only supports SQLAlchemy connectable")
 
@@ -37,23 +67,663 @@ FERNET_KEY = os.getenv('FERNET_KEY', Fernet.generate_key())
 cipher = Fernet(FERNET_KEY)
 
 
+# Granice kubełków histogramów etapów przetwarzania: czas w sekundach i liczba wierszy
+STAGE_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+STAGE_ROWS_BUCKETS = (10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+
+class Histogram:
+    """Histogram w formacie Prometheus z etykietą stage, przechowywany w pamięci procesu."""
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self._series = {}  # etap -> [liczności kubełków (bez sumowania), suma, liczba obserwacji]
+        self._lock = threading.Lock()
+
+    def observe(self, stage, value):
+        with self._lock:
+            series = self._series.setdefault(stage, [[0] * (len(self.buckets) + 1), 0.0, 0])
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self, stage):
+        """Zwraca (skumulowane liczności kubełków, suma, liczba obserwacji) albo None."""
+        with self._lock:
+            series = self._series.get(stage)
+            if series is None:
+                return None
+            return list(accumulate(series[0])), series[1], series[2]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            stages = sorted(self._series)
+        for stage in stages:
+            counts, total, count = self.snapshot(stage)
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                lines.append(f'{self.name}_bucket{{stage="{stage}",le="{bound}"}} {bucket_count}')
+            lines.append(f'{self.name}_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{self.name}_count{{stage="{stage}"}} {count}')
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+stage_durations = Histogram('inz_stage_duration_seconds', "Czas trwania etapów przetwarzania.",
+                            STAGE_DURATION_BUCKETS)
+stage_rows = Histogram('inz_stage_rows', "Liczba wierszy przetworzonych w etapie.", STAGE_ROWS_BUCKETS)
+
+
+def record_stage(stage, seconds, rows=None):
+    """Zapisuje czas etapu w histogramach i, w trakcie żądania, w nagłówku Server-Timing."""
+    stage_durations.observe(stage, seconds)
+    if rows is not None:
+        stage_rows.observe(stage, rows)
+    if has_request_context():
+        timings = g.setdefault('stage_timings', {})
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timed_stage(stage, rows=None):
+    """Mierzy czas bloku; liczbę wierszy można ustawić w trakcie przez timer['rows']."""
+    timer = {'rows': rows}
+    started = time.perf_counter()
+    try:
+        yield timer
+    finally:
+        record_stage(stage, time.perf_counter() - started, timer['rows'])
+
+
+def _result_rows(result):
+    frame = result[0] if isinstance(result, tuple) and result else result
+    return len(frame) if isinstance(frame, (pd.DataFrame, np.ndarray)) else None
+
+
+def timed(stage, input_rows=False):
+    """Dekorator mierzący czas funkcji jako etap stage.
+
+    Liczba wierszy pochodzi z ramki przekazanej jako pierwszy argument (input_rows=True)
+    albo z ramki zwróconej przez funkcję (także jako pierwszy element krotki).
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with timed_stage(stage, len(args[0]) if input_rows else None) as timer:
+                result = function(*args, **kwargs)
+                if not input_rows:
+                    timer['rows'] = _result_rows(result)
+            return result
+        return wrapper
+    return decorator
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def add_server_timing(response):
+    timings = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in g.get('stage_timings', {}).items()]
+    if 'request_started' in g:
+        timings.append(f"total;dur={(time.perf_counter() - g.request_started) * 1000:.1f}")
+    if timings:
+        response.headers['Server-Timing'] = ', '.join(timings)
+    return response
+
+
+# Format przesyłu odpowiedzi: kolumnowy JSON z niejawną osią czasu, opcjonalnie Arrow IPC
+COLUMNAR_MIMETYPE = 'application/vnd.inz.columnar+json'
+ARROW_STREAM_MIMETYPE = 'application/vnd.apache.arrow.stream'
+# Kompresja odpowiedzi większych niż COMPRESS_MIN_BYTES
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+COMPRESS_MIMETYPES = {'application/json', COLUMNAR_MIMETYPE, ARROW_STREAM_MIMETYPE, 'text/plain', 'text/html'}
+
+
+def response_format(formats=(ARROW_STREAM_MIMETYPE, COLUMNAR_MIMETYPE)):
+    """Najbardziej zwarty z formatów jawnie wymienionych w nagłówku Accept albo 'application/json'.
+
+    Same symbole wieloznaczne (*/*) oznaczają zwykły JSON, tak jak dotychczas.
+    """
+    requested = {mimetype: quality for mimetype, quality in request.accept_mimetypes if quality > 0}
+    available = [mimetype for mimetype in formats if mimetype in requested
+                 and (mimetype != ARROW_STREAM_MIMETYPE or pa is not None)]
+    if not available:
+        return 'application/json'
+    return max(available, key=lambda mimetype: requested[mimetype])
+
+
+def time_axis(x):
+    """Oś godzin (HH:MM:SS) jako początek i krok w sekundach, gdy punkty są równo rozłożone."""
+    try:
+        seconds = pd.to_timedelta(pd.Index(x, dtype=object)).total_seconds().to_numpy()
+    except (ValueError, TypeError):
+        return {'values': list(x)}
+    steps = np.diff(seconds)
+    if len(seconds) < 2 or steps[0] <= 0 or (steps != steps[0]).any():
+        return {'values': list(x)}
+    return {'kind': 'time', 'start': int(seconds[0]), 'step': int(steps[0]), 'count': len(seconds)}
+
+
+def columnar_chart(chart_data):
+    """chart_data w układzie kolumnowym: oś 'axis' i lista kolumn wartości (y1, y2 lub serie)."""
+    columns = [{'key': key, 'values': chart_data[key]} for key in ('y1', 'y2') if key in chart_data]
+    columns += [{'key': 'series', **{name: value for name, value in series.items() if name != 'y'},
+                 'values': series['y']} for series in chart_data.get('series', [])]
+    meta = {key: value for key, value in chart_data.items() if key not in ('x', 'y1', 'y2', 'series')}
+    return {'format': 'columnar', 'axis': time_axis(chart_data['x']), 'columns': columns, **meta}
+
+
+def arrow_chart(columnar):
+    """Arrow IPC (strumień): kolumna float64 na serię, pozostałe pola w metadanych schematu 'chart'.
+
+    Zwraca None, gdy kolumny mają różne długości.
+    """
+    if len({len(column['values']) for column in columnar['columns']}) > 1:
+        return None
+    table = pa.table({f"c{i}": pa.array(column['values'], type=pa.float64())
+                      for i, column in enumerate(columnar['columns'])})
+    meta = {**columnar, 'columns': [{name: value for name, value in column.items() if name != 'values'}
+                                    for column in columnar['columns']]}
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema.with_metadata({'chart': json.dumps(meta)})) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def chart_response(payload):
+    """Odpowiedź /plot w formacie wybranym przez klienta (Accept); domyślnie dotychczasowy JSON."""
+    mimetype = response_format()
+    if mimetype == 'application/json':
+        response = jsonify(**payload)
+    else:
+        columnar = columnar_chart(payload['chart_data'])
+        body = arrow_chart(columnar) if mimetype == ARROW_STREAM_MIMETYPE else None
+        if body is None:
+            mimetype, body = COLUMNAR_MIMETYPE, json.dumps(columnar, separators=(',', ':'))
+        response = Response(body, mimetype=mimetype)
+    response.vary.add('Accept')
+    return response
+
+
+def response_encoding():
+    """Kodowanie kompresji akceptowane przez klienta: br (gdy dostępne brotli), gzip albo None."""
+    encodings = request.accept_encodings
+    if brotli is not None and encodings['br'] and encodings['br'] >= encodings['gzip']:
+        return 'br'
+    return 'gzip' if encodings['gzip'] else None
+
+
+@app.after_request
+def compress_response(response):
+    if (response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers
+            or response.status_code != 200 or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    encoding = response_encoding()
+    if len(data) < COMPRESS_MIN_BYTES or encoding is None:
+        return response
+    response.set_data(brotli.compress(data) if encoding == 'br' else b''.join(gzip_chunks([data])))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+# Ustawienia puli połączeń z bazą danych
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+DB_POOL_CHECKOUT_TIMEOUT = float(os.getenv('DB_POOL_CHECKOUT_TIMEOUT', '10'))
+DB_POOL_IDLE_TIMEOUT = float(os.getenv('DB_POOL_IDLE_TIMEOUT', '300'))
+DB_POOL_HEALTHCHECK_AFTER = float(os.getenv('DB_POOL_HEALTHCHECK_AFTER', '30'))
+# Odstęp między kolejnymi próbami migracji schematu po błędzie (sekundy)
+SCHEMA_RETRY_AFTER = float(os.getenv('SCHEMA_RETRY_AFTER', '300'))
+
+SESSION_DB_KEYS = ['db_name', 'db_user', 'db_password', 'db_host', 'db_port']
+
+
+class ConnectionPool:
+    """Ograniczona pula połączeń PostgreSQL dla jednego zestawu danych logowania."""
+
+    def __init__(self, connect_kwargs, max_size=DB_POOL_MAX_SIZE, checkout_timeout=DB_POOL_CHECKOUT_TIMEOUT,
+                 idle_timeout=DB_POOL_IDLE_TIMEOUT, healthcheck_after=DB_POOL_HEALTHCHECK_AFTER):
+        self.connect_kwargs = connect_kwargs
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.idle_timeout = idle_timeout
+        self.healthcheck_after = healthcheck_after
+        self._idle = deque()  # (połączenie, czas ostatniego użycia)
+        self._in_use = 0
+        self._cond = threading.Condition()
+        # Migracje schematu wykonywane są raz na proces dla każdej bazy
+        self.schema_ready = False
+        self.schema_lock = threading.Lock()
+        # Po nieudanej migracji kolejna próba dopiero po SCHEMA_RETRY_AFTER, a nie przy każdym połączeniu
+        self.schema_retry_at = 0.0
+        self.schema_error = None
+
+    def getconn(self):
+        deadline = time.monotonic() + self.checkout_timeout
+        with self._cond:
+            while True:
+                self._evict_idle()
+                if self._idle:
+                    # LIFO - najczęściej używane połączenia pozostają "ciepłe"
+                    conn, last_used = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._in_use < self.max_size:
+                    conn, last_used = None, None
+                    self._in_use += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolError("Przekroczono czas oczekiwania na wolne połączenie z bazą danych.")
+                self._cond.wait(remaining)
+
+        try:
+            if conn is not None and (conn.closed or (time.monotonic() - last_used > self.healthcheck_after
+                                                     and not self._is_alive(conn))):
+                self._close_quietly(conn)
+                conn = None
+            if conn is None:
+                conn = psycopg2.connect(**self.connect_kwargs)
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            try:
+                # Niezatwierdzona lub przerwana transakcja nie może przejść do kolejnego żądania
+                if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            if discard or conn.closed:
+                self._close_quietly(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def evict_idle(self):
+        with self._cond:
+            self._evict_idle()
+
+    def closeall(self):
+        with self._cond:
+            while self._idle:
+                self._close_quietly(self._idle.popleft()[0])
+
+    def _evict_idle(self):
+        # Najstarsze nieużywane połączenia znajdują się na początku kolejki
+        now = time.monotonic()
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            self._close_quietly(self._idle.popleft()[0])
+
+    @staticmethod
+    def _is_alive(conn):
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+class PooledConnection:
+    """Połączenie wypożyczone z puli - close() oddaje je do puli zamiast zamykać."""
+
+    def __init__(self, pool, conn, request_scoped=False):
+        self._pool = pool
+        self._conn = conn
+        self._request_scoped = request_scoped
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    @property
+    def raw(self):
+        return self._conn
+
+    def close(self):
+        if self._conn is None:
+            return
+        if self._request_scoped:
+            # Połączenie żądania wraca do puli dopiero w teardown, tu tylko czyścimy transakcję
+            if not self._conn.closed and self._conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                self._conn.rollback()
+            return
+        self.release()
+
+    def release(self, discard=False):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        self._pool.putconn(conn, discard=discard)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_last_pool_sweep = time.monotonic()
+
+
+@lru_cache(maxsize=128)
+def _decrypt_password(token):
+    return cipher.decrypt(token.encode()).decode()
+
+
+def get_pool(db_name, db_user, db_password, db_host, db_port):
+    """Zwraca pulę połączeń dla danych logowania (hasło w postaci zaszyfrowanej)."""
+    global _last_pool_sweep
+    password = _decrypt_password(db_password)
+    key = (db_name, db_user, password, db_host, db_port)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(dict(dbname=db_name, user=db_user, password=password,
+                                                     host=db_host, port=db_port))
+        sweep = time.monotonic() - _last_pool_sweep > DB_POOL_IDLE_TIMEOUT / 2
+        if sweep:
+            _last_pool_sweep = time.monotonic()
+            pools = list(_pools.values())
+    if sweep:
+        # Zamykanie bezczynnych połączeń także w pulach, z których nikt już nie korzysta
+        for other in pools:
+            other.evict_idle()
+    return pool
+
+
+def session_credentials():
+    """Dane logowania do bazy z sesji (hasło zaszyfrowane) lub None, jeśli baza nie jest przypisana."""
+    if not all(key in session for key in SESSION_DB_KEYS):
+        return None
+    return tuple(session[key] for key in SESSION_DB_KEYS)
+
+
 def connect_db():
-    """Łączy się z bazą danych za pomocą danych z sesji."""
+    """Wypożycza połączenie z puli odpowiadającej danym logowania z sesji.
+
+    Poza żądaniem HTTP (zadania w tle) dane logowania pochodzą z g.db_credentials.
+    """
     global DATABASE_NAME
-    if not all(key in session for key in ['db_name', 'db_user', 'db_password', 'db_host', 'db_port']):
-        DATABASE_NAME = None
-        return redirect(url_for('index'))
-    DATABASE_NAME = session['db_name']
-    conn = psycopg2.connect(
-        dbname=session['db_name'],
-        user=session['db_user'],
-        password=cipher.decrypt(session['db_password'].encode()).decode(),
-        host=session['db_host'],
-        port=session['db_port']
-    )
+    if has_request_context():
+        credentials = session_credentials()
+        if credentials is None:
+            DATABASE_NAME = None
+            return redirect(url_for('index'))
+    else:
+        credentials = g.get('db_credentials')
+        if credentials is None:
+            raise RuntimeError("Brak danych logowania do bazy danych poza żądaniem HTTP.")
+    DATABASE_NAME = credentials[0]
+
+    # W obrębie jednego żądania (lub zadania) wszystkie funkcje pomocnicze korzystają z tego samego połączenia
+    context_scoped = has_app_context()
+    if context_scoped:
+        conn = g.pop('db_conn', None)
+        if conn is not None:
+            if conn.raw is not None and not conn.raw.closed:
+                g.db_conn = conn
+                return conn
+            conn.release(discard=True)
+
+    pool = get_pool(*credentials)
+    conn = PooledConnection(pool, pool.getconn(), request_scoped=context_scoped)
+    if context_scoped:
+        g.db_conn = conn
+    if not pool.schema_ready and time.monotonic() >= pool.schema_retry_at:
+        ensure_schema(pool, conn)
     return conn
 
 
+@app.teardown_appcontext
+def release_db_connection(exception=None):
+    conn = g.pop('db_conn', None)
+    if conn is not None and conn.raw is not None:
+        conn.release(discard=bool(conn.raw.closed))
+
+
+# Definicja kolumn tabeli pojazdy
+POJAZDY_DDL_COLUMNS = """
+        data_15min TIMESTAMP NOT NULL,
+        numer_odcinka TEXT NOT NULL,
+        srednia_przestrzen_pomiedzy_pojazdami NUMERIC,
+        liczba_samochodow_jadaca_pod_prad INTEGER,
+        liczba_na_pasie_1 INTEGER,
+        liczba_samochodow_h_pas_1 INTEGER,
+        srednia_predkosc_h_pas_1 NUMERIC,
+        srednia_dlugosc_h_pas_1 NUMERIC,
+        liczba_samochodow_l_pas_1 INTEGER,
+        srednia_predkosc_l_pas_1 NUMERIC,
+        srednia_dlugosc_l_pas_1 NUMERIC,
+        liczba_na_pasie_2 INTEGER,
+        liczba_samochodow_h_pas_2 INTEGER,
+        srednia_predkosc_h_pas_2 NUMERIC,
+        srednia_dlugosc_h_pas_2 NUMERIC,
+        liczba_samochodow_l_pas_2 INTEGER,
+        srednia_predkosc_l_pas_2 NUMERIC,
+        srednia_dlugosc_l_pas_2 NUMERIC"""
+
+# Identyfikatory blokad doradczych PostgreSQL
+SCHEMA_LOCK_ID = 724001
+PARTITION_LOCK_ID = 724002
+
+
+def _migrate_partitioned_pojazdy(cursor):
+    """Tabela pojazdy partycjonowana miesięcznie po data_15min; dane ze starej tabeli są przenoszone."""
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('pojazdy')")
+    row = cursor.fetchone()
+    relkind = row[0] if row else None
+    if relkind == 'p':
+        return
+    if relkind is not None:
+        cursor.execute("ALTER TABLE pojazdy RENAME TO pojazdy_legacy")
+
+    # Klucz główny w kolejności (odcinek, czas) obsługuje zapytania o zakres dat jednego odcinka
+    cursor.execute(f"""
+    CREATE TABLE pojazdy ({POJAZDY_DDL_COLUMNS},
+        CONSTRAINT pojazdy_odcinek_data_pkey PRIMARY KEY (numer_odcinka, data_15min)
+    ) PARTITION BY RANGE (data_15min)
+    """)
+
+    if relkind is not None:
+        cursor.execute("SELECT DISTINCT date_trunc('month', data_15min) FROM pojazdy_legacy "
+                       "WHERE data_15min IS NOT NULL")
+        ensure_pojazdy_partitions(cursor, [row[0] for row in cursor.fetchall()])
+        # Stara tabela nie ma kolumn dodanych w późniejszych migracjach
+        columns = ', '.join(column for column in POJAZDY_COLUMNS.values()
+                            if column not in POJAZDY_HISTOGRAM_COLUMNS.values())
+        cursor.execute(f"""
+        INSERT INTO pojazdy ({columns})
+        SELECT {columns} FROM pojazdy_legacy
+        WHERE data_15min IS NOT NULL AND numer_odcinka IS NOT NULL
+        """)
+        cursor.execute("DROP TABLE pojazdy_legacy")
+
+
+def _migrate_brin_index(cursor):
+    # Mały indeks BRIN dla skanów długich zakresów dat niezależnie od odcinka
+    cursor.execute("CREATE INDEX IF NOT EXISTS pojazdy_data_15min_brin ON pojazdy USING brin (data_15min)")
+
+
+def _migrate_histogram_columns(cursor):
+    cursor.execute("ALTER TABLE pojazdy " + ', '.join(f"ADD COLUMN IF NOT EXISTS {column} INTEGER[]"
+                                                      for column in POJAZDY_HISTOGRAM_COLUMNS.values()))
+
+
+def _migrate_temp_data_columns(cursor):
+    # Tabele temp_data utworzone przed wprowadzeniem formatu kolumnowego; nową tabelę z tymi kolumnami
+    # tworzy create_temp_data_table
+    cursor.execute("""
+        ALTER TABLE IF EXISTS temp_data
+            ADD COLUMN IF NOT EXISTS format_version SMALLINT,
+            ADD COLUMN IF NOT EXISTS row_count INTEGER,
+            ADD COLUMN IF NOT EXISTS raw_size BIGINT,
+            ADD COLUMN IF NOT EXISTS stored_size BIGINT
+    """)
+
+
+def _migrate_rollup_tables(cursor):
+    ensure_rollup_tables(cursor)
+
+
+# Kolejne wersje schematu bazy: (wersja, opis, funkcja migracji)
+SCHEMA_MIGRATIONS = [
+    (1, "Tabela pojazdy partycjonowana miesięcznie", _migrate_partitioned_pojazdy),
+    (2, "Indeks BRIN na pojazdy.data_15min", _migrate_brin_index),
+    (3, "Histogramy prędkości i długości w tabeli pojazdy", _migrate_histogram_columns),
+    (4, "Kolumny formatu kolumnowego w tabeli temp_data", _migrate_temp_data_columns),
+    (5, "Tabele agregatów godzinowych i dziennych", _migrate_rollup_tables),
+]
+
+
+def migrate_schema(conn):
+    """Wykonuje brakujące migracje schematu w jednej transakcji i zwraca aktualną wersję."""
+    with conn.cursor() as cursor:
+        # Blokada chroni przed równoczesną migracją z kilku procesów aplikacji
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_ID,))
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            opis TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        current = cursor.fetchone()[0]
+        for version, description, migration in SCHEMA_MIGRATIONS:
+            if version <= current:
+                continue
+            migration(cursor)
+            cursor.execute("INSERT INTO schema_version (version, opis) VALUES (%s, %s)", (version, description))
+            app.logger.info("Migracja schematu %d: %s", version, description)
+            current = version
+    conn.commit()
+    return current
+
+
+def ensure_schema(pool, conn):
+    with pool.schema_lock:
+        if pool.schema_ready or time.monotonic() < pool.schema_retry_at:
+            return
+        try:
+            migrate_schema(conn)
+        except psycopg2.Error as e:
+            # Bez uprawnień do zmiany schematu aplikacja działa dalej, migracja zostanie ponowiona po odstępie
+            conn.rollback()
+            pool.schema_retry_at = time.monotonic() + SCHEMA_RETRY_AFTER
+            if pool.schema_error != str(e):
+                # Ten sam błąd przy kolejnych próbach nie jest ponownie zapisywany w logu
+                app.logger.exception("Nie udało się zaktualizować schematu bazy danych")
+            pool.schema_error = str(e)
+            return
+        pool.schema_ready = True
+        pool.schema_error = None
+
+
+def ensure_pojazdy_partitions(cursor, timestamps):
+    """Tworzy brakujące partycje miesięczne tabeli pojazdy dla podanych chwil czasu."""
+    months = pd.to_datetime(pd.Series(list(timestamps), dtype=object)).dropna().dt.to_period('M').unique()
+    partitions = {f"pojazdy_{month.year}_{month.month:02d}": month for month in sorted(months)}
+    if not partitions:
+        return
+    cursor.execute("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'pojazdy'::regclass AND c.relname = ANY(%s)
+    """, (list(partitions),))
+    existing = {_first_value(row) for row in cursor.fetchall()}
+    missing = [name for name in partitions if name not in existing]
+    if not missing:
+        return
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (PARTITION_LOCK_ID,))
+    for name in missing:
+        month = partitions[name]
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF pojazdy FOR VALUES FROM (%s) TO (%s)",
+                       (month.start_time.to_pydatetime(), (month + 1).start_time.to_pydatetime()))
+
+
+# Dane tymczasowe (oczekujące na potwierdzenie nadpisania) są zapisywane kolumnowo
+# w skompresowanym archiwum npz poprzedzonym nagłówkiem z numerem wersji formatu
+TEMP_DATA_MAGIC = b'INZT'
+TEMP_DATA_FORMAT_VERSION = 1
+TEMP_DATA_HEADER = struct.Struct('>4sHQ')  # znacznik, wersja formatu, liczba wierszy
+TEMP_DATA_TTL = float(os.getenv('TEMP_DATA_TTL', '300'))
+TEMP_DATA_SWEEP_INTERVAL = float(os.getenv('TEMP_DATA_SWEEP_INTERVAL', '60'))
+
+_temp_data_sweeper = None
+_temp_data_sweeper_lock = threading.Lock()
+
+
+class TempDataFormatError(ValueError):
+    pass
+
+
+def encode_frame(df):
+    """Zapisuje DataFrame kolumnami jako skompresowane tablice numpy (bez pickle)."""
+    arrays = {'columns': np.array([str(column) for column in df.columns], dtype=str)}
+    for i, column in enumerate(df.columns):
+        values = df[column]
+        if values.dtype.kind in 'biufM' and isinstance(values.dtype, np.dtype):
+            arrays[f'c{i}'] = values.to_numpy()
+        elif pd.api.types.is_numeric_dtype(values.dtype):
+            # Typy z obsługą braków (Int64, Float64) zapisywane są jako float z NaN
+            arrays[f'c{i}'] = values.to_numpy(dtype='float64', na_value=np.nan)
+        else:
+            missing = values.isna().to_numpy()
+            arrays[f'c{i}'] = values.astype(object).where(~missing, '').to_numpy(dtype=str)
+            if missing.any():
+                arrays[f'm{i}'] = missing
+    buffer = io.BytesIO()
+    buffer.write(TEMP_DATA_HEADER.pack(TEMP_DATA_MAGIC, TEMP_DATA_FORMAT_VERSION, len(df)))
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def decode_frame(payload):
+    payload = bytes(payload)
+    if len(payload) < TEMP_DATA_HEADER.size:
+        raise TempDataFormatError("Nieznany format danych tymczasowych.")
+    magic, version, rows = TEMP_DATA_HEADER.unpack_from(payload)
+    if magic != TEMP_DATA_MAGIC:
+        raise TempDataFormatError("Nieznany format danych tymczasowych.")
+    if version != TEMP_DATA_FORMAT_VERSION:
+        raise TempDataFormatError(f"Nieobsługiwana wersja formatu danych tymczasowych: {version}.")
+
+    with np.load(io.BytesIO(payload[TEMP_DATA_HEADER.size:]), allow_pickle=False) as arrays:
+        columns = list(arrays['columns'])
+        data = {}
+        for i, column in enumerate(columns):
+            values = arrays[f'c{i}']
+            if values.dtype.kind == 'U':
+                values = values.astype(object)
+                if f'm{i}' in arrays:
+                    values[arrays[f'm{i}']] = None
+            data[column] = values
+    df = pd.DataFrame(data, columns=columns)
+    if len(df) != rows:
+        raise TempDataFormatError("Uszkodzone dane tymczasowe.")
+    return df
+
+
 def create_temp_data_table():
     conn = connect_db()
     cursor = conn.cursor()
@@ -63,31 +733,38 @@ def create_temp_data_table():
     CREATE TABLE IF NOT EXISTS temp_data (
         id SERIAL PRIMARY KEY,
         data BYTEA,
-        expiration TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        expiration TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        format_version SMALLINT,
+        row_count INTEGER,
+        raw_size BIGINT,
+        stored_size BIGINT
     );
     """
 
     cursor.execute(create_table_query)
-
-    # Usuwanie przeterminowanych rekordów
-    cursor.execute("DELETE FROM temp_data WHERE expiration < CURRENT_TIMESTAMP - INTERVAL '5 minutes'")
     conn.commit()
     cursor.close()
     conn.close()
 
+    # Przeterminowane rekordy usuwa wątek w tle, a nie żądanie użytkownika
+    start_temp_data_sweeper()
+
 
+@timed('staging', input_rows=True)
 def save_data_to_db(processed_df):
     # Serializujemy dane DataFrame
-    serialized_df = pickle.dumps(processed_df)
+    serialized_df = encode_frame(processed_df)
+    raw_size = int(processed_df.memory_usage(deep=True).sum())
 
     conn = connect_db()
     cursor = conn.cursor()
 
     # Wstawiamy dane do tabeli temp_data
     cursor.execute("""
-        INSERT INTO temp_data (data, expiration) 
-        VALUES (%s, %s) RETURNING id
-    """, (serialized_df, datetime.now()))
+        INSERT INTO temp_data (data, expiration, format_version, row_count, raw_size, stored_size) 
+        VALUES (%s, %s, %s, %s, %s, %s) RETURNING id
+    """, (serialized_df, datetime.now(), TEMP_DATA_FORMAT_VERSION, len(processed_df),
+          raw_size, len(serialized_df)))
 
     conn.commit()
 
@@ -97,6 +774,8 @@ def save_data_to_db(processed_df):
     cursor.close()
     conn.close()
 
+    app.logger.info("temp_data %s: %d wierszy, %d B w pamięci, %d B zapisane",
+                    temp_id, len(processed_df), raw_size, len(serialized_df))
     return temp_id
 
 
@@ -110,7 +789,11 @@ def get_data_from_db(temp_id):
 
     if row:
         # Deserializujemy dane z formatu binarnego
-        processed_df = pickle.loads(row[0])
+        try:
+            processed_df = decode_frame(row[0])
+        except TempDataFormatError as e:
+            app.logger.warning("temp_data %s: %s", temp_id, e)
+            processed_df = None
 
         conn.commit()
 
@@ -124,170 +807,551 @@ def get_data_from_db(temp_id):
         return None
 
 
-def resource_path_mr_number_info():
-    return os.path.join(BASE_DIR, 'WK_1000_A1M-5000_A2E.xlsx')
+def sweep_temp_data(pools=None):
+    """Usuwa przeterminowane dane tymczasowe we wszystkich bazach, z którymi aplikacja ma połączenie."""
+    if pools is None:
+        with _pools_lock:
+            pools = list(_pools.values())
+    deleted = 0
+    for pool in pools:
+        try:
+            conn = pool.getconn()
+        except (PoolError, psycopg2.Error):
+            continue
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT to_regclass('temp_data') IS NOT NULL")
+                if cursor.fetchone()[0]:
+                    cursor.execute("DELETE FROM temp_data WHERE expiration < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'",
+                                   (TEMP_DATA_TTL,))
+                    deleted += cursor.rowcount
+            conn.commit()
+        except psycopg2.Error as e:
+            app.logger.warning("Nie udało się usunąć przeterminowanych danych tymczasowych: %s", e)
+        finally:
+            pool.putconn(conn)
+    return deleted
+
+
+def _temp_data_sweeper_loop():
+    while True:
+        time.sleep(TEMP_DATA_SWEEP_INTERVAL)
+        try:
+            sweep_temp_data()
+        except Exception:
+            app.logger.exception("Błąd wątku usuwającego dane tymczasowe")
 
 
-# Load data from excel file
-def load_data(file_name):
-    # start_time = time.perf_counter()  # Zapisz czas rozpoczęcia
-    file = file_name.filename
-    if not re.search(r'_(\d+)_\d{4}-\d{2}-\d{2}_POJAZDY\.(xlsx|csv)$', file):
-        return None, "Niepoprawny schemat nazwy pliku. Oczekiwany format to NUMER_MR_RRRR-MM-DD_POJAZDY."
-    df = pd.read_excel(file_name, engine='calamine')
+def start_temp_data_sweeper():
+    global _temp_data_sweeper
+    with _temp_data_sweeper_lock:
+        if _temp_data_sweeper is None:
+            _temp_data_sweeper = threading.Thread(target=_temp_data_sweeper_loop, name='temp-data-sweeper',
+                                                  daemon=True)
+            _temp_data_sweeper.start()
+
+
+def resource_path_mr_number_info():
+    return os.path.join(BASE_DIR, 'WK_1000_A1M-5000_A2E.xlsx')
 
-    # List of required columns
-    required_columns = {'Id', 'Data', 'Kategoria', 'Pas ruchu', 'Prędkość',
-                        'Przestrzeń między poprzedzającym pojazdem w dziesiętnych częściach sekundy',
-                        'Długość pojazdu w cm', 'Kierunek pod prąd'}
 
-    df_columns = set(df.columns)
-    missing_columns = required_columns - df_columns
-    extra_columns = df_columns - required_columns
+# Kolumny wymagane w pliku z danymi pojazdów
+REQUIRED_COLUMNS = {'Id', 'Data', 'Kategoria', 'Pas ruchu', 'Prędkość',
+                    'Przestrzeń między poprzedzającym pojazdem w dziesiętnych częściach sekundy',
+                    'Długość pojazdu w cm', 'Kierunek pod prąd'}
+
+# Typy kolumn pojazdów po wczytaniu; kolumna Id nie jest potrzebna do agregacji i jest pomijana
+VEHICLE_DTYPES = {
+    'Kategoria': 'category',
+    'Pas ruchu': 'int8',
+    # Wielkości sumowane do średnich zostają w float64 - suma w float32 zmieniałaby zaokrąglone średnie
+    'Prędkość': 'float64',
+    'Przestrzeń między poprzedzającym pojazdem w dziesiętnych częściach sekundy': 'float64',
+    'Długość pojazdu w cm': 'float64',
+    'Kierunek pod prąd': 'int8',
+}
+# Kolumny całkowite CSV czytane są typami z obsługą braków, bo int8 nie przyjmuje pustych pól;
+# read_csv_chunks zamienia je potem przez compact_vehicle_frame, tak jak w arkuszach
+CSV_DTYPES = {'Data': str, **{column: dtype.capitalize() if dtype.startswith('int') else dtype
+                              for column, dtype in VEHICLE_DTYPES.items()}}
+CSV_CHUNK_ROWS = int(os.getenv('CSV_CHUNK_ROWS', '200000'))
+
+FILE_NAME_PATTERN = r'_(\d+)_\d{4}-\d{2}-\d{2}_POJAZDY\.(xlsx|csv)$'
+
+
+@timed('validate')
+def validate_columns(columns):
+    df_columns = set(columns)
+    missing_columns = REQUIRED_COLUMNS - df_columns
+    extra_columns = df_columns - REQUIRED_COLUMNS
 
     # Check for the presence of required columns
     if missing_columns:
-        return None, f"Brakujące kolumny: {', '.join(missing_columns)}"
+        return f"Brakujące kolumny: {', '.join(missing_columns)}"
 
     # Check for the presence of additional columns
     if extra_columns:
-        return None, f"Niepotrzebne kolumny: {', '.join(extra_columns)}"
+        return f"Niepotrzebne kolumny: {', '.join(extra_columns)}"
+    return None
+
+
+def compact_vehicle_frame(df):
+    """Usuwa kolumnę Id i zamienia kolumny pojazdów na typy z VEHICLE_DTYPES."""
+    df = df.drop(columns=['Id'], errors='ignore')
+    for column, dtype in VEHICLE_DTYPES.items():
+        if column in df.columns:
+            if dtype.startswith('int') and df[column].isna().any():
+                # Puste komórki arkusza nie mieszczą się w typie całkowitym
+                dtype = 'float64'
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def section_from_file_name(file):
+    # Extracting the mr number from the file name
+    match = re.search(r'([^\\]+)(?=_\d{4}-\d{2}-\d{2}_POJAZDY\.(xlsx|csv)$)', file)
+    return match.group(1) if match else None
+
+
+# Load data from excel or csv file
+@timed('parse')
+def load_data(file_name):
+    """Wczytuje cały plik jako ramkę pojazdów. Trasy zapisu agregują pliki CSV fragmentami przez
+    aggregate_file, więc pełna ramka CSV powstaje tylko tutaj (testy, benchmarki)."""
+    file = file_name.filename
+    if not re.search(FILE_NAME_PATTERN, file):
+        return None, "Niepoprawny schemat nazwy pliku. Oczekiwany format to NUMER_MR_RRRR-MM-DD_POJAZDY."
+    if file.endswith('.csv'):
+        try:
+            df = pd.concat(read_csv_chunks(file_name), ignore_index=True)
+        except CsvHeaderError as e:
+            return None, str(e)
+        except (ValueError, pd.errors.ParserError) as e:
+            return None, f"Błąd podczas wczytywania pliku CSV: {e}"
+    else:
+        df = pd.read_excel(file_name, engine='calamine')
+
+        error = validate_columns(df.columns)
+        if error:
+            return None, error
+        try:
+            df = compact_vehicle_frame(df)
+        except (ValueError, TypeError) as e:
+            return None, f"Błąd podczas wczytywania pliku: {e}"
 
     try:
         df["Data"] = pd.to_datetime(df["Data"], format='%Y-%m-%d %H:%M:%S', errors='coerce')
     except Exception as e:
-        print(f"Błąd podczas konwersji daty: {e}")
+        app.logger.warning("Błąd podczas konwersji daty w pliku %s: %s", file, e)
         return None, "Błąd podczas konwersji daty."
 
-    # Extracting the mr number from the file name
-    match = re.search(r'([^\\]+)(?=_\d{4}-\d{2}-\d{2}_POJAZDY\.(xlsx|csv)$)', file)
-    odcinek = match.group(1) if match else None
-    df['Numer odcinka'] = odcinek
-    # end_time = time.perf_counter()  # Zapisz czas zakończenia
-    # elapsed_time = end_time - start_time  # Oblicz czas wykonania
-    # print(f"Czas wykonania load_data: {elapsed_time:.2f} sekundy")
+    # Numer odcinka jest wspólny dla całego pliku, więc trzymany jest w atrybutach ramki, a nie w kolumnie
+    df.attrs['Numer odcinka'] = section_from_file_name(file)
     return df, None
 
 
+class CsvHeaderError(ValueError):
+    pass
+
+
+def read_csv_chunks(file_name, chunk_rows=None):
+    """Czyta plik CSV fragmentami o stałej liczbie wierszy; nagłówek sprawdzany jest raz, przed odczytem danych."""
+    stream = getattr(file_name, 'stream', file_name)
+    first_line = stream.readline()
+    stream.seek(0)
+    if isinstance(first_line, bytes):
+        first_line = first_line.decode('utf-8-sig', errors='replace')
+    # Eksport z ustawieniami polskimi używa średnika jako separatora i przecinka dziesiętnego
+    sep = max([',', ';', '\t'], key=first_line.count)
+    decimal = ',' if sep == ';' else '.'
+
+    header = pd.read_csv(stream, sep=sep, nrows=0, encoding='utf-8-sig').columns
+    stream.seek(0)
+    error = validate_columns(header)
+    if error:
+        raise CsvHeaderError(error)
+
+    for chunk in pd.read_csv(stream, sep=sep, decimal=decimal, encoding='utf-8-sig', usecols=list(CSV_DTYPES),
+                             dtype=CSV_DTYPES, chunksize=chunk_rows or CSV_CHUNK_ROWS):
+        yield compact_vehicle_frame(chunk)
+
+
+# Pamięć podręczna zagregowanych plików na dysku
+PARSE_CACHE_DIR = os.getenv('PARSE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'inz_parse_cache'))
+PARSE_CACHE_MAX_BYTES = int(os.getenv('PARSE_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+# Wersja wczytywania i agregacji plików - należy ją zwiększyć przy każdej zmianie wyniku agregacji
+PARSE_PIPELINE_VERSION = 2
+
+
+class ParseCache:
+    """Dyskowa pamięć podręczna LRU zagregowanych plików, adresowana skrótem zawartości.
+
+    Wpisy zapisywane są w formacie encode_frame, a czas modyfikacji pliku jest czasem ostatniego
+    użycia - dzięki temu pamięć jest wspólna dla procesów roboczych i przetrwa restart aplikacji.
+    Przy directory=None pamięć jest wyłączona.
+    """
+
+    def __init__(self, directory=PARSE_CACHE_DIR, max_bytes=PARSE_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def get(self, key):
+        if not self.directory or key is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                df = decode_frame(file.read())
+            os.utime(path)
+        except FileNotFoundError:
+            df = None
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            # Uszkodzony lub zapisany starszym formatem wpis jest usuwany
+            app.logger.warning("Pominięto wpis pamięci podręcznej %s: %s", key, e)
+            self._unlink(path)
+            df = None
+        with self._lock:
+            if df is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return df
+
+    def put(self, key, df):
+        if not self.directory or key is None or len(df) == 0:
+            return
+        try:
+            payload = encode_frame(df)
+            if len(payload) > self.max_bytes:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            # Zapis przez plik tymczasowy, aby inne procesy nie odczytały niepełnego wpisu
+            temporary = os.path.join(self.directory, f".{key}.{uuid.uuid4().hex}.tmp")
+            with open(temporary, 'wb') as file:
+                file.write(payload)
+            os.replace(temporary, self._path(key))
+        except (OSError, ValueError, TypeError) as e:
+            app.logger.warning("Nie zapisano wpisu pamięci podręcznej %s: %s", key, e)
+            return
+        self._evict()
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.name.endswith('.npz'):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        return entries
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in entries:
+            if size <= self.max_bytes:
+                break
+            self._unlink(path)
+            size -= entry_size
+            with self._lock:
+                self.evictions += 1
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        if self.directory and os.path.isdir(self.directory):
+            for _, _, path in self._entries():
+                self._unlink(path)
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        entries = self._entries() if self.directory and os.path.isdir(self.directory) else []
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(entries), 'bytes': sum(entry[1] for entry in entries),
+                    'max_bytes': self.max_bytes}
+
+
+parse_cache = ParseCache()
+
+
+def parse_cache_key(file_name):
+    """Skrót zawartości pliku, numeru odcinka z nazwy pliku i wersji przetwarzania.
+
+    Zwraca None dla plików o niepoprawnej nazwie - takie pliki nie trafiają do pamięci podręcznej.
+    """
+    file = file_name.filename
+    if not re.search(FILE_NAME_PATTERN, file):
+        return None
+    with timed_stage('hash'):
+        digest = hashlib.sha256(f"{PARSE_PIPELINE_VERSION}:{section_from_file_name(file)}:"
+                                f"{os.path.splitext(file)[1]}:".encode())
+        stream = getattr(file_name, 'stream', file_name)
+        position = stream.tell()
+        stream.seek(0)
+        for block in iter(partial(stream.read, 1024 * 1024), b''):
+            digest.update(block)
+        stream.seek(position)
+    return digest.hexdigest()
+
+
+def load_aggregated_data(file_name):
+    """Wczytuje plik z danymi pojazdów i zwraca dane zagregowane do 15 minut.
+
+    Wynik jest zapisywany w pamięci podręcznej parse_cache, więc ponowne przesłanie tego samego
+    pliku pomija wczytywanie i agregację.
+    """
+    key = parse_cache_key(file_name)
+    processed_df = parse_cache.get(key)
+    if processed_df is not None:
+        return processed_df, None
+
+    processed_df, error = aggregate_file(file_name)
+    if error is None:
+        parse_cache.put(key, processed_df)
+    return processed_df, error
+
+
+def aggregate_file(file_name):
+    """Wczytuje i agreguje plik z danymi pojazdów z pominięciem pamięci podręcznej.
+
+    Pliki CSV są agregowane fragment po fragmencie, więc zużycie pamięci zależy od rozmiaru
+    fragmentu, a nie całego pliku. Błędy wczytywania zwracane są jako komunikat, błędy
+    przetwarzania zgłaszane jako wyjątki.
+    """
+    file = file_name.filename
+    if not file.endswith('.csv') or not re.search(FILE_NAME_PATTERN, file):
+        df, error = load_data(file_name)
+        if error:
+            return None, error
+        return process_data_db(df), None
+
+    section = section_from_file_name(file)
+    partials = []
+    # Odczyt i agregacja fragmentów przeplatają się, więc czasy obu etapów są sumowane osobno
+    started = time.perf_counter()
+    aggregation = 0.0
+    vehicles = 0
+    try:
+        for chunk in read_csv_chunks(file_name):
+            try:
+                chunk['Data'] = pd.to_datetime(chunk['Data'], format='%Y-%m-%d %H:%M:%S', errors='coerce')
+            except Exception as e:
+                app.logger.warning("Błąd podczas konwersji daty w pliku %s: %s", file, e)
+                return None, "Błąd podczas konwersji daty."
+            vehicles += len(chunk)
+            aggregation_started = time.perf_counter()
+            partials.append(aggregate_partial(chunk, section))
+            aggregation += time.perf_counter() - aggregation_started
+    except CsvHeaderError as e:
+        return None, str(e)
+    except (ValueError, pd.errors.ParserError) as e:
+        return None, f"Błąd podczas wczytywania pliku CSV: {e}"
+
+    if not partials or all(partial.empty for partial in partials):
+        raise ValueError("DataFrame jest pusty.")
+    record_stage('parse', time.perf_counter() - started - aggregation, vehicles)
+    aggregation_started = time.perf_counter()
+    processed_df = finalize_aggregates(partials)
+    record_stage('aggregate', aggregation + time.perf_counter() - aggregation_started, vehicles)
+    return processed_df, None
+
+
+@timed('aggregate', input_rows=True)
 def process_data_db(df):
     if not isinstance(df, pd.DataFrame):
         raise ValueError("Oczekiwano obiektu DataFrame.")
 
     if df.empty:
         raise ValueError("DataFrame jest pusty.")
-    df["Data 15min"] = df["Data"].dt.floor("15min")
-    # Maski dla pasów ruchu i kategorii
-    mask_pas_1 = df['Pas ruchu'] == 1
-    mask_pas_2 = df['Pas ruchu'] == 2
-
-    mask_h = df['Kategoria'] == 'H'
-    mask_l = df['Kategoria'] == 'L'
-
-    # Liczba pojazdów na pasach
-    df['Liczba na pasie 1'] = mask_pas_1.astype(int)
-    df['Liczba na pasie 2'] = mask_pas_2.astype(int)
-
-    df['Liczba samochodów H Pas 1'] = (mask_pas_1 & mask_h).astype(int)
-    df['Średnia prędkość H Pas 1'] = df['Prędkość'].where(mask_pas_1 & mask_h)
-    df['Średnia długość H Pas 1'] = df['Długość pojazdu w cm'].where(mask_pas_1 & mask_h)
-
-    df['Liczba samochodów L Pas 1'] = (mask_pas_1 & mask_l).astype(int)
-    df['Średnia prędkość L Pas 1'] = df['Prędkość'].where(mask_pas_1 & mask_l)
-    df['Średnia długość L Pas 1'] = df['Długość pojazdu w cm'].where(mask_pas_1 & mask_l)
-
-    df['Liczba samochodów H Pas 2'] = (mask_pas_2 & mask_h).astype(int)
-    df['Średnia prędkość H Pas 2'] = df['Prędkość'].where(mask_pas_2 & mask_h)
-    df['Średnia długość H Pas 2'] = df['Długość pojazdu w cm'].where(mask_pas_2 & mask_h)
-
-    df['Liczba samochodów L Pas 2'] = (mask_pas_2 & mask_l).astype(int)
-    df['Średnia prędkość L Pas 2'] = df['Prędkość'].where(mask_pas_2 & mask_l)
-    df['Średnia długość L Pas 2'] = df['Długość pojazdu w cm'].where(mask_pas_2 & mask_l)
-
-    aggregated_data = df.groupby(["Data 15min", "Numer odcinka"]).agg({
-        "Przestrzeń między poprzedzającym pojazdem w dziesiętnych częściach sekundy": "mean",
-        "Kierunek pod prąd": "sum",
-        "Liczba na pasie 1": "sum",
-        "Liczba samochodów H Pas 1": "sum",
-        "Średnia prędkość H Pas 1": "mean",
-        "Średnia długość H Pas 1": "mean",
-        "Liczba samochodów L Pas 1": "sum",
-        "Średnia prędkość L Pas 1": "mean",
-        "Średnia długość L Pas 1": "mean",
-        "Liczba na pasie 2": "sum",
-        "Liczba samochodów H Pas 2": "sum",
-        "Średnia prędkość H Pas 2": "mean",
-        "Średnia długość H Pas 2": "mean",
-        "Liczba samochodów L Pas 2": "sum",
-        "Średnia prędkość L Pas 2": "mean",
-        "Średnia długość L Pas 2": "mean"
-    }).reset_index()
-
-    # Zaokrąglanie tylko wymaganych kolumn
-    columns_to_round = [
-        "Przestrzeń między poprzedzającym pojazdem w dziesiętnych częściach sekundy",
-        "Średnia prędkość H Pas 1", "Średnia długość H Pas 1",
-        "Średnia prędkość L Pas 1", "Średnia długość L Pas 1",
-        "Średnia prędkość H Pas 2", "Średnia długość H Pas 2",
-        "Średnia prędkość L Pas 2", "Średnia długość L Pas 2"
-    ]
 
-    aggregated_data[columns_to_round] = aggregated_data[columns_to_round].round(1)
-    aggregated_data.columns = [
-        "Data 15min", "Numer odcinka", "Średnia przestrzeń między pojazdem", "Liczba samochodów jadąca pod prąd",
-        "Liczba na pasie 1", "Liczba samochodów H Pas 1", "Średnia prędkość H Pas 1",
-        "Średnia długość H Pas 1", "Liczba samochodów L Pas 1", "Średnia prędkość L Pas 1",
-        "Średnia długość L Pas 1", "Liczba na pasie 2", "Liczba samochodów H Pas 2",
-        "Średnia prędkość H Pas 2", "Średnia długość H Pas 2", "Liczba samochodów L Pas 2",
-        "Średnia prędkość L Pas 2", "Średnia długość L Pas 2"
-    ]
+    # Jedno grupowanie po (15 minut, odcinek, pas, kategoria), a następnie przestawienie małego wyniku
+    # do układu kolumn tabeli pojazdy - bez pomocniczych kolumn na poziomie pojedynczych pojazdów
+    return finalize_aggregates(aggregate_partial(df, df.attrs.get('Numer odcinka')))
 
-    return aggregated_data
 
+# Nazwy kolumn surowych danych pojazdów
+SPEED_COLUMN = 'Prędkość'
+LENGTH_COLUMN = 'Długość pojazdu w cm'
+HEADWAY_COLUMN = 'Przestrzeń między poprzedzającym pojazdem w dziesiętnych częściach sekundy'
+WRONG_WAY_COLUMN = 'Kierunek pod prąd'
+PARTIAL_KEYS = ['Data 15min', 'Numer odcinka', 'Pas ruchu', 'Kategoria']
+# Stałe przedziały histogramów prędkości (km/h) i długości (cm); wartości spoza zakresu trafiają
+# do skrajnych przedziałów. Zmiana przedziałów wymaga przeliczenia zapisanych histogramów.
+SPEED_HISTOGRAM_EDGES = np.arange(0, 255, 5)
+LENGTH_HISTOGRAM_EDGES = np.arange(0, 2550, 50)
+HISTOGRAMS = {'speed': (SPEED_COLUMN, SPEED_HISTOGRAM_EDGES), 'length': (LENGTH_COLUMN, LENGTH_HISTOGRAM_EDGES)}
 
-# Search if there is existing record to update
-def update_database(df):
-    conn = connect_db()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)  # Kursor zwracający słowniki
 
-    # Tworzenie tabeli (jeśli nie istnieje) w PostgreSQL
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS pojazdy (
-        data_15min TIMESTAMP,
-        numer_odcinka TEXT,
-        srednia_przestrzen_pomiedzy_pojazdami NUMERIC,
-        liczba_samochodow_jadaca_pod_prad INTEGER,
-        liczba_na_pasie_1 INTEGER,
-        liczba_samochodow_h_pas_1 INTEGER,
-        srednia_predkosc_h_pas_1 NUMERIC,
-        srednia_dlugosc_h_pas_1 NUMERIC,
-        liczba_samochodow_l_pas_1 INTEGER,
-        srednia_predkosc_l_pas_1 NUMERIC,
-        srednia_dlugosc_l_pas_1 NUMERIC,
-        liczba_na_pasie_2 INTEGER,
-        liczba_samochodow_h_pas_2 INTEGER,
-        srednia_predkosc_h_pas_2 NUMERIC,
-        srednia_dlugosc_h_pas_2 NUMERIC,
-        liczba_samochodow_l_pas_2 INTEGER,
-        srednia_predkosc_l_pas_2 NUMERIC,
-        srednia_dlugosc_l_pas_2 NUMERIC,
-        PRIMARY KEY (data_15min, numer_odcinka)
-    );
-    """)
+def histogram_counts(values, edges, group_ids, groups):
+    """Liczności przedziałów edges w każdej grupie jako macierz groups x (len(edges) - 1).
+
+    Jedno np.bincount po kodach (grupa, przedział) zamiast grupowania po pojazdach; braki są pomijane.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    bins = len(edges) - 1
+    valid = ~np.isnan(values)
+    codes = np.clip(np.searchsorted(edges, values[valid], side='right') - 1, 0, bins - 1)
+    flat = np.bincount(group_ids[valid] * bins + codes, minlength=groups * bins)
+    return flat.reshape(groups, bins)
 
-    existing_records = False
 
-    for _, row in df.iterrows():
-        # Sprawdzenie, czy rekord już istnieje
-        cursor.execute("""
-            SELECT * FROM pojazdy WHERE data_15min = %s AND numer_odcinka = %s
-        """, (row['Data 15min'].to_pydatetime(), row['Numer odcinka']))
+def aggregate_partial(df, section=None):
+    """Agreguje pojazdy do sum i liczności w grupach (15 minut, odcinek, pas, kategoria).
 
-        record = cursor.fetchone()
+    Numer odcinka pochodzi z kolumny Numer odcinka, a gdy jej nie ma - z argumentu section.
+    Wyniki dla kolejnych fragmentów pliku można łączyć funkcją finalize_aggregates.
+    """
+    columns = {'Data 15min': df['Data'].dt.floor('15min')}
+    if pd.api.types.is_integer_dtype(df[WRONG_WAY_COLUMN]):
+        # Małe typy całkowite mogłyby się przepełnić przy sumowaniu
+        columns[WRONG_WAY_COLUMN] = df[WRONG_WAY_COLUMN].astype('int64')
+    per_row_section = 'Numer odcinka' in df.columns
+    keys = PARTIAL_KEYS if per_row_section else [key for key in PARTIAL_KEYS if key != 'Numer odcinka']
+    grouped = df.assign(**columns).groupby(keys, dropna=False, observed=True, sort=False)
+    partial = grouped.agg(
+        vehicles=('Data', 'size'),
+        speed_sum=(SPEED_COLUMN, 'sum'), speed_count=(SPEED_COLUMN, 'count'),
+        length_sum=(LENGTH_COLUMN, 'sum'), length_count=(LENGTH_COLUMN, 'count'),
+        headway_sum=(HEADWAY_COLUMN, 'sum'), headway_count=(HEADWAY_COLUMN, 'count'),
+        wrong_way=(WRONG_WAY_COLUMN, 'sum'),
+    )
+    # Sumy kolumn całkowitych (dane bez compact_vehicle_frame) również w float64
+    partial = partial.astype({column: 'float64' for column in ['speed_sum', 'length_sum', 'headway_sum']})
+    # Histogramy jako kolumny liczności przedziałów - sumują się przy łączeniu fragmentów jak pozostałe sumy
+    group_ids = grouped.ngroup().to_numpy()
+    partial = pd.concat([partial] + [
+        pd.DataFrame(histogram_counts(df[column], edges, group_ids, len(partial)), index=partial.index,
+                     columns=_bin_columns(name))
+        for name, (column, edges) in HISTOGRAMS.items()], axis=1)
+    if not per_row_section:
+        partial = pd.concat({section: partial}, names=['Numer odcinka']).reorder_levels(PARTIAL_KEYS)
+    return partial
+
+
+def finalize_aggregates(partials):
+    """Łączy częściowe agregaty i przekształca je do układu kolumn tabeli pojazdy."""
+    if isinstance(partials, list):
+        # Ta sama grupa może pojawić się w kilku fragmentach pliku
+        partial = pd.concat(partials).groupby(level=PARTIAL_KEYS, dropna=False, observed=True, sort=False).sum()
+    else:
+        partial = partials
+    # Wiersze bez poprawnej daty lub numeru odcinka są pomijane, tak jak w groupby
+    valid = (partial.index.get_level_values('Data 15min').notna()
+             & partial.index.get_level_values('Numer odcinka').notna())
+    partial = partial[valid]
+
+    # Kolumny przedziałów histogramów nie są przestawiane razem z resztą - literały budowane są
+    # osobno dla każdego pasa i kategorii, co ogranicza szczytowe zużycie pamięci
+    bins = partial[[column for name in HISTOGRAMS for column in _bin_columns(name)]]
+    partial = partial.drop(columns=bins.columns)
+    totals = partial.groupby(level=['Data 15min', 'Numer odcinka']).sum()
+    result = pd.DataFrame(index=totals.index)
+    result['Średnia przestrzeń między pojazdem'] = _mean(totals['headway_sum'], totals['headway_count'])
+    result['Liczba samochodów jadąca pod prąd'] = totals['wrong_way']
+
+    lanes = partial['vehicles'].groupby(level=['Data 15min', 'Numer odcinka', 'Pas ruchu']).sum()
+    lanes = lanes.unstack('Pas ruchu')
+    wide = partial.unstack(['Pas ruchu', 'Kategoria'])
+    for lane in (1, 2):
+        result[f'Liczba na pasie {lane}'] = _column(lanes, lane).fillna(0).astype('int64')
+        for category in ('H', 'L'):
+            result[f'Liczba samochodów {category} Pas {lane}'] = \
+                _column(wide, ('vehicles', lane, category)).fillna(0).astype('int64')
+            result[f'Średnia prędkość {category} Pas {lane}'] = _mean(
+                _column(wide, ('speed_sum', lane, category)), _column(wide, ('speed_count', lane, category)))
+            result[f'Średnia długość {category} Pas {lane}'] = _mean(
+                _column(wide, ('length_sum', lane, category)), _column(wide, ('length_count', lane, category)))
+            result[f'Histogram prędkości {category} Pas {lane}'] = _histogram_literals(bins, result.index, 'speed',
+                                                                                      lane, category)
+            result[f'Histogram długości {category} Pas {lane}'] = _histogram_literals(bins, result.index, 'length',
+                                                                                     lane, category)
+
+    # Zaokrąglanie tylko średnich
+    mean_columns = [column for column in result.columns if column.startswith('Średnia')]
+    result[mean_columns] = result[mean_columns].round(1)
+    return result.sort_index().reset_index()[list(POJAZDY_COLUMNS)]
+
+
+def _column(df, key):
+    if key in df.columns:
+        return df[key]
+    return pd.Series(float('nan'), index=df.index)
+
+
+def _mean(sums, counts):
+    return (sums / counts).where(counts > 0)
+
+
+def _bin_columns(name):
+    return [f'{name}_bin_{i}' for i in range(len(HISTOGRAMS[name][1]) - 1)]
+
+
+def _histogram_literals(bins, index, name, lane, category):
+    """Histogramy pasa i kategorii jako literały tablic PostgreSQL bez końcowych zer; None bez pojazdów."""
+    selected = ((bins.index.get_level_values('Pas ruchu') == lane)
+                & (bins.index.get_level_values('Kategoria') == category))
+    counts = bins.loc[selected, _bin_columns(name)].droplevel(['Pas ruchu', 'Kategoria'])
+    counts = counts.reindex(index, fill_value=0).to_numpy(dtype=np.int64)
+    return pd.Series(_array_literals(counts), index=index)
+
+
+def _array_literals(counts):
+    """Wiersze macierzy liczników jako literały '{...}' bez końcowych zer; None dla wierszy z samych zer.
+
+    Tekst całej macierzy składany jest naraz w buforze bajtów i dzielony na wiersze jednym split,
+    zamiast łączenia napisów osobno dla każdego wiersza.
+    """
+    rows, bins = counts.shape
+    if not rows:
+        return []
+    nonempty = counts.any(axis=1)
+    lengths = np.where(nonempty, bins - np.argmax(counts[:, ::-1] > 0, axis=1), 0)
+    row_of_cell, bin_of_cell = np.nonzero(np.arange(bins) < lengths[:, None])
+    values = counts[row_of_cell, bin_of_cell]
+    digits = np.floor(np.log10(np.maximum(values, 1))).astype(np.int64) + 1
+
+    # Komórka to cyfry i separator (',' lub '}'), niepusty wiersz zaczyna się od '{', każdy kończy '\n'
+    cells_width = np.bincount(row_of_cell, weights=digits + 1, minlength=rows).astype(np.int64)
+    row_end = np.cumsum(cells_width + nonempty + 1) - 1
+    row_start = row_end - cells_width - nonempty
+    cell_end = np.cumsum(digits + 1)
+    separators = row_start[row_of_cell] + cell_end - (np.cumsum(cells_width) - cells_width)[row_of_cell]
+
+    buffer = np.full(row_end[-1] + 1, ord(','), dtype=np.uint8)
+    buffer[row_start[nonempty]] = ord('{')
+    buffer[row_end[nonempty] - 1] = ord('}')
+    buffer[row_end] = ord('\n')
+    for position in range(digits.max(initial=0)):
+        # Cyfry od najmniej znaczącej, wstecz od separatora
+        mask = digits > position
+        buffer[separators[mask] - 1 - position] = ord('0') + values[mask] // 10 ** position % 10
+    return [line or None for line in buffer.tobytes().decode('ascii').split('\n')[:-1]]
+
+
+# Search if there are existing records to update
+@timed('conflict_check', input_rows=True)
+def update_database(df):
+    """Zwraca listę kluczy (data_15min, numer_odcinka) z ramki, które już istnieją w tabeli pojazdy."""
+    conn = connect_db()
+    cursor = conn.cursor()
 
-        # Jeśli rekord istnieje, dodajemy do listy
-        if record:
-            existing_records = True
-            break
+    existing_records = find_conflicting_keys(cursor, df)
 
     conn.commit()
     cursor.close()
@@ -296,19 +1360,47 @@ def update_database(df):
     return existing_records
 
 
-def fetch_data_from_db(start_date=None, end_date=None, section_number=None):
+def find_conflicting_keys(cursor, df):
+    # Wszystkie klucze wysyłane są jednym zapytaniem jako tablice rozwijane przez unnest
+    keys = df[['Data 15min', 'Numer odcinka']].drop_duplicates()
+    timestamps = pd.to_datetime(keys['Data 15min'])
+    # Zakres dat pozwala pominąć partycje spoza wczytywanego pliku
+    cursor.execute("""
+        SELECT p.data_15min, p.numer_odcinka
+        FROM unnest(%s::timestamp[], %s::text[]) AS k(data_15min, numer_odcinka)
+        JOIN pojazdy p USING (data_15min, numer_odcinka)
+        WHERE p.data_15min BETWEEN %s AND %s
+        ORDER BY p.numer_odcinka, p.data_15min
+    """, (timestamps.dt.to_pydatetime().tolist(), keys['Numer odcinka'].astype(str).tolist(),
+          timestamps.min().to_pydatetime(), timestamps.max().to_pydatetime()))
+    return [tuple(row) for row in cursor.fetchall()]
+
+
+@timed('fetch')
+def fetch_data_from_db(start_date=None, end_date=None, section_number=None, columns=None):
+    """Pobiera wiersze tabeli pojazdy (domyślnie wszystkie kolumny) z typami liczbowymi numpy."""
+    columns = list(columns) if columns else list(POJAZDY_DB_TYPES)
+    unknown = [column for column in columns if column not in POJAZDY_DB_TYPES]
+    if unknown:
+        return None, f"Nieznane kolumny tabeli pojazdy: {', '.join(unknown)}"
+
     try:
         conn = connect_db()
     except psycopg2.Error as e:
         return None, str(e)
 
-    query = "SELECT * FROM pojazdy"
+    # NUMERIC rzutowany jest na float8 po stronie bazy, aby sterownik nie tworzył obiektów Decimal
+    select = ', '.join(f"{column}::float8 AS {column}" if POJAZDY_DB_TYPES[column] == 'float64' else column
+                       for column in columns)
+    query = f"SELECT {select} FROM pojazdy"
 
-    conditions = []
+    conditions, params = [], []
     if start_date and end_date:
-        conditions.append(f"data_15min BETWEEN '{start_date} 00:00:00' AND '{end_date} 23:59:59'")
+        conditions.append("data_15min BETWEEN %s AND %s")
+        params.extend([f"{start_date} 00:00:00", f"{end_date} 23:59:59"])
     if section_number:
-        conditions.append(f"numer_odcinka = '{section_number}'")
+        conditions.append("numer_odcinka = %s")
+        params.append(section_number)
 
     if conditions:
         query += " WHERE " + " AND ".join(conditions)
@@ -316,132 +1408,438 @@ def fetch_data_from_db(start_date=None, end_date=None, section_number=None):
     query += " ORDER BY data_15min"
 
     try:
-        df = pd.read_sql_query(query, conn)
-    except pd.io.sql.DatabaseError as e:
+        with conn.cursor() as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+    except psycopg2.Error as e:
         conn.close()
         return None, str(e)
 
     conn.close()
-    return df, None
+    return rows_to_frame(rows, columns), None
 
 
-def get_sections(excel_path):
-    if not os.path.isfile(excel_path):
-        return None, f"Excel file does not exist at {excel_path}"
+def rows_to_frame(rows, columns):
+    """Składa DataFrame z krotek kursora, dekodując kolumny od razu do tablic numpy."""
+    values = zip(*rows) if rows else [()] * len(columns)
+    data = {}
+    for column, column_values in zip(columns, values):
+        dtype = POJAZDY_DB_TYPES[column]
+        if dtype == 'int32' and None in column_values:
+            # Brakujące liczby całkowite zamieniane są na NaN
+            dtype = 'float64'
+        data[column] = np.array(column_values, dtype=dtype)
+    return pd.DataFrame(data, columns=columns)
+
 
+@timed('fetch')
+def fetch_hourly_rollup(start_date=None, end_date=None, section_number=None):
+    """Pobiera godzinowe agregaty z tabeli pojazdy_godzinowe.
+
+    Zwraca (None, None), gdy tabela agregatów jeszcze nie istnieje - wtedy wykres liczony jest z pojazdy.
+    """
     try:
-        # Connect to the database and fetch the sections
         conn = connect_db()
-        query = 'SELECT DISTINCT numer_odcinka FROM pojazdy ORDER BY numer_odcinka'
-        df_db = pd.read_sql_query(query, conn)
+    except psycopg2.Error as e:
+        return None, str(e)
+
+    table = ROLLUP_TABLES['h'][0]
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+            if not cursor.fetchone()[0]:
+                conn.close()
+                return None, None
+
+        conditions, params = _rollup_filters('numer_odcinka', 'okres', section_number,
+                                             start_date if start_date and end_date else None,
+                                             end_date if start_date and end_date else None)
+        query = (f"SELECT okres, numer_odcinka, liczba_samochodow, liczba_samochodow_h, liczba_samochodow_l "
+                 f"FROM {table} WHERE {' AND '.join(conditions)} ORDER BY okres")
+        df = pd.read_sql_query(query, conn, params=params)
+    except (psycopg2.Error, DatabaseError) as e:
         conn.close()
+        return None, str(e)
 
-        # Read all sheets from the Excel file
-        excel_info = {}
-        try:
-            xls = pd.ExcelFile(excel_path, engine='calamine')
-            try:
-                for sheet_name in xls.sheet_names:
-                    df = pd.read_excel(xls, sheet_name=sheet_name)
-
-                    if 'ID_MR' in df.columns:
-                        # Normalize column names
-                        df.columns = df.columns.str.strip().str.lower()
-                        df.rename(columns={
-                            'id_mr': 'ID_MR',
-                            'pikieta': 'pikietaż'
-                        }, inplace=True)
-
-                        # Add data from the current sheet to the excel_info dictionary
-                        df_filtered = df[['ID_MR', 'droga', 'pikietaż', 'lokalizacja']].dropna(subset=['ID_MR'])
-                        for _, row in df_filtered.iterrows():
-                            excel_info[row['ID_MR']] = {
-                                'droga': row.get('droga', ''),
-                                'pikietaż': row.get('pikietaż', ''),
-                                'lokalizacja': row.get('lokalizacja', '')
-                            }
-            finally:
-                xls.close()
-        except Exception as e:
-            return None, f"Error reading Excel file: {str(e)}"
+    conn.close()
+    return df, None
 
-        if not excel_info:
-            return None, "Column 'ID_MR' not found in any sheet of Excel file."
 
-        # Create a list of sections with additional info
-        sections_with_info = []
-        for section in df_db['numer_odcinka']:
-            section_info = excel_info.get(section, {})
-            additional_info = (f"{section_info.get('droga', '')}, km {section_info.get('pikietaż', '')}, "
-                               f"{section_info.get('lokalizacja')}")
-            sections_with_info.append(f"{section.split('_')[-1]} ({additional_info})")
+# Profil godzinowy wykresu liczony w całości w bazie danych (gdy wybrany jest odcinek)
+PLOT_SQL_AGGREGATION = os.getenv('PLOT_SQL_AGGREGATION', '1') == '1'
 
-        return sections_with_info, None
-    except Exception as e:
-        return None, str(e)
+# Wyrażenie liczby pojazdów dla typu samochodu: (wiersze 15-minutowe pojazdy, agregaty godzinowe)
+PLOT_CAR_TYPE_EXPRESSIONS = {
+    'H': ('liczba_samochodow_h_pas_1 + liczba_samochodow_h_pas_2', 'liczba_samochodow_h'),
+    'L': ('liczba_samochodow_l_pas_1 + liczba_samochodow_l_pas_2', 'liczba_samochodow_l'),
+}
+PLOT_ALL_CARS_EXPRESSIONS = ('liczba_na_pasie_1 + liczba_na_pasie_2', 'liczba_samochodow')
 
 
-def reverse_format_section(excel_path, formatted_section):
-    if not os.path.isfile(excel_path):
-        return None, f"Excel file does not exist at {excel_path}"
+# Mapa cieplna dzień tygodnia x pora dnia: rozdzielczość w minutach i typy samochodów
+HEATMAP_RESOLUTIONS = (60, 15)
+HEATMAP_CAR_TYPES = ('both', 'H', 'L')
 
+
+@timed('fetch')
+def fetch_week_heatmap(start_date=None, end_date=None, section_number=None, resolution=60):
+    """Średnia liczba pojazdów dla każdego dnia tygodnia i pory dnia, jednym zapytaniem dla wszystkich typów.
+
+    Zwraca słownik typ samochodu -> macierz 7 x (1440 / resolution) (wiersze od poniedziałku,
+    NaN dla pustych pól) albo (None, None), gdy w zakresie nie ma danych.
+    """
     try:
-        # Read all sheets from the Excel file
-        excel_info = {}
-        try:
-            xls = pd.ExcelFile(excel_path, engine='calamine')
-            try:
-                for sheet_name in xls.sheet_names:
-                    df = pd.read_excel(xls, sheet_name=sheet_name)
-
-                    if 'ID_MR' in df.columns:
-                        # Normalize column names
-                        df.columns = df.columns.str.strip().str.lower()
-                        df.rename(columns={
-                            'id_mr': 'ID_MR',
-                            'pikieta': 'pikietaż'
-                        }, inplace=True)
-
-                        # Add data from the current sheet to the excel_info dictionary
-                        df_filtered = df[['ID_MR', 'droga', 'pikietaż', 'lokalizacja']].dropna(subset=['ID_MR'])
-                        for _, row in df_filtered.iterrows():
-                            excel_info[str(row['ID_MR']).strip()] = {
-                                'droga': str(row.get('droga', '')).strip(),
-                                'pikietaż': str(row.get('pikietaż', '')).strip(),
-                                'lokalizacja': str(row.get('lokalizacja', '')).strip()
-                            }
-            finally:
-                xls.close()
-        except Exception as e:
-            return None, f"Error reading Excel file: {str(e)}"
+        conn = connect_db()
+    except psycopg2.Error as e:
+        return None, str(e)
 
-        # Parse the formatted_section string
-        pattern = re.compile(r'(\d+)\s*\(([^,]+),\s*km\s*([\d+]+(?:\d*)?),\s*([^)]*)\)')
-        match = pattern.match(formatted_section)
+    expressions = [PLOT_CAR_TYPE_EXPRESSIONS.get(car_type, PLOT_ALL_CARS_EXPRESSIONS)
+                   for car_type in HEATMAP_CAR_TYPES]
+    dates = (start_date, end_date) if start_date and end_date else (None, None)
+    try:
+        with conn.cursor() as cursor:
+            use_rollup = False
+            if resolution == 60:
+                cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (ROLLUP_TABLES['h'][0],))
+                use_rollup = cursor.fetchone()[0]
+            if use_rollup:
+                conditions, params = _rollup_filters('numer_odcinka', 'okres', section_number, *dates)
+                sums = ', '.join(f"SUM({rollup}) AS liczba_{i}" for i, (_, rollup) in enumerate(expressions))
+                buckets = f"""
+                SELECT okres, {sums}
+                FROM {ROLLUP_TABLES['h'][0]} WHERE {' AND '.join(conditions)}
+                GROUP BY okres
+                """
+            else:
+                # Rozdzielczość 15 minut jest dostępna tylko w tabeli pojazdy
+                conditions, params = _rollup_filters('numer_odcinka', 'data_15min', section_number, *dates)
+                bucket = "date_trunc('hour', data_15min)" if resolution == 60 else "data_15min"
+                sums = ', '.join(f"SUM({raw}) AS liczba_{i}" for i, (raw, _) in enumerate(expressions))
+                buckets = f"""
+                SELECT {bucket} AS okres, {sums}
+                FROM pojazdy WHERE {' AND '.join(conditions)}
+                GROUP BY 1
+                """
+            averages = ', '.join(f"AVG(liczba_{i})::float8" for i in range(len(expressions)))
+            cursor.execute(f"""
+            WITH kubelki AS ({buckets})
+            SELECT extract(isodow FROM okres)::int - 1 AS dzien,
+                   (extract(hour FROM okres)::int * 60 + extract(minute FROM okres)::int) / %s AS pole,
+                   {averages}
+            FROM kubelki
+            GROUP BY 1, 2
+            """, params + [resolution])
+            rows = cursor.fetchall()
+    except psycopg2.Error as e:
+        conn.close()
+        return None, str(e)
 
-        if not match:
-            return None, "Formatted section does not match expected pattern."
+    conn.close()
+    if not rows:
+        return None, None
 
-        # Extract the relevant parts
-        id_mr_part = match.group(1).strip()
-        droga = match.group(2).strip()
-        pikietaz = match.group(3).strip()
-        lokalizacja = match.group(4).strip()
+    rows = np.array(rows, dtype=np.float64)
+    days, slots = rows[:, 0].astype(np.intp), rows[:, 1].astype(np.intp)
+    matrices = np.full((len(HEATMAP_CAR_TYPES), 7, 1440 // resolution), np.nan)
+    matrices[:, days, slots] = rows[:, 2:].T
+    return dict(zip(HEATMAP_CAR_TYPES, matrices.round(1))), None
 
-        # Check if the part matches any entry
-        matching_id_mr = None
-        for key, value in excel_info.items():
-            if value['droga'] == droga and value['pikietaż'] == pikietaz and value['lokalizacja'] == lokalizacja:
 
-                # Extract last three digits of ID_MR
-                if key.endswith(id_mr_part):
-                    matching_id_mr = key
-                    break
+# Szereg czasowy 15-minutowy zmniejszany na serwerze do stałej liczby punktów
+TIMESERIES_POINTS = int(os.getenv('TIMESERIES_POINTS', '1000'))
+TIMESERIES_MAX_POINTS = 5000
+# LTTB zawsze zachowuje pierwszy i ostatni punkt, więc potrzebuje co najmniej trzech
+TIMESERIES_MIN_POINTS = 3
 
-        if matching_id_mr:
-            return matching_id_mr, None
-        else:
-            return None, "No matching ID_MR found in the Excel data."
+
+@timed('fetch')
+def fetch_time_series(start, end, section_number=None, car_type=None):
+    """15-minutowe sumy pojazdów w przedziale [start, end) jako tablice (czasy datetime64, wartości float64).
+
+    Bez odcinka wartości są sumą wszystkich odcinków.
+    """
+    try:
+        conn = connect_db()
+    except psycopg2.Error as e:
+        return None, None, str(e)
+
+    raw_expression, _ = PLOT_CAR_TYPE_EXPRESSIONS.get(car_type, PLOT_ALL_CARS_EXPRESSIONS)
+    conditions, params = ["data_15min >= %s", "data_15min < %s"], [start, end]
+    if section_number:
+        conditions.append("numer_odcinka = %s")
+        params.append(section_number)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+            SELECT data_15min, SUM({raw_expression})::float8
+            FROM pojazdy WHERE {' AND '.join(conditions)}
+            GROUP BY 1
+            ORDER BY 1
+            """, params)
+            rows = cursor.fetchall()
+    except psycopg2.Error as e:
+        conn.close()
+        return None, None, str(e)
+
+    conn.close()
+    times = np.array([row[0] for row in rows], dtype='datetime64[s]')
+    values = np.array([row[1] for row in rows], dtype=np.float64)
+    return times, values, None
+
+
+@timed('downsample', input_rows=True)
+def lttb(x, y, threshold):
+    """Largest-Triangle-Three-Buckets: indeksy threshold punktów zachowujących kształt serii.
+
+    Granice i średnie kubełków liczone są wektorowo (np.add.reduceat), a pole trójkątów - dla całego
+    kubełka naraz; pętla ma threshold iteracji niezależnie od długości serii, bo wybór punktu
+    zależy od punktu wybranego w poprzednim kubełku.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # Pierwszy i ostatni punkt zostają; pozostałe dzielone są na threshold - 2 kubełki
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.intp)
+    counts = np.diff(edges)
+    average_x = np.add.reduceat(x[:n - 1], edges[:-1]) / counts
+    average_y = np.add.reduceat(y[:n - 1], edges[:-1]) / counts
+    # Trzeci wierzchołek trójkąta: średnia następnego kubełka, dla ostatniego - ostatni punkt
+    next_x = np.append(average_x[1:], x[-1])
+    next_y = np.append(average_y[1:], y[-1])
+
+    selected = np.empty(threshold, dtype=np.intp)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        area = np.abs((x[a] - next_x[i]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (next_y[i] - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+# Percentyle (np. V85) z histogramów zapisanych w tabeli pojazdy
+HISTOGRAM_POJAZDY_COLUMNS = {'speed': 'histogram_predkosci', 'length': 'histogram_dlugosci'}
+PERCENTILES_DEFAULT = (85,)
+
+
+@timed('fetch')
+def fetch_histogram(measure, start_date=None, end_date=None, section_number=None, lanes=(1, 2),
+                    categories=('H', 'L')):
+    """Suma histogramów measure (speed lub length) z wybranych pasów i kategorii jako tablica liczności.
+
+    Histogramy sumowane są w SQL po przedziałach: wielo-argumentowe unnest ... WITH ORDINALITY
+    rozwija wszystkie kolumny naraz, więc do aplikacji wraca jeden wiersz na przedział.
+    """
+    try:
+        conn = connect_db()
+    except psycopg2.Error as e:
+        return None, str(e)
+
+    columns = [f'p.{HISTOGRAM_POJAZDY_COLUMNS[measure]}_{category.lower()}_pas_{lane}'
+               for lane in lanes for category in categories]
+    names = [f'n{i}' for i in range(len(columns))]
+    conditions, params = _rollup_filters('p.numer_odcinka', 'p.data_15min', section_number, start_date, end_date)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+            SELECT h.przedzial, SUM({' + '.join(f'COALESCE(h.{name}, 0)' for name in names)})::bigint
+            FROM pojazdy p
+            CROSS JOIN LATERAL unnest({', '.join(columns)}) WITH ORDINALITY AS h({', '.join(names)}, przedzial)
+            WHERE {' AND '.join(conditions)}
+            GROUP BY 1
+            """, params)
+            rows = cursor.fetchall()
+    except psycopg2.Error as e:
+        conn.close()
+        return None, str(e)
+
+    conn.close()
+    edges = HISTOGRAMS[measure][1]
+    counts = np.zeros(len(edges) - 1, dtype=np.int64)
+    for position, count in rows:
+        counts[position - 1] = count
+    return counts, None
+
+
+def histogram_percentiles(counts, edges, percentiles):
+    """Przybliżone percentyle z liczności przedziałów - interpolacja liniowa wewnątrz przedziału.
+
+    Błąd nie przekracza szerokości przedziału; None, gdy histogram jest pusty.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    total = counts.sum()
+    if not total:
+        return [None] * len(percentiles)
+    cumulative = np.cumsum(counts)
+    targets = np.asarray(percentiles, dtype=np.float64) / 100 * total
+    # Cel 0 wskazuje pierwszy niepusty przedział
+    bins = np.maximum(np.searchsorted(cumulative, targets, side='left'), np.argmax(counts > 0))
+    before = cumulative[bins] - counts[bins]
+    values = edges[bins] + (targets - before) / counts[bins] * (edges[bins + 1] - edges[bins])
+    return values.tolist()
+
+
+class ReferenceData:
+    """Zindeksowane dane z arkusza referencyjnego punktów MR."""
+
+    def __init__(self, signature=None):
+        self.signature = signature
+        self.by_id = {}  # ID_MR -> droga, pikietaż, lokalizacja, N_wgs84, E_wgs84
+        self.by_label = {}  # sformatowana etykieta -> ID_MR
+        self.by_location = {}  # (droga, pikietaż, lokalizacja) -> lista ID_MR
+
+    def add(self, id_mr, droga, pikietaz, lokalizacja, n_wgs84=None, e_wgs84=None):
+        info = self.by_id.setdefault(id_mr, {'N_wgs84': None, 'E_wgs84': None})
+        # Opis punktu pochodzi z ostatniego arkusza, współrzędne z pierwszego, który je zawiera
+        info.update({'droga': droga, 'pikietaż': pikietaz, 'lokalizacja': lokalizacja})
+        if info['N_wgs84'] is None and pd.notna(n_wgs84) and pd.notna(e_wgs84):
+            info['N_wgs84'], info['E_wgs84'] = float(n_wgs84), float(e_wgs84)
+
+    def build_indexes(self):
+        self.by_label.clear()
+        self.by_location.clear()
+        for id_mr, info in self.by_id.items():
+            # Etykiety nie są unikalne (ten sam numer końcowy) - wygrywa pierwszy punkt, jak przy przeszukiwaniu
+            self.by_label.setdefault(format_section_label(id_mr, info), id_mr)
+            self.by_location.setdefault((info['droga'], info['pikietaż'], info['lokalizacja']), []).append(id_mr)
+
+
+SECTION_LABEL_FIELDS = ['numer', 'droga', 'km', 'lokalizacja']
+
+
+def section_label_parts(section, info):
+    return [str(part) for part in (section.split('_')[-1], info.get('droga', ''), info.get('pikietaż', ''),
+                                   info.get('lokalizacja'))]
+
+
+def format_section_label(section, info):
+    return "{} ({}, km {}, {})".format(*section_label_parts(section, info))
+
+
+_reference_cache = {}
+_reference_lock = threading.Lock()
+
+
+def load_reference_data(excel_path):
+    """Zwraca dane referencyjne MR; arkusz jest ponownie wczytywany tylko po zmianie pliku."""
+    try:
+        stat = os.stat(excel_path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        signature = None
+
+    with _reference_lock:
+        cached = _reference_cache.get(excel_path)
+    if cached is not None and signature is not None and cached.signature == signature:
+        return cached
+
+    reference = ReferenceData(signature)
+    xls = pd.ExcelFile(excel_path, engine='calamine')
+    try:
+        for sheet_name in xls.sheet_names:
+            df = pd.read_excel(xls, sheet_name=sheet_name)
+
+            # Normalize column names
+            df.columns = df.columns.astype(str).str.strip().str.lower()
+            if 'id_mr' in df.columns:
+                if 'pikieta' in df.columns:
+                    # Arkusz 114B ma obie kolumny - "pikietaż" zawiera tam dodatkowo stronę drogi
+                    df = df.drop(columns=['pikietaż'], errors='ignore').rename(columns={'pikieta': 'pikietaż'})
+                df = df.rename(columns={'id_mr': 'ID_MR'})
+                for column in ['droga', 'pikietaż', 'lokalizacja', 'n_wgs84', 'e_wgs84']:
+                    if column not in df.columns:
+                        df[column] = None
+
+                df_filtered = df.dropna(subset=['ID_MR'])
+                for id_mr, droga, pikietaz, lokalizacja, n_wgs84, e_wgs84 in zip(
+                        df_filtered['ID_MR'], df_filtered['droga'], df_filtered['pikietaż'],
+                        df_filtered['lokalizacja'], df_filtered['n_wgs84'], df_filtered['e_wgs84']):
+                    reference.add(str(id_mr).strip(), str(droga).strip(), str(pikietaz).strip(),
+                                  str(lokalizacja).strip(), n_wgs84, e_wgs84)
+    finally:
+        xls.close()
+    reference.build_indexes()
+
+    if signature is not None:
+        with _reference_lock:
+            _reference_cache[excel_path] = reference
+    return reference
+
+
+def get_sections(excel_path, columnar=False):
+    """Lista etykiet odcinków z bazy; przy columnar=True - słownik kolumn części etykiety."""
+    if not os.path.isfile(excel_path):
+        return None, f"Excel file does not exist at {excel_path}"
+
+    try:
+        # Connect to the database and fetch the sections
+        conn = connect_db()
+        query = 'SELECT DISTINCT numer_odcinka FROM pojazdy ORDER BY numer_odcinka'
+        df_db = pd.read_sql_query(query, conn)
+        conn.close()
+
+        try:
+            reference = load_reference_data(excel_path)
+        except Exception as e:
+            return None, f"Error reading Excel file: {str(e)}"
+
+        if not reference.by_id:
+            return None, "Column 'ID_MR' not found in any sheet of Excel file."
+
+        if columnar:
+            parts = [section_label_parts(section, reference.by_id.get(str(section).strip(), {}))
+                     for section in df_db['numer_odcinka']]
+            return {field: [row[i] for row in parts] for i, field in enumerate(SECTION_LABEL_FIELDS)}, None
+
+        # Create a list of sections with additional info
+        sections_with_info = [format_section_label(section, reference.by_id.get(str(section).strip(), {}))
+                              for section in df_db['numer_odcinka']]
+
+        return sections_with_info, None
+    except Exception as e:
+        return None, str(e)
+
+
+@timed('reference_lookup')
+def reverse_format_section(excel_path, formatted_section):
+    if not os.path.isfile(excel_path):
+        return None, f"Excel file does not exist at {excel_path}"
+
+    try:
+        try:
+            reference = load_reference_data(excel_path)
+        except Exception as e:
+            return None, f"Error reading Excel file: {str(e)}"
+
+        # Etykiety z listy odcinków są dopasowywane bezpośrednio
+        matching_id_mr = reference.by_label.get(formatted_section)
+        if matching_id_mr:
+            return matching_id_mr, None
+
+        # Parse the formatted_section string
+        pattern = re.compile(r'(\d+)\s*\(([^,]+),\s*km\s*([\d+]+(?:\d*)?),\s*([^)]*)\)')
+        match = pattern.match(formatted_section)
+
+        if not match:
+            return None, "Formatted section does not match expected pattern."
+
+        # Extract the relevant parts
+        id_mr_part = match.group(1).strip()
+        droga = match.group(2).strip()
+        pikietaz = match.group(3).strip()
+        lokalizacja = match.group(4).strip()
+
+        # Check if the part matches any entry with the same location
+        for key in reference.by_location.get((droga, pikietaz, lokalizacja), []):
+            # Extract last digits of ID_MR
+            if key.endswith(id_mr_part):
+                return key, None
+
+        return None, "No matching ID_MR found in the Excel data."
 
     except Exception as e:
         return None, str(e)
@@ -453,47 +1851,47 @@ def get_location():
     if not section_number:
         return jsonify({'error': 'Nie podano numeru MR'}), 400
 
-        # Wywołaj reverse_format_section tylko raz
+    # Wywołaj reverse_format_section tylko raz
     section_reverse, error = reverse_format_section(resource_path_mr_number_info(), section_number)
     if error:
         return jsonify({'error': error}), 400
 
-    # Wczytaj wszystkie arkusze na raz
-    xls = pd.ExcelFile(resource_path_mr_number_info(), engine='calamine')
+    # Współrzędne pochodzą z zindeksowanych danych referencyjnych
     try:
-        sheets_dict = {sheet: pd.read_excel(xls, sheet_name=sheet) for sheet in xls.sheet_names}
-    finally:
-        xls.close()
-
-    location_info = None
-    for sheet_name, df in sheets_dict.items():
-        # Ujednolicenie nazw kolumn
-        df.columns = df.columns.str.strip().str.lower()
-        # Sprawdzenie, czy wymagane kolumny istnieją
-        if 'id_mr' in df.columns and 'n_wgs84' in df.columns and 'e_wgs84' in df.columns:
-            df.rename(columns={'id_mr': 'ID_MR'}, inplace=True)
-            # Filtracja po numerze MR
-            row = df[df['ID_MR'] == section_reverse]
-            if not row.empty:
-                n_wgs84 = row.iloc[0]['n_wgs84']
-                e_wgs84 = row.iloc[0]['e_wgs84']
-                location_info = {'N_wgs84': n_wgs84, 'E_wgs84': e_wgs84}
-                break
+        reference = load_reference_data(resource_path_mr_number_info())
+    except Exception as e:
+        return jsonify({'error': f"Error reading Excel file: {str(e)}"}), 500
 
-    if location_info:
-        return jsonify(location_info)
+    info = reference.by_id.get(section_reverse)
+    if info and info['N_wgs84'] is not None:
+        return jsonify({'N_wgs84': info['N_wgs84'], 'E_wgs84': info['E_wgs84']})
     else:
         return jsonify({'error': 'Nie znaleziono lokalizacji dla podanego numeru MR'}), 404
 
 
 @app.route('/get_sections', methods=['GET'])
 def get_sections_endpoint():
-    sections, error = get_sections(resource_path_mr_number_info())
+    columnar = response_format((COLUMNAR_MIMETYPE,)) == COLUMNAR_MIMETYPE
+    sections, error = get_sections(resource_path_mr_number_info(), columnar=columnar)
     if error:
         return jsonify({"error": error})
-    return jsonify(sections)
+    if columnar:
+        # Etykiety składane są w przeglądarce z kolumn części
+        response = Response(json.dumps({'format': 'columnar', 'columns': sections}, separators=(',', ':')),
+                            mimetype=COLUMNAR_MIMETYPE)
+    else:
+        response = jsonify(sections)
+    response.vary.add('Accept')
+    return response
+
 
+DAYS_OF_WEEK = {
+    'Monday': 0, 'Tuesday': 1, 'Wednesday': 2, 'Thursday': 3,
+    'Friday': 4, 'Saturday': 5, 'Sunday': 6
+}
 
+
+@timed('process')
 def process_data(df, car_type, day_of_week=None):
     try:
         if car_type == 'H':
@@ -511,11 +1909,7 @@ def process_data(df, car_type, day_of_week=None):
         df = df.dropna(subset=['Liczba samochodów'])
 
         if day_of_week:
-            day_of_week_map = {
-                'Monday': 0, 'Tuesday': 1, 'Wednesday': 2, 'Thursday': 3,
-                'Friday': 4, 'Saturday': 5, 'Sunday': 6
-            }
-            day_num = day_of_week_map.get(day_of_week)
+            day_num = DAYS_OF_WEEK.get(day_of_week)
             if day_num is not None:
                 df = df[df.index.dayofweek == day_num]
 
@@ -528,10 +1922,34 @@ def process_data(df, car_type, day_of_week=None):
     return df_hourly, None
 
 
+@timed('process')
+def process_rollup(df, car_type, day_of_week=None):
+    """Odpowiednik process_data dla agregatów godzinowych - zwraca sumy pojazdów w kolejnych godzinach."""
+    try:
+        column = ROLLUP_CAR_TYPE_COLUMNS.get(car_type, 'liczba_samochodow')
+        df = pd.DataFrame({'Hour': pd.to_datetime(df['okres'], errors='coerce'),
+                           'Liczba samochodów': pd.to_numeric(df[column], errors='coerce')})
+        df = df.dropna()
+
+        if day_of_week:
+            day_num = DAYS_OF_WEEK.get(day_of_week)
+            if day_num is not None:
+                df = df[df['Hour'].dt.dayofweek == day_num]
+
+        # Przy wielu odcinkach ta sama godzina występuje kilka razy
+        df_hourly = df.groupby('Hour').sum()
+
+    except Exception as e:
+        return None, str(e)
+
+    return df_hourly, None
+
+
 @app.route('/')
 def index():
-    connect_db()
-    db_message = f"Obecnie używana baza danych: {DATABASE_NAME}" if DATABASE_NAME else "Baza danych nie jest przypisana"
+    # Nazwa bazy pochodzi z sesji - nie ma potrzeby otwierać połączenia przy każdym wyświetleniu strony
+    db_name = session.get('db_name')
+    db_message = f"Obecnie używana baza danych: {db_name}" if db_name else "Baza danych nie jest przypisana"
     return render_template('index.html', db_message=db_message)
 
 
@@ -561,62 +1979,252 @@ def connect():
         return jsonify({'success': False, 'message': f'Nie udało się połączyć z bazą danych!'})
 
 
-def update_database_with_confirmation(df, overwrite_request):
+# Kolumny zagregowanej ramki danych i odpowiadające im kolumny tabeli pojazdy
+POJAZDY_COLUMNS = {
+    'Data 15min': 'data_15min',
+    'Numer odcinka': 'numer_odcinka',
+    'Średnia przestrzeń między pojazdem': 'srednia_przestrzen_pomiedzy_pojazdami',
+    'Liczba samochodów jadąca pod prąd': 'liczba_samochodow_jadaca_pod_prad',
+    'Liczba na pasie 1': 'liczba_na_pasie_1',
+    'Liczba samochodów H Pas 1': 'liczba_samochodow_h_pas_1',
+    'Średnia prędkość H Pas 1': 'srednia_predkosc_h_pas_1',
+    'Średnia długość H Pas 1': 'srednia_dlugosc_h_pas_1',
+    'Liczba samochodów L Pas 1': 'liczba_samochodow_l_pas_1',
+    'Średnia prędkość L Pas 1': 'srednia_predkosc_l_pas_1',
+    'Średnia długość L Pas 1': 'srednia_dlugosc_l_pas_1',
+    'Liczba na pasie 2': 'liczba_na_pasie_2',
+    'Liczba samochodów H Pas 2': 'liczba_samochodow_h_pas_2',
+    'Średnia prędkość H Pas 2': 'srednia_predkosc_h_pas_2',
+    'Średnia długość H Pas 2': 'srednia_dlugosc_h_pas_2',
+    'Liczba samochodów L Pas 2': 'liczba_samochodow_l_pas_2',
+    'Średnia prędkość L Pas 2': 'srednia_predkosc_l_pas_2',
+    'Średnia długość L Pas 2': 'srednia_dlugosc_l_pas_2',
+}
+# Histogramy prędkości i długości pojazdów (INTEGER[], przedziały SPEED_HISTOGRAM_EDGES i LENGTH_HISTOGRAM_EDGES)
+POJAZDY_HISTOGRAM_COLUMNS = {
+    f'Histogram {measure} {category} Pas {lane}': f'histogram_{column}_{category.lower()}_pas_{lane}'
+    for lane in (1, 2) for category in ('H', 'L')
+    for measure, column in (('prędkości', 'predkosci'), ('długości', 'dlugosci'))
+}
+POJAZDY_COLUMNS.update(POJAZDY_HISTOGRAM_COLUMNS)
+POJAZDY_KEY_COLUMNS = ['data_15min', 'numer_odcinka']
+
+_pojazdy_column_list = ', '.join(POJAZDY_COLUMNS.values())
+_pojazdy_update_set = ',\n'.join(f"{column} = EXCLUDED.{column}" for column in POJAZDY_COLUMNS.values()
+                                 if column not in POJAZDY_KEY_COLUMNS)
+ON_CONFLICT_OVERWRITE = f"ON CONFLICT (data_15min, numer_odcinka) DO UPDATE SET\n{_pojazdy_update_set}"
+ON_CONFLICT_KEEP = "ON CONFLICT (data_15min, numer_odcinka) DO NOTHING"
+
+# Typy kolumn tabeli pojazdy po stronie aplikacji: NUMERIC -> float64, INTEGER -> int32
+POJAZDY_DB_TYPES = {
+    'data_15min': 'datetime64[us]',
+    'numer_odcinka': 'object',
+    **{column: 'float64' for column in POJAZDY_COLUMNS.values() if column.startswith('srednia')},
+    **{column: 'int32' for column in POJAZDY_COLUMNS.values() if column.startswith('liczba')},
+}
+# Kolumny potrzebne do wykresu liczonego w pandas (process_data)
+PLOT_ROW_COLUMNS = ['data_15min', 'numer_odcinka',
+                    'liczba_samochodow_h_pas_1', 'liczba_samochodow_h_pas_2',
+                    'liczba_samochodow_l_pas_1', 'liczba_samochodow_l_pas_2',
+                    'liczba_na_pasie_1', 'liczba_na_pasie_2']
+
+# Od tej liczby wierszy dane trafiają do bazy przez COPY zamiast pojedynczych INSERT-ów
+BULK_INGEST_MIN_ROWS = int(os.getenv('BULK_INGEST_MIN_ROWS', '100'))
+
+
+@timed('db_write', input_rows=True)
+def update_database_with_confirmation(df, overwrite_request, bulk=None):
+    """Zapisuje zagregowane dane w tabeli pojazdy.
+
+    Przy bulk=None tryb wybierany jest na podstawie liczby wierszy: duże ramki są przesyłane
+    przez COPY do tabeli tymczasowej i scalane jednym zapytaniem INSERT ... SELECT.
+    """
+    if bulk is None:
+        bulk = len(df) >= BULK_INGEST_MIN_ROWS
+
     conn = connect_db()
     cursor = conn.cursor(cursor_factory=RealDictCursor)  # Wygenerowanie kursorów zwracających słowniki
+    on_conflict = ON_CONFLICT_OVERWRITE if overwrite_request else ON_CONFLICT_KEEP
 
-    for _, row in df.iterrows():
-        values = (
-            row['Data 15min'].to_pydatetime(), row['Numer odcinka'], row['Średnia przestrzeń między pojazdem'],
-            row['Liczba samochodów jadąca pod prąd'], row['Liczba na pasie 1'],
-            row['Liczba samochodów H Pas 1'], row['Średnia prędkość H Pas 1'], row['Średnia długość H Pas 1'],
-            row['Liczba samochodów L Pas 1'], row['Średnia prędkość L Pas 1'], row['Średnia długość L Pas 1'],
-            row['Liczba na pasie 2'], row['Liczba samochodów H Pas 2'], row['Średnia prędkość H Pas 2'],
-            row['Średnia długość H Pas 2'], row['Liczba samochodów L Pas 2'], row['Średnia prędkość L Pas 2'],
-            row['Średnia długość L Pas 2']
-        )
-
-        if overwrite_request:
-            cursor.execute("""
-            INSERT INTO pojazdy (data_15min, numer_odcinka, srednia_przestrzen_pomiedzy_pojazdami, 
-            liczba_samochodow_jadaca_pod_prad, liczba_na_pasie_1, liczba_samochodow_h_pas_1, srednia_predkosc_h_pas_1, 
-            srednia_dlugosc_h_pas_1, liczba_samochodow_l_pas_1, srednia_predkosc_l_pas_1, srednia_dlugosc_l_pas_1, 
-            liczba_na_pasie_2, liczba_samochodow_h_pas_2, srednia_predkosc_h_pas_2, srednia_dlugosc_h_pas_2, 
-            liczba_samochodow_l_pas_2, srednia_predkosc_l_pas_2, srednia_dlugosc_l_pas_2)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (data_15min, numer_odcinka) DO UPDATE SET
-            srednia_przestrzen_pomiedzy_pojazdami = EXCLUDED.srednia_przestrzen_pomiedzy_pojazdami,
-            liczba_samochodow_jadaca_pod_prad = EXCLUDED.liczba_samochodow_jadaca_pod_prad,
-            liczba_na_pasie_1 = EXCLUDED.liczba_na_pasie_1,
-            liczba_samochodow_h_pas_1 = EXCLUDED.liczba_samochodow_h_pas_1,
-            srednia_predkosc_h_pas_1 = EXCLUDED.srednia_predkosc_h_pas_1,
-            srednia_dlugosc_h_pas_1 = EXCLUDED.srednia_dlugosc_h_pas_1,
-            liczba_samochodow_l_pas_1 = EXCLUDED.liczba_samochodow_l_pas_1,
-            srednia_predkosc_l_pas_1 = EXCLUDED.srednia_predkosc_l_pas_1,
-            srednia_dlugosc_l_pas_1 = EXCLUDED.srednia_dlugosc_l_pas_1,
-            liczba_na_pasie_2 = EXCLUDED.liczba_na_pasie_2,
-            liczba_samochodow_h_pas_2 = EXCLUDED.liczba_samochodow_h_pas_2,
-            srednia_predkosc_h_pas_2 = EXCLUDED.srednia_predkosc_h_pas_2,
-            srednia_dlugosc_h_pas_2 = EXCLUDED.srednia_dlugosc_h_pas_2,
-            liczba_samochodow_l_pas_2 = EXCLUDED.liczba_samochodow_l_pas_2,
-            srednia_predkosc_l_pas_2 = EXCLUDED.srednia_predkosc_l_pas_2,
-            srednia_dlugosc_l_pas_2 = EXCLUDED.srednia_dlugosc_l_pas_2
-            """, values)
-        else:
-            # Jeśli overwrite_request jest False, to wykonujemy tylko INSERT
-            cursor.execute("""
-            INSERT INTO pojazdy (data_15min, numer_odcinka, srednia_przestrzen_pomiedzy_pojazdami, 
-            liczba_samochodow_jadaca_pod_prad, liczba_na_pasie_1, liczba_samochodow_h_pas_1, srednia_predkosc_h_pas_1, 
-            srednia_dlugosc_h_pas_1, liczba_samochodow_l_pas_1, srednia_predkosc_l_pas_1, srednia_dlugosc_l_pas_1, 
-            liczba_na_pasie_2, liczba_samochodow_h_pas_2, srednia_predkosc_h_pas_2, srednia_dlugosc_h_pas_2, 
-            liczba_samochodow_l_pas_2, srednia_predkosc_l_pas_2, srednia_dlugosc_l_pas_2)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (data_15min, numer_odcinka) DO NOTHING
+    ensure_pojazdy_partitions(cursor, df['Data 15min'])
+    if bulk:
+        _bulk_insert_pojazdy(cursor, df, on_conflict)
+    else:
+        for row in _pojazdy_frame(df).itertuples(index=False, name=None):
+            values = (pd.Timestamp(row[0]).to_pydatetime(),) + row[1:]
+            cursor.execute(f"""
+            INSERT INTO pojazdy ({_pojazdy_column_list})
+            VALUES ({', '.join(['%s'] * len(POJAZDY_COLUMNS))})
+            {on_conflict}
             """, values)
 
+    # Agregaty godzinowe i dzienne (tabele tworzy migracja schematu) są aktualizowane
+    # w tej samej transakcji co pojazdy
+    refresh_rollups(cursor, df['Data 15min'], df['Numer odcinka'])
+
     conn.commit()
     cursor.close()
     conn.close()
+    invalidate_plot_cache(df)
+
+
+def _pojazdy_frame(df):
+    """Kolumny tabeli pojazdy z ramki; ramki bez histogramów (np. zapisane w temp_data przed ich
+    wprowadzeniem) mają w nich NULL."""
+    missing = {column: None for column in POJAZDY_HISTOGRAM_COLUMNS if column not in df.columns}
+    rows = df.assign(**missing)[list(POJAZDY_COLUMNS)]
+    histograms = rows[list(POJAZDY_HISTOGRAM_COLUMNS)]
+    return rows.assign(**histograms.astype(object).where(histograms.notna(), None))
+
+
+def _bulk_insert_pojazdy(cursor, df, on_conflict):
+    # Tabela tymczasowa znika razem z końcem transakcji
+    cursor.execute("""
+    CREATE TEMP TABLE pojazdy_staging (LIKE pojazdy INCLUDING DEFAULTS) ON COMMIT DROP
+    """)
+
+    buffer = io.StringIO()
+    rows = _pojazdy_frame(df)
+    # Puste histogramy jako puste pole CSV, czyli NULL
+    rows = rows.assign(**{column: rows[column].fillna('') for column in POJAZDY_HISTOGRAM_COLUMNS})
+    # Puste średnie zapisujemy jako NaN, tak samo jak robi to ścieżka z pojedynczymi INSERT-ami
+    rows.to_csv(buffer, header=False, index=False, na_rep='NaN', date_format='%Y-%m-%d %H:%M:%S')
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY pojazdy_staging ({_pojazdy_column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+    cursor.execute(f"""
+    INSERT INTO pojazdy ({_pojazdy_column_list})
+    SELECT {_pojazdy_column_list} FROM pojazdy_staging
+    {on_conflict}
+    """)
+
+
+# Tabele z agregatami pojazdy dla dłuższych okresów: granulacja -> (tabela, jednostka date_trunc)
+ROLLUP_TABLES = {
+    'h': ('pojazdy_godzinowe', 'hour'),
+    'D': ('pojazdy_dzienne', 'day'),
+}
+# Kolumny agregatów i wyrażenia liczone na wierszach 15-minutowych. Suma obu pasów liczona jest
+# dla każdego wiersza, tak jak w process_data, aby wiersze z brakującym pasem były pomijane.
+ROLLUP_COLUMNS = {
+    'liczba_interwalow': 'COUNT(*)',
+    'liczba_samochodow': 'SUM(p.liczba_na_pasie_1 + p.liczba_na_pasie_2)',
+    'liczba_samochodow_h': 'SUM(p.liczba_samochodow_h_pas_1 + p.liczba_samochodow_h_pas_2)',
+    'liczba_samochodow_l': 'SUM(p.liczba_samochodow_l_pas_1 + p.liczba_samochodow_l_pas_2)',
+    'liczba_samochodow_pod_prad': 'SUM(p.liczba_samochodow_jadaca_pod_prad)',
+}
+# Kolumna agregatu odpowiadająca typowi samochodu z formularza wykresu
+ROLLUP_CAR_TYPE_COLUMNS = {'H': 'liczba_samochodow_h', 'L': 'liczba_samochodow_l'}
+
+_rollup_column_list = ', '.join(ROLLUP_COLUMNS)
+_rollup_update_set = ', '.join(f"{column} = EXCLUDED.{column}" for column in ROLLUP_COLUMNS)
+
+
+def _rollup_select(unit, where, source='pojazdy p'):
+    expressions = ', '.join(f"{expression} AS {column}" for column, expression in ROLLUP_COLUMNS.items())
+    return f"""
+    SELECT date_trunc('{unit}', p.data_15min) AS okres, p.numer_odcinka, {expressions}
+    FROM {source}
+    WHERE {where}
+    GROUP BY 1, 2
+    """
+
+
+def ensure_rollup_tables(cursor):
+    """Tworzy tabele agregatów; nowo utworzona tabela jest od razu wypełniana danymi z pojazdy.
+
+    Wywoływana przez migrację schematu oraz polecenie rollup-backfill, a nie przy każdym zapisie.
+    """
+    for table, unit in ROLLUP_TABLES.values():
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+        row = cursor.fetchone()
+        if row and _first_value(row):
+            continue
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            okres TIMESTAMP NOT NULL,
+            numer_odcinka TEXT NOT NULL,
+            liczba_interwalow INTEGER NOT NULL,
+            liczba_samochodow BIGINT,
+            liczba_samochodow_h BIGINT,
+            liczba_samochodow_l BIGINT,
+            liczba_samochodow_pod_prad BIGINT,
+            PRIMARY KEY (numer_odcinka, okres)
+        )
+        """)
+        cursor.execute(f"INSERT INTO {table} (okres, numer_odcinka, {_rollup_column_list}) "
+                       + _rollup_select(unit, 'p.data_15min IS NOT NULL AND p.numer_odcinka IS NOT NULL'))
+
+
+def _first_value(row):
+    # Kursory zwracają krotki albo słowniki (RealDictCursor)
+    return next(iter(row.values())) if isinstance(row, dict) else row[0]
+
+
+def refresh_rollups(cursor, timestamps, sections):
+    """Przelicza z tabeli pojazdy agregaty okresów, do których trafiły podane wiersze."""
+    keys = pd.DataFrame({'data_15min': pd.to_datetime(timestamps), 'numer_odcinka': sections}).dropna()
+    if keys.empty:
+        return
+    for freq, (table, unit) in ROLLUP_TABLES.items():
+        touched = keys.assign(okres=keys['data_15min'].dt.floor(freq))[['okres', 'numer_odcinka']].drop_duplicates()
+        source = f"""unnest(%s::timestamp[], %s::text[]) AS t(okres, numer_odcinka)
+        JOIN pojazdy p ON p.numer_odcinka = t.numer_odcinka
+            AND p.data_15min >= t.okres AND p.data_15min < t.okres + INTERVAL '1 {unit}'"""
+        cursor.execute(f"""
+        INSERT INTO {table} (okres, numer_odcinka, {_rollup_column_list})
+        {_rollup_select(unit, 'TRUE', source)}
+        ON CONFLICT (numer_odcinka, okres) DO UPDATE SET {_rollup_update_set}
+        """, ([ts.to_pydatetime() for ts in touched['okres']], [str(section) for section in touched['numer_odcinka']]))
+
+
+def rebuild_rollups(cursor, section_number=None, start_date=None, end_date=None):
+    """Odbudowuje agregaty z tabeli pojazdy dla odcinka i zakresu dat (domyślnie całości)."""
+    conditions, params = _rollup_filters('p.numer_odcinka', 'p.data_15min', section_number, start_date, end_date)
+    # Zakres obejmuje pełne dni, więc pokrywa się z pełnymi okresami każdego agregatu
+    table_conditions, table_params = _rollup_filters('numer_odcinka', 'okres', section_number, start_date, end_date)
+    for table, unit in ROLLUP_TABLES.values():
+        cursor.execute(f"DELETE FROM {table} WHERE {' AND '.join(table_conditions)}", table_params)
+        cursor.execute(f"INSERT INTO {table} (okres, numer_odcinka, {_rollup_column_list}) "
+                       + _rollup_select(unit, ' AND '.join(conditions)), params)
+
+
+def check_rollups(cursor, section_number=None, start_date=None, end_date=None):
+    """Zwraca listę (tabela, okres, numer_odcinka) agregatów niezgodnych z tabelą pojazdy."""
+    conditions, params = _rollup_filters('p.numer_odcinka', 'p.data_15min', section_number, start_date, end_date)
+    table_conditions, table_params = _rollup_filters('numer_odcinka', 'okres', section_number, start_date, end_date)
+    mismatches = []
+    for table, unit in ROLLUP_TABLES.values():
+        differs = ' OR '.join(f"e.{column} IS DISTINCT FROM r.{column}" for column in ROLLUP_COLUMNS)
+        cursor.execute(f"""
+        WITH expected AS ({_rollup_select(unit, ' AND '.join(conditions))}),
+        stored AS (SELECT * FROM {table} WHERE {' AND '.join(table_conditions)})
+        SELECT COALESCE(e.okres, r.okres), COALESCE(e.numer_odcinka, r.numer_odcinka)
+        FROM expected e
+        FULL OUTER JOIN stored r ON r.okres = e.okres AND r.numer_odcinka = e.numer_odcinka
+        WHERE {differs}
+        ORDER BY 2, 1
+        """, params + table_params)
+        mismatches.extend((table, *row) for row in cursor.fetchall())
+    return mismatches
+
+
+def _rollup_filters(section_column, time_column, section_number, start_date, end_date):
+    conditions, params = [f"{time_column} IS NOT NULL", f"{section_column} IS NOT NULL"], []
+    if isinstance(section_number, (list, tuple)):
+        # Kilka odcinków jednym warunkiem
+        conditions.append(f"{section_column} = ANY(%s)")
+        params.append(list(section_number))
+    elif section_number:
+        conditions.append(f"{section_column} = %s")
+        params.append(section_number)
+    if start_date:
+        conditions.append(f"{time_column} >= date_trunc('day', %s::timestamp)")
+        params.append(start_date)
+    if end_date:
+        conditions.append(f"{time_column} < date_trunc('day', %s::timestamp) + INTERVAL '1 day'")
+        params.append(end_date)
+    return conditions, params
 
 
 # Upload file from excel or database
@@ -628,34 +2236,132 @@ def upload():
     # xlsx or csv file
     if 'file' in request.files:
         file = request.files['file']
-        df, error = load_data(file)
-        if error:
-            return jsonify(error=error)
         try:
-            processed_df = process_data_db(df)
+            processed_df, error = load_aggregated_data(file)
         except Exception as e:
             return jsonify(error=f"Błąd podczas przetwarzania danych: {e}")
+        if error:
+            return jsonify(error=error)
 
-        # Sprawdzamy, czy istnieją rekordy w bazie danych
-        existing_records = update_database(processed_df)
-        if existing_records:
-            # Sprawdzamy, czy tabela istnieje, jeśli nie, to ją tworzymy
-            create_temp_data_table()
+        return store_aggregated_data(processed_df)
 
-            # Zapisujemy dane do bazy
-            temp_id = save_data_to_db(processed_df)
+    return jsonify(error="Nieprawidłowe dane wejściowe")
 
-            return jsonify({
-                "message": "Znaleziono istniejące rekordy. Czy chcesz je nadpisać?",
-                "requires_confirmation": True,
-                "temp_id": temp_id
-            })
 
-        # Jeśli brak istniejących rekordów, wykonujemy aktualizację
-        update_database_with_confirmation(processed_df, overwrite_request=False)
-        return jsonify(success=True)
+def store_aggregated_data(processed_df, **extra):
+    """Zapisuje dane w tabeli pojazdy albo, gdy istnieją już rekordy, odkłada je do potwierdzenia."""
+    # Sprawdzamy, czy istnieją rekordy w bazie danych
+    existing_records = update_database(processed_df)
+    if existing_records:
+        # Sprawdzamy, czy tabela istnieje, jeśli nie, to ją tworzymy
+        create_temp_data_table()
+
+        # Zapisujemy dane do bazy
+        temp_id = save_data_to_db(processed_df)
+
+        return jsonify({
+            "message": "Znaleziono istniejące rekordy. Czy chcesz je nadpisać?",
+            "requires_confirmation": True,
+            "temp_id": temp_id,
+            "conflicts": len(existing_records),
+            **extra
+        })
+
+    # Jeśli brak istniejących rekordów, wykonujemy aktualizację
+    update_database_with_confirmation(processed_df, overwrite_request=False)
+    return jsonify(success=True, **extra)
+
+
+# Liczba procesów parsujących pliki przy przesyłaniu wielu plików naraz
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', str(os.cpu_count() or 1)))
+_upload_executor = None
+_upload_executor_lock = threading.Lock()
+
+
+def get_upload_executor():
+    global _upload_executor
+    with _upload_executor_lock:
+        if _upload_executor is None:
+            # spawn zamiast fork - proces serwera ma już wątki (pule, blokady), których fork nie kopiuje bezpiecznie
+            _upload_executor = ProcessPoolExecutor(max_workers=UPLOAD_WORKERS,
+                                                   mp_context=multiprocessing.get_context('spawn'))
+        return _upload_executor
+
+
+def aggregate_upload(file_name, content):
+    """Wczytuje i agreguje jeden plik (także w procesie roboczym); zwraca (nazwa, dane, błąd)."""
+    file = io.BytesIO(content)
+    file.filename = file_name
+    try:
+        processed_df, error = load_aggregated_data(file)
+    except Exception as e:
+        return file_name, None, f"Błąd podczas przetwarzania danych: {e}"
+    return file_name, processed_df, error
 
-    return jsonify(error="Nieprawidłowe dane wejściowe")
+
+def expand_uploads(files):
+    """Zwraca listę (nazwa, zawartość) przesłanych plików oraz raport błędów; archiwa zip są rozpakowywane."""
+    uploads, report = [], []
+    for file in files:
+        if file.filename.lower().endswith('.zip'):
+            try:
+                with zipfile.ZipFile(file.stream) as archive:
+                    for member in archive.infolist():
+                        if not member.is_dir():
+                            uploads.append((os.path.basename(member.filename), archive.read(member)))
+            except zipfile.BadZipFile:
+                report.append({'file': file.filename, 'error': "Niepoprawne archiwum zip."})
+        else:
+            uploads.append((file.filename, file.read()))
+    return uploads, report
+
+
+@app.route('/upload_batch', methods=['POST'])
+def upload_batch():
+    if 'db_name' not in session:
+        error_message = "Brak przypisanej bazy danych. Proszę przypisać bazę danych przed przesłaniem pliku Excel."
+        return jsonify(error=error_message)
+    files = request.files.getlist('files') + request.files.getlist('file')
+    if not files:
+        return jsonify(error="Nieprawidłowe dane wejściowe")
+
+    uploads, report = expand_uploads(files)
+    names = [name for name, _ in uploads]
+    contents = [content for _, content in uploads]
+    try:
+        # Parsowanie xlsx obciąża procesor, więc pliki trafiają do puli procesów
+        if len(uploads) > 1 and UPLOAD_WORKERS > 1:
+            results = list(get_upload_executor().map(aggregate_upload, names, contents))
+        else:
+            results = list(map(aggregate_upload, names, contents))
+    except Exception as e:
+        return jsonify(error=f"Błąd podczas przetwarzania danych: {e}", files=report)
+
+    frames, entries = [], []
+    for name, processed_df, error in results:
+        if error:
+            report.append({'file': name, 'error': error})
+        else:
+            frames.append(processed_df)
+            entries.append({'file': name, 'rows': len(processed_df)})
+            report.append(entries[-1])
+    if not frames:
+        return jsonify(error="Żaden plik nie został poprawnie przetworzony.", files=report)
+
+    # Jedno sprawdzenie konfliktów i jeden zapis dla wszystkich plików
+    processed_df = pd.concat(frames, ignore_index=True)
+    superseded = processed_df.duplicated(subset=['Data 15min', 'Numer odcinka'], keep='last').to_numpy()
+    if superseded.any():
+        # Ten sam klucz w kilku plikach - zapisywany jest wiersz z ostatniego pliku, a pominięte
+        # klucze trafiają do raportu pliku, z którego pochodziły
+        origin = np.repeat(np.arange(len(frames)), [len(frame) for frame in frames])
+        for index in np.unique(origin[superseded]):
+            keys = processed_df.loc[superseded & (origin == index), ['Numer odcinka', 'Data 15min']]
+            entries[index]['duplicates'] = [
+                [section, timestamp] for section, timestamp in zip(
+                    keys['Numer odcinka'], pd.to_datetime(keys['Data 15min']).dt.strftime('%Y-%m-%d %H:%M:%S'))]
+        processed_df = processed_df[~superseded].reset_index(drop=True)
+    return store_aggregated_data(processed_df, files=report)
 
 
 @app.route('/confirm-overwrite', methods=['POST'])
@@ -677,6 +2383,218 @@ def confirm_overwrite():
         return jsonify(error=f"Błąd podczas aktualizacji danych: {e}")
 
 
+# Zadania wczytywania plików w tle
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+JOB_SPOOL_DIR = os.getenv('JOB_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'inz_uploads'))
+JOB_RETENTION = float(os.getenv('JOB_RETENTION', '3600'))
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+_job_executor = None
+
+
+class IngestJob:
+    """Stan zadania wczytującego jeden plik do tabeli pojazdy."""
+
+    def __init__(self, file_name, path, credentials):
+        self.id = uuid.uuid4().hex
+        self.file_name = file_name
+        self.path = path
+        self.credentials = credentials
+        self.status = 'queued'  # queued, running, awaiting_confirmation, done, failed
+        self.stage = None
+        self.stages = {}  # etap -> czas trwania w sekundach
+        self.vehicles = None
+        self.rows = None
+        self.error = None
+        self.message = None
+        self.temp_id = None
+        self.conflicts = None
+        self.created = time.time()
+        self.finished = None
+        self._stage_started = None
+
+    def start_stage(self, stage):
+        self._end_stage()
+        self.status = 'running'
+        self.stage = stage
+        self._stage_started = time.perf_counter()
+
+    def finish(self, status, **fields):
+        self._end_stage()
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self.status = status
+        self.finished = time.time()
+
+    def _end_stage(self):
+        if self._stage_started is not None:
+            elapsed = time.perf_counter() - self._stage_started
+            self.stages[self.stage] = round(self.stages.get(self.stage, 0) + elapsed, 3)
+            self._stage_started = None
+
+    def to_dict(self):
+        job = {
+            'job_id': self.id,
+            'file': self.file_name,
+            'status': self.status,
+            'stage': self.stage,
+            'stages': dict(self.stages),
+            'vehicles': self.vehicles,
+            'rows': self.rows,
+        }
+        if self._stage_started is not None:
+            job['stage_elapsed'] = round(time.perf_counter() - self._stage_started, 3)
+        if self.error:
+            job['error'] = self.error
+        if self.status == 'awaiting_confirmation':
+            job.update(message=self.message, requires_confirmation=True, temp_id=self.temp_id,
+                       conflicts=self.conflicts)
+        return job
+
+
+def get_job_executor():
+    global _job_executor
+    with _jobs_lock:
+        if _job_executor is None:
+            _job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='ingest')
+        return _job_executor
+
+
+def _purge_jobs():
+    # Usuwane są tylko zakończone zadania; oczekujące w kolejce i wykonywane zostają niezależnie od wieku
+    now = time.time()
+    with _jobs_lock:
+        for job_id in [job_id for job_id, job in _jobs.items()
+                       if job.finished is not None and now - job.finished > JOB_RETENTION]:
+            del _jobs[job_id]
+
+
+def run_job(job, step, *args):
+    """Wykonuje krok zadania w kontekście aplikacji z danymi logowania zleceniodawcy."""
+    with app.app_context():
+        g.db_credentials = job.credentials
+        try:
+            step(job, *args)
+        except Exception as e:
+            job.finish('failed', error=f"Błąd podczas przetwarzania danych: {e}")
+
+
+def ingest_job(job):
+    try:
+        with open(job.path, 'rb') as file:
+            file.filename = job.file_name
+            # Plik przesłany już wcześniej nie jest ponownie wczytywany
+            job.start_stage('pamięć podręczna')
+            key = parse_cache_key(file)
+            processed_df, error = parse_cache.get(key), None
+            if processed_df is None:
+                if job.file_name.endswith('.csv'):
+                    # Pliki CSV są wczytywane i agregowane fragmentami w jednym przebiegu
+                    job.start_stage('wczytywanie i agregacja')
+                    processed_df, error = aggregate_file(file)
+                else:
+                    job.start_stage('wczytywanie')
+                    df, error = load_data(file)
+                    if not error:
+                        job.vehicles = len(df)
+                        job.start_stage('agregacja')
+                        processed_df = process_data_db(df)
+                        del df
+                if not error:
+                    parse_cache.put(key, processed_df)
+    finally:
+        os.remove(job.path)
+    if error:
+        job.finish('failed', error=error)
+        return
+    job.rows = len(processed_df)
+
+    job.start_stage('sprawdzanie konfliktów')
+    existing_records = update_database(processed_df)
+    if existing_records:
+        job.start_stage('zapis tymczasowy')
+        create_temp_data_table()
+        temp_id = save_data_to_db(processed_df)
+        job.finish('awaiting_confirmation', temp_id=temp_id, conflicts=len(existing_records),
+                   message="Znaleziono istniejące rekordy. Czy chcesz je nadpisać?")
+        return
+
+    job.start_stage('zapis')
+    update_database_with_confirmation(processed_df, overwrite_request=False)
+    job.finish('done')
+
+
+def confirm_job(job, overwrite_request):
+    job.start_stage('pobieranie danych tymczasowych')
+    processed_df = get_data_from_db(job.temp_id)
+    if processed_df is None:
+        job.finish('failed', error="Brak danych do przetworzenia.")
+        return
+
+    job.start_stage('zapis')
+    update_database_with_confirmation(processed_df, overwrite_request=overwrite_request)
+    job.finish('done')
+
+
+def get_session_job(job_id):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    # Zadanie jest widoczne tylko dla sesji z tymi samymi danymi logowania
+    if job is None or job.credentials != session_credentials():
+        return None
+    return job
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    credentials = session_credentials()
+    if credentials is None:
+        error_message = "Brak przypisanej bazy danych. Proszę przypisać bazę danych przed przesłaniem pliku Excel."
+        return jsonify(error=error_message)
+    if 'file' not in request.files:
+        return jsonify(error="Nieprawidłowe dane wejściowe")
+
+    file = request.files['file']
+    if not re.search(FILE_NAME_PATTERN, file.filename):
+        return jsonify(error="Niepoprawny schemat nazwy pliku. Oczekiwany format to NUMER_MR_RRRR-MM-DD_POJAZDY.")
+    _purge_jobs()
+
+    # Plik zapisywany jest na dysku, a odpowiedź wraca od razu z identyfikatorem zadania
+    os.makedirs(JOB_SPOOL_DIR, exist_ok=True)
+    job = IngestJob(file.filename, None, credentials)
+    job.path = os.path.join(JOB_SPOOL_DIR, job.id + os.path.splitext(file.filename)[1])
+    file.save(job.path)
+    with _jobs_lock:
+        _jobs[job.id] = job
+    get_job_executor().submit(run_job, job, ingest_job)
+    return jsonify(job.to_dict()), 202
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = get_session_job(job_id)
+    if job is None:
+        return jsonify(error="Nie znaleziono zadania."), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/jobs/<job_id>/confirm', methods=['POST'])
+def confirm_job_endpoint(job_id):
+    job = get_session_job(job_id)
+    if job is None:
+        return jsonify(error="Nie znaleziono zadania."), 404
+    overwrite_request = (request.json or {}).get("overwrite_request", False)
+    # Sprawdzenie i zmiana stanu pod blokadą, aby równoczesne potwierdzenia nie uruchomiły zapisu dwa razy
+    with _jobs_lock:
+        if job.status != 'awaiting_confirmation':
+            return jsonify(error="Zadanie nie oczekuje na potwierdzenie."), 409
+        job.status = 'queued'
+        job.finished = None
+    get_job_executor().submit(run_job, job, confirm_job, overwrite_request)
+    return jsonify(job.to_dict()), 202
+
+
 @app.route('/disconnect_db', methods=['POST'])
 def disconnect():
     if 'db_name' in session:
@@ -688,71 +2606,440 @@ def disconnect():
         return jsonify({'success': False, 'message': 'Nie ma aktywnego połączenia z bazą danych.'})
 
 
-@app.route('/plot', methods=['POST'])
-def plot():
-    if 'db_name' not in session:
-        return jsonify(error="Brak przypisanej bazy danych. Proszę przypisać bazę danych przed wygenerowaniem wykresu.")
-    start_date_1 = request.form.get('start_date_1')
-    end_date_1 = request.form.get('end_date_1')
-    start_date_2 = request.form.get('start_date_2')
-    end_date_2 = request.form.get('end_date_2')
-    car_type = request.form['car_type']
-    day_of_week = request.form.get('day_of_week')
-    section_number = request.form.get('section_number')
-
-    days_of_week_translation = {
-        'Monday': 'Poniedziałek',
-        'Tuesday': 'Wtorek',
-        'Wednesday': 'Środa',
-        'Thursday': 'Czwartek',
-        'Friday': 'Piątek',
-        'Saturday': 'Sobota',
-        'Sunday': 'Niedziela'
-    }
+# Pamięć podręczna odpowiedzi /plot
+PLOT_CACHE_MAX_BYTES = int(os.getenv('PLOT_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+PLOT_CACHE_TTL = float(os.getenv('PLOT_CACHE_TTL', '600'))
 
-    car_type_translation = {
-        'both': 'Oba',
-    }
 
-    # Walidacja dat wejściowych
-    try:
-        for date in [start_date_1, end_date_1, start_date_2, end_date_2]:
-            if date:
-                datetime.strptime(date, '%Y-%m-%d')
-    except ValueError:
-        return jsonify(error="Nieprawidłowy format daty. Użyj formatu RRRR-MM-DD.")
+class PlotCache:
+    """Pamięć podręczna LRU odpowiedzi /plot z limitem pamięci i czasem życia wpisów.
 
-    section_reverse, error = reverse_format_section(resource_path_mr_number_info(), section_number)
+    Każdy wpis pamięta bazę, odcinek i zakresy dat, z których powstał, aby zapis nowych
+    danych usuwał tylko wykresy, na które mógł wpłynąć.
+    """
 
-    df1, error1 = fetch_data_from_db(start_date_1, end_date_1, section_reverse)
-    df2, error2 = fetch_data_from_db(start_date_2, end_date_2, section_reverse) if start_date_2 and end_date_2 else (
+    def __init__(self, max_bytes=PLOT_CACHE_MAX_BYTES, ttl=PLOT_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # klucz -> (odpowiedź, rozmiar, czas zapisu, baza, odcinek, zakresy)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[2] > self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, payload, database, section, ranges):
+        """section - numer odcinka lub frozenset numerów odcinków wykresu; None oznacza wszystkie odcinki.
+
+        ranges - lista zakresów (data początkowa, data końcowa); None oznacza brak ograniczenia.
+        """
+        size = len(json.dumps(payload))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (payload, size, time.monotonic(), database, section, ranges)
+            self._size += size
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, database, section, start, end):
+        """Usuwa wpisy bazy obejmujące odcinek i nachodzące na zakres dat [start, end]."""
+        with self._lock:
+            stale = [key for key, entry in self._entries.items()
+                     if (database is None or entry[3] == database)
+                     and (entry[4] is None or entry[4] == section
+                          or (isinstance(entry[4], frozenset) and section in entry[4]))
+                     and any(_ranges_overlap(period, (start, end)) for period in entry[5])]
+            for key in stale:
+                self._remove(key)
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'invalidations': self.invalidations, 'entries': len(self._entries), 'bytes': self._size,
+                    'max_bytes': self.max_bytes}
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._size -= entry[1]
+
+
+def _ranges_overlap(period, other):
+    if period is None:
+        return True
+    (start, end), (other_start, other_end) = period, other
+    return start <= other_end and other_start <= end
+
+
+plot_cache = PlotCache()
+
+
+def current_database():
+    """Identyfikator bazy (nazwa, host, port) dla bieżącego żądania lub zadania w tle."""
+    credentials = session_credentials() if has_request_context() else g.get('db_credentials') \
+        if has_app_context() else None
+    if credentials is None:
+        return None
+    return credentials[0], credentials[3], credentials[4]
+
+
+def invalidate_plot_cache(df):
+    """Usuwa z pamięci podręcznej wykresy odcinków i dni, do których zapisano dane."""
+    dates = pd.to_datetime(df['Data 15min']).dt.date
+    database = current_database()
+    for section, section_dates in dates.groupby(df['Numer odcinka'].astype(str)):
+        if section_dates.notna().any():
+            plot_cache.invalidate(database, section, section_dates.min(), section_dates.max())
+
+
+@timed('process')
+def hour_of_day_profile(df_hourly):
+    """Uśrednia godzinowe sumy pojazdów według godziny doby."""
+    profile = df_hourly[['Liczba samochodów']].groupby(df_hourly.index.time).mean().reset_index()
+    profile['Liczba samochodów'] = profile['Liczba samochodów'].round(1)
+    profile.columns = ['Czas', 'Liczba samochodów']
+    return profile
+
+
+def plot_profiles_from_rows(start_date_1, end_date_1, start_date_2, end_date_2, section_reverse, car_type,
+                            day_of_week):
+    """Profile godzinowe obu okresów liczone w pandas z wierszy godzinowych lub 15-minutowych."""
+    # Godzinowe agregaty są czytane z tabeli pojazdy_godzinowe, a gdy jej nie ma - liczone z pojazdy
+    df1, error1 = fetch_hourly_rollup(start_date_1, end_date_1, section_reverse)
+    if df1 is not None:
+        fetch, process = fetch_hourly_rollup, process_rollup
+    else:
+        fetch, process = partial(fetch_data_from_db, columns=PLOT_ROW_COLUMNS), process_data
+        df1, error1 = fetch(start_date_1, end_date_1, section_reverse)
+    df2, error2 = fetch(start_date_2, end_date_2, section_reverse) if start_date_2 and end_date_2 else (
         None, None)
 
+    if error1 or error2:
+        return None, None, None, f"Błąd przetwarzania danych: {error1 or error2}"
     if df1 is None or df1.empty:
-        return jsonify(error="Brak danych do wyświetlenia.")
+        return None, None, None, "Brak danych do wyświetlenia."
 
-    df1_hourly, error1 = process_data(df1, car_type, day_of_week)
-    df2_hourly, error2 = process_data(df2, car_type, day_of_week) if df2 is not None else (None, None)
+    df1_hourly, error1 = process(df1, car_type, day_of_week)
+    df2_hourly, error2 = process(df2, car_type, day_of_week) if df2 is not None else (None, None)
     if error1 or (error2 and df2 is not None):
-        return jsonify(error=f"Błąd przetwarzania danych: {error1 or error2}")
+        return None, None, None, f"Błąd przetwarzania danych: {error1 or error2}"
 
     # Pobranie numeru odcinka drogi z danych
     odcinek_numer = df1['numer_odcinka'].iloc[0] if 'numer_odcinka' in df1.columns else "N/A"
 
-    df1_hourly = df1_hourly[['Liczba samochodów']].groupby(df1_hourly.index.time).mean().reset_index()
-    df1_hourly['Liczba samochodów'] = df1_hourly['Liczba samochodów'].round(1)
-    df1_hourly.columns = ['Czas', 'Liczba samochodów']
+    df1_hourly = hour_of_day_profile(df1_hourly)
     if df2_hourly is not None:
-        df2_hourly = df2_hourly[['Liczba samochodów']].groupby(df2_hourly.index.time).mean().reset_index()
-        df2_hourly['Liczba samochodów'] = df2_hourly['Liczba samochodów'].round(1)
-        df2_hourly.columns = ['Czas', 'Liczba samochodów']
+        df2_hourly = hour_of_day_profile(df2_hourly)
+    return df1_hourly, df2_hourly, odcinek_numer, None
+
+
+# Maksymalna liczba okresów porównania na jednym wykresie
+PLOT_MAX_PERIODS = int(os.getenv('PLOT_MAX_PERIODS', '24'))
+PLOT_PERIOD_FIELD = re.compile(r'(?:start|end)_date_(\d+)')
+# Etykieta serii, gdy nie wybrano odcinka
+PLOT_ALL_SECTIONS = 'wszystkie'
+
+
+@timed('fetch')
+def fetch_period_profiles(periods, sections=None, car_type=None, day_of_week=None):
+    """Średnia liczba pojazdów dla każdej godziny doby wielu okresów i odcinków, jednym zapytaniem.
+
+    Okresy trafiają do zapytania jako lista VALUES złączona z tabelą, więc każdy wiersz jest
+    oznaczany numerem okresu. Sumy godzinowe i ich średnie według godziny doby liczone są w bazie -
+    z bazy wraca najwyżej 24 wiersze na okres i odcinek, niezależnie od długości okresów.
+    Bez odcinków sumy obejmują wszystkie odcinki. Zwraca ramkę z kolumnami
+    Okres (indeks okresu na liście), numer_odcinka, godzina, Liczba samochodów.
+    """
+    try:
+        conn = connect_db()
+    except psycopg2.Error as e:
+        return None, str(e)
+
+    raw_expression, rollup_expression = PLOT_CAR_TYPE_EXPRESSIONS.get(car_type, PLOT_ALL_CARS_EXPRESSIONS)
+    values, params = [], []
+    for number, (_, start_date, end_date) in enumerate(periods):
+        values.append("(%s, %s::date, %s::date)")
+        params.extend([number] + ([start_date, end_date] if start_date and end_date else [None, None]))
+    # Zakres obejmujący wszystkie okresy zawęża odczyt tabeli (indeks, partycje)
+    bounds = [_date_range(start_date, end_date) for _, start_date, end_date in periods]
+    start, end = (min(b[0] for b in bounds), max(b[1] for b in bounds)) if None not in bounds else (None, None)
+    section_select = "p.numer_odcinka" if sections else "NULL"
+    day_num = DAYS_OF_WEEK.get(day_of_week) if day_of_week else None
+    # W PostgreSQL niedziela ma numer 0, w pandas poniedziałek
+    dow = (day_num + 1) % 7 if day_num is not None else None
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (ROLLUP_TABLES['h'][0],))
+            if cursor.fetchone()[0]:
+                table, time_column, hour, expression = ROLLUP_TABLES['h'][0], 'p.okres', 'p.okres', \
+                    rollup_expression
+            else:
+                table, time_column, hour, expression = 'pojazdy', 'p.data_15min', \
+                    "date_trunc('hour', p.data_15min)", raw_expression
+            conditions, filter_params = _rollup_filters('p.numer_odcinka', time_column,
+                                                        list(sections) if sections else None, start, end)
+            query = f"""
+            WITH okresy(nr, poczatek, koniec) AS (VALUES {', '.join(values)}),
+            godziny AS (
+                SELECT o.nr, {section_select} AS numer_odcinka, {hour} AS okres, SUM({expression}) AS liczba
+                FROM okresy o
+                JOIN {table} p ON (o.poczatek IS NULL OR {time_column} >= o.poczatek)
+                    AND (o.koniec IS NULL OR {time_column} < o.koniec + 1)
+                WHERE {' AND '.join(conditions)}
+                GROUP BY 1, 2, 3
+            )
+            SELECT nr, numer_odcinka, extract(hour FROM okres)::int AS godzina, AVG(liczba)::float8
+            FROM godziny
+            WHERE liczba IS NOT NULL AND (%s::int IS NULL OR extract(dow FROM okres) = %s)
+            GROUP BY 1, 2, 3
+            ORDER BY 1, 2, 3
+            """
+            cursor.execute(query, params + filter_params + [dow, dow])
+            rows = cursor.fetchall()
+    except psycopg2.Error as e:
+        conn.close()
+        return None, str(e)
+
+    conn.close()
+    df = pd.DataFrame(rows, columns=['Okres', 'numer_odcinka', 'godzina', 'Liczba samochodów'])
+    df['Liczba samochodów'] = df['Liczba samochodów'].astype('float64').round(1)
+    if not sections:
+        df['numer_odcinka'] = PLOT_ALL_SECTIONS
+    return df, None
+
+
+def plot_periods(params):
+    return params['periods']
+
+
+def plot_series_mode(params):
+    """Wykres seriami: porównanie odcinków lub więcej niż dwa okresy."""
+    return bool(params['sections']) or len(params['periods']) > 2
+
+
+def plot_series_sections(params):
+    if params['sections']:
+        return params['sections']
+    return [params['section_reverse']] if params['section_reverse'] else None
+
+
+def plot_section_profiles(params):
+    """Profile godzinowe okresów i odcinków w układzie długim: Okres, numer_odcinka, godzina, Liczba samochodów.
+
+    Wszystkie okresy są pobierane i uśredniane w bazie jednym zapytaniem.
+    """
+    periods = plot_periods(params)
+    profiles, error = fetch_period_profiles(periods, plot_series_sections(params), params['car_type'],
+                                            params['day_of_week'])
+    if error:
+        return None, f"Błąd przetwarzania danych: {error}"
+    if profiles.empty:
+        return None, "Brak danych do wyświetlenia."
+    profiles['Okres'] = profiles['Okres'].map(dict(enumerate(name for name, _, _ in periods)))
+    return profiles, None
+
+
+def section_chart_data(profiles, params, title):
+    """Dane wykresu seriami: wspólna oś godzin i jedna seria na okres i odcinek."""
+    periods = plot_periods(params)
+    sections = plot_series_sections(params) or [PLOT_ALL_SECTIONS]
+    hours = sorted(profiles['godzina'].unique())
+    keys = [(period, section) for period, _, _ in periods for section in sections]
+    table = profiles.set_index(['Okres', 'numer_odcinka', 'godzina'])['Liczba samochodów'] \
+        .unstack('godzina').reindex(index=pd.MultiIndex.from_tuples(keys), columns=hours)
+
+    dates = {period: (start_date, end_date) for period, start_date, end_date in periods}
+    series = []
+    for (period, section), values in zip(keys, table.to_numpy()):
+        if len(periods) == 1:
+            name = section
+        elif len(sections) == 1:
+            name = f"{period} ({dates[period][0]} - {dates[period][1]})"
+        else:
+            name = f"{section} ({dates[period][0]} - {dates[period][1]})"
+        series.append({'name': name, 'section': section, 'period': period,
+                       'y': [None if np.isnan(value) else float(value) for value in values]})
+    chart_data = {
+        "x": [str(dt_time(int(hour))) for hour in hours],
+        "series": series,
+        "labels": {"title": title, "xaxis": "Czas", "yaxis": "Liczba samochodów"},
+        "periods": [{'name': period, 'start_date': start_date, 'end_date': end_date}
+                    for period, start_date, end_date in periods],
+        "start_date_1": params['start_date_1'],
+        "end_date_1": params['end_date_1'],
+    }
+    if params['has_period_2']:
+        chart_data.update(start_date_2=params['start_date_2'], end_date_2=params['end_date_2'])
+    return chart_data
+
+
+DAYS_OF_WEEK_TRANSLATION = {
+    'Monday': 'Poniedziałek',
+    'Tuesday': 'Wtorek',
+    'Wednesday': 'Środa',
+    'Thursday': 'Czwartek',
+    'Friday': 'Piątek',
+    'Saturday': 'Sobota',
+    'Sunday': 'Niedziela'
+}
+CAR_TYPE_TRANSLATION = {
+    'both': 'Oba',
+}
+
+
+def plot_parameters(form):
+    """Odczytuje i waliduje parametry wykresu z formularza /plot lub z parametrów zapytania eksportu.
+
+    Okresy porównania podawane są polami start_date_N i end_date_N; okres 1 jest zawsze,
+    kolejne liczą się tylko z obiema datami.
+    """
+    params = {name: form.get(name) for name in ['start_date_1', 'end_date_1', 'start_date_2', 'end_date_2',
+                                                 'car_type', 'day_of_week', 'section_number']}
+    if not params['car_type']:
+        return None, "Nie wybrano typu samochodu."
+
+    numbers = {1}
+    for name in form:
+        match = PLOT_PERIOD_FIELD.fullmatch(name)
+        if match and int(match.group(1)) > 0:
+            numbers.add(int(match.group(1)))
+    numbers = sorted(numbers)
+    # Walidacja dat wejściowych
+    try:
+        for number in numbers:
+            for date in [form.get(f'start_date_{number}'), form.get(f'end_date_{number}')]:
+                if date:
+                    datetime.strptime(date, '%Y-%m-%d')
+    except ValueError:
+        return None, "Nieprawidłowy format daty. Użyj formatu RRRR-MM-DD."
+    params['periods'] = [(f'Okres {number}', form.get(f'start_date_{number}'), form.get(f'end_date_{number}'))
+                         for number in numbers
+                         if number == 1 or (form.get(f'start_date_{number}') and form.get(f'end_date_{number}'))]
+    if len(params['periods']) > PLOT_MAX_PERIODS:
+        return None, f"Można porównać najwyżej {PLOT_MAX_PERIODS} okresów."
+
+    params['section_reverse'], _ = reverse_format_section(resource_path_mr_number_info(),
+                                                          params['section_number'])
+    # Tryb porównania odcinków: odcinek główny i odcinki z pola section_numbers
+    labels = [label for label in [params['section_number']] + form.getlist('section_numbers') if label]
+    params['sections'] = []
+    if len(labels) > 1:
+        for label in dict.fromkeys(labels):
+            section, _ = reverse_format_section(resource_path_mr_number_info(), label)
+            if not section:
+                return None, f"Nie znaleziono odcinka: {label}"
+            if section not in params['sections']:
+                params['sections'].append(section)
+    # Drugi okres liczy się tylko z obiema datami
+    params['has_period_2'] = bool(params['start_date_2'] and params['end_date_2'])
+    return params, None
+
+
+def plot_profiles(params):
+    """Zwraca (profil okresu 1, profil okresu 2 lub None, numer odcinka) albo komunikat błędu."""
+    start_date_1, end_date_1 = params['start_date_1'], params['end_date_1']
+    start_date_2, end_date_2 = params['start_date_2'], params['end_date_2']
+    section_reverse, car_type, day_of_week = params['section_reverse'], params['car_type'], params['day_of_week']
+
+    if PLOT_SQL_AGGREGATION and section_reverse:
+        # Profile obu okresów liczone są w bazie jednym zapytaniem, tak jak w trybie serii
+        periods = plot_periods(params)[:2 if params['has_period_2'] else 1]
+        profiles, error = fetch_period_profiles(periods, [section_reverse], car_type, day_of_week)
+        if error:
+            return None, f"Błąd przetwarzania danych: {error}"
+        by_period = {number: _period_profile(profiles, number) for number in range(len(periods))}
+        if by_period[0].empty:
+            return None, "Brak danych do wyświetlenia."
+        # Drugi okres bez danych daje pustą serię, tak jak przy liczeniu w pandas
+        return (by_period[0], by_period.get(1), section_reverse), None
+
+    df1_hourly, df2_hourly, odcinek_numer, error = plot_profiles_from_rows(
+        start_date_1, end_date_1, start_date_2, end_date_2, section_reverse, car_type, day_of_week)
+    if error:
+        return None, error
+    return (df1_hourly, df2_hourly, odcinek_numer), None
+
+
+def _period_profile(profiles, number):
+    """Profil jednego okresu z wyniku fetch_period_profiles w układzie hour_of_day_profile."""
+    profile = profiles[profiles['Okres'] == number]
+    return pd.DataFrame({'Czas': [dt_time(int(hour)) for hour in profile['godzina']],
+                         'Liczba samochodów': profile['Liczba samochodów'].to_numpy()})
+
+
+def plot_title(car_type, day_of_week, odcinek_numer):
     title = f"Średnia liczba samochodów"
     if day_of_week:
-        polish_day_of_week = days_of_week_translation.get(day_of_week, day_of_week)
+        polish_day_of_week = DAYS_OF_WEEK_TRANSLATION.get(day_of_week, day_of_week)
         title += f"<br>Dzień tygodnia: {polish_day_of_week}"
-    car_type_translation = car_type_translation.get(car_type, car_type)
-    title += f"<br>Typ samochodu: {car_type_translation}"
+    title += f"<br>Typ samochodu: {CAR_TYPE_TRANSLATION.get(car_type, car_type)}"
     title += f"<br>Numer MR: {odcinek_numer}"
+    return title
+
+
+@app.route('/plot', methods=['POST'])
+def plot():
+    if 'db_name' not in session:
+        return jsonify(error="Brak przypisanej bazy danych. Proszę przypisać bazę danych przed wygenerowaniem wykresu.")
+    params, error = plot_parameters(request.form)
+    if error:
+        return jsonify(error=error)
+    start_date_1, end_date_1 = params['start_date_1'], params['end_date_1']
+    start_date_2, end_date_2 = params['start_date_2'], params['end_date_2']
+    car_type, day_of_week, section_reverse = params['car_type'], params['day_of_week'], params['section_reverse']
+    sections = params['sections']
+    periods = plot_periods(params)
+
+    # Klucz z danych po walidacji
+    cache_key = (current_database(), tuple(sections) if sections else section_reverse,
+                 tuple((start_date or None, end_date or None) for _, start_date, end_date in periods),
+                 car_type, day_of_week or None)
+    cached = plot_cache.get(cache_key)
+    if cached is not None:
+        return chart_response(cached)
+    ranges = [_date_range(start_date, end_date) for _, start_date, end_date in periods]
+
+    if plot_series_mode(params):
+        # Porównanie odcinków lub wielu okresów - jedno zapytanie dla wszystkich okresów i odcinków
+        profiles, error = plot_section_profiles(params)
+        if error:
+            return jsonify(error=error)
+        title = plot_title(car_type, day_of_week, ', '.join(plot_series_sections(params) or [PLOT_ALL_SECTIONS]))
+        payload = {'chart_data': section_chart_data(profiles, params, title)}
+        plot_cache.put(cache_key, payload, cache_key[0], frozenset(sections) if sections else section_reverse,
+                       ranges)
+        return chart_response(payload)
+
+    profiles, error = plot_profiles(params)
+    if error:
+        return jsonify(error=error)
+    df1_hourly, df2_hourly, odcinek_numer = profiles
+
+    title = plot_title(car_type, day_of_week, odcinek_numer)
     chart_data = {
         "x": df1_hourly['Czas'].astype(str).tolist(),  # Convert to string for JSON
         "y1": df1_hourly['Liczba samochodów'].tolist(),
@@ -780,30 +3067,518 @@ def plot():
             "title": title
         })
 
-    # Eksport danych do CSV
-    csv_output = io.StringIO()
-    csv_writer = csv.writer(csv_output)
-    csv_writer.writerow([
-        'Okres', 'Data początkowa', 'Data końcowa', 'Czas', 'Średnia liczba samochodów',
-        'Typ samochodu', 'Numer MR'
-    ])
+    # Dane CSV są dostępne osobno pod /export/plot.csv
+    payload = {'chart_data': chart_data}
+    plot_cache.put(cache_key, payload, cache_key[0], section_reverse, ranges)
+    return chart_response(payload)
+
+
+@app.route('/plot/heatmap', methods=['POST'])
+def plot_heatmap():
+    """Mapa cieplna dzień tygodnia x pora dnia dla odcinka i okresu 1 formularza wykresu.
+
+    Macierze wszystkich typów samochodów są zwracane razem, więc zmiana typu nie wymaga zapytania.
+    """
+    if 'db_name' not in session:
+        return jsonify(error="Brak przypisanej bazy danych. Proszę przypisać bazę danych przed wygenerowaniem wykresu.")
+    params, error = plot_parameters(request.form)
+    if error:
+        return jsonify(error=error)
+    try:
+        resolution = int(request.form.get('resolution') or 60)
+    except ValueError:
+        resolution = None
+    if resolution not in HEATMAP_RESOLUTIONS:
+        return jsonify(error=f"Nieprawidłowa rozdzielczość mapy cieplnej: {request.form.get('resolution')}")
+    start_date, end_date, section_reverse = params['start_date_1'], params['end_date_1'], params['section_reverse']
+
+    cache_key = (current_database(), section_reverse, 'heatmap', start_date or None, end_date or None, resolution)
+    cached = plot_cache.get(cache_key)
+    if cached is not None:
+        return jsonify(**cached)
+
+    matrices, error = fetch_week_heatmap(start_date, end_date, section_reverse, resolution)
+    if error:
+        return jsonify(error=f"Błąd przetwarzania danych: {error}")
+    if matrices is None:
+        return jsonify(error="Brak danych do wyświetlenia.")
+
+    title = "Średnia liczba samochodów według dnia tygodnia i pory dnia"
+    title += f"<br>Numer MR: {section_reverse or PLOT_ALL_SECTIONS}"
+    payload = {'heatmap': {
+        'x': [f"{minute // 60:02d}:{minute % 60:02d}" for minute in range(0, 1440, resolution)],
+        'y': list(DAYS_OF_WEEK_TRANSLATION.values()),
+        'z': {car_type: [[None if np.isnan(value) else float(value) for value in row] for row in matrix]
+              for car_type, matrix in matrices.items()},
+        'resolution': resolution,
+        'labels': {'title': title, 'xaxis': "Pora dnia", 'yaxis': "Dzień tygodnia"},
+        'start_date': start_date,
+        'end_date': end_date,
+    }}
+    plot_cache.put(cache_key, payload, cache_key[0], section_reverse, [_date_range(start_date, end_date)])
+    return jsonify(**payload)
+
+
+def _timestamp(value):
+    """Czas z parametru okna powiększenia (RRRR-MM-DD[ GG:MM[:SS]]) lub None."""
+    try:
+        return datetime.fromisoformat(value.strip().replace('T', ' ')) if value else None
+    except ValueError:
+        return None
 
+
+@app.route('/plot/timeseries', methods=['POST'])
+def plot_timeseries():
+    """Szereg 15-minutowy odcinka zmniejszony algorytmem LTTB do stałej liczby punktów.
+
+    Domyślnie obejmuje okres 1 formularza wykresu; pola start i end (okno powiększenia)
+    zawężają zapytanie do widocznego fragmentu, który wraca w wyższej rozdzielczości.
+    """
+    if 'db_name' not in session:
+        return jsonify(error="Brak przypisanej bazy danych. Proszę przypisać bazę danych przed wygenerowaniem wykresu.")
+    params, error = plot_parameters(request.form)
+    if error:
+        return jsonify(error=error)
+    if not (params['start_date_1'] and params['end_date_1']):
+        return jsonify(error="Podaj daty okresu 1.")
+    start = _timestamp(request.form.get('start')) or datetime.strptime(params['start_date_1'], '%Y-%m-%d')
+    end = _timestamp(request.form.get('end')) or \
+        datetime.strptime(params['end_date_1'], '%Y-%m-%d') + timedelta(days=1)
+    if start >= end:
+        return jsonify(error="Początek zakresu musi być wcześniejszy niż koniec.")
+    try:
+        points = min(max(int(request.form.get('points') or TIMESERIES_POINTS), TIMESERIES_MIN_POINTS),
+                     TIMESERIES_MAX_POINTS)
+    except ValueError:
+        points = TIMESERIES_POINTS
+    car_type, section_reverse = params['car_type'], params['section_reverse']
+
+    cache_key = (current_database(), section_reverse, 'timeseries', start, end, car_type, points)
+    cached = plot_cache.get(cache_key)
+    if cached is not None:
+        return jsonify(**cached)
+
+    times, values, error = fetch_time_series(start, end, section_reverse, car_type)
+    if error:
+        return jsonify(error=f"Błąd przetwarzania danych: {error}")
+    if not len(times):
+        return jsonify(error="Brak danych do wyświetlenia.")
+    keep = ~np.isnan(values)
+    times, values = times[keep], values[keep]
+    selected = lttb(times.astype(np.int64), values, points)
+
+    title = "Liczba samochodów w przedziałach 15-minutowych"
+    title += f"<br>Typ samochodu: {CAR_TYPE_TRANSLATION.get(car_type, car_type)}"
+    title += f"<br>Numer MR: {section_reverse or PLOT_ALL_SECTIONS}"
+    payload = {'timeseries': {
+        'x': np.datetime_as_string(times[selected], unit='m').tolist(),
+        'y': values[selected].tolist(),
+        'raw_points': int(len(times)),
+        'start': start.isoformat(sep=' '),
+        'end': end.isoformat(sep=' '),
+        'labels': {'title': title, 'xaxis': "Czas", 'yaxis': "Liczba samochodów"},
+    }}
+    plot_cache.put(cache_key, payload, cache_key[0], section_reverse, [(start.date(), end.date())])
+    return jsonify(**payload)
+
+
+@app.route('/plot/percentiles', methods=['POST'])
+def plot_percentiles():
+    """Histogram prędkości lub długości i jego percentyle dla odcinka i okresu 1 formularza wykresu.
+
+    Pola: measure (speed, length), lane (1, 2, puste - oba pasy) i powtarzalne p (domyślnie 85).
+    """
+    if 'db_name' not in session:
+        return jsonify(error="Brak przypisanej bazy danych. Proszę przypisać bazę danych przed wygenerowaniem wykresu.")
+    params, error = plot_parameters(request.form)
+    if error:
+        return jsonify(error=error)
+    measure = request.form.get('measure') or 'speed'
+    if measure not in HISTOGRAMS:
+        return jsonify(error=f"Nieprawidłowa wielkość histogramu: {measure}")
+    lane = request.form.get('lane') or ''
+    if lane not in ('', '1', '2'):
+        return jsonify(error=f"Nieprawidłowy pas ruchu: {lane}")
+    lanes = (int(lane),) if lane else (1, 2)
+    try:
+        percentiles = tuple(float(p) for p in request.form.getlist('p')) or PERCENTILES_DEFAULT
+    except ValueError:
+        percentiles = None
+    if not percentiles or not all(0 <= p <= 100 for p in percentiles):
+        return jsonify(error="Percentyle muszą być liczbami z zakresu 0-100.")
+    car_type = params['car_type']
+    categories = (car_type,) if car_type in ('H', 'L') else ('H', 'L')
+    start_date, end_date, section_reverse = params['start_date_1'], params['end_date_1'], params['section_reverse']
+
+    cache_key = (current_database(), section_reverse, 'percentiles', start_date or None, end_date or None,
+                 measure, lanes, categories, percentiles)
+    cached = plot_cache.get(cache_key)
+    if cached is not None:
+        return jsonify(**cached)
+
+    counts, error = fetch_histogram(measure, start_date, end_date, section_reverse, lanes, categories)
+    if error:
+        return jsonify(error=f"Błąd przetwarzania danych: {error}")
+    if not counts.any():
+        return jsonify(error="Brak danych do wyświetlenia.")
+
+    edges = HISTOGRAMS[measure][1]
+    values = histogram_percentiles(counts, edges, percentiles)
+    payload = {'histogram': {
+        'measure': measure,
+        'edges': edges.tolist(),
+        'counts': counts.tolist(),
+        'count': int(counts.sum()),
+        'percentiles': [{'p': p, 'value': round(value, 1)} for p, value in zip(percentiles, values)],
+        'start_date': start_date,
+        'end_date': end_date,
+    }}
+    plot_cache.put(cache_key, payload, cache_key[0], section_reverse, [_date_range(start_date, end_date)])
+    return jsonify(**payload)
+
+
+def _date_range(start_date, end_date):
+    # Okres bez obu dat obejmuje wszystkie dane
+    if not (start_date and end_date):
+        return None
+    return datetime.strptime(start_date, '%Y-%m-%d').date(), datetime.strptime(end_date, '%Y-%m-%d').date()
+
+
+# Eksport danych CSV strumieniowo, fragmentami
+EXPORT_CHUNK_BYTES = int(os.getenv('EXPORT_CHUNK_BYTES', str(64 * 1024)))
+EXPORT_QUEUE_SIZE = 16
+
+
+def csv_row_chunks(rows, chunk_bytes=None):
+    """Zamienia wiersze na fragmenty CSV (bytes) o rozmiarze około chunk_bytes."""
+    chunk_bytes = chunk_bytes or EXPORT_CHUNK_BYTES
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= chunk_bytes:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31 - strumień w formacie gzip
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def timed_chunks(stage, chunks):
+    """Przekazuje fragmenty odpowiedzi dalej i mierzy łączny czas ich tworzenia jako etap stage.
+
+    Czas wysyłania do klienta nie jest wliczany; etap trafia do /metrics po zakończeniu strumienia,
+    więc nie ma go w nagłówku Server-Timing.
+    """
+    elapsed = 0.0
+    chunks = iter(chunks)
+    try:
+        while True:
+            started = time.perf_counter()
+            chunk = next(chunks, None)
+            elapsed += time.perf_counter() - started
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        record_stage(stage, elapsed)
+
+
+def csv_response(chunks, file_name):
+    """Odpowiedź strumieniowa z fragmentami CSV.
+
+    Przy compress=gzip w zapytaniu zwracany jest plik .csv.gz, a gdy klient akceptuje gzip -
+    CSV skompresowany na czas przesyłania (Content-Encoding).
+    """
+    headers = {'Content-Disposition': f'attachment; filename="{file_name}"', 'Vary': 'Accept-Encoding'}
+    mimetype = 'text/csv'
+    if request.args.get('compress') == 'gzip':
+        headers['Content-Disposition'] = f'attachment; filename="{file_name}.gz"'
+        mimetype = 'application/gzip'
+        chunks = gzip_chunks(chunks)
+    elif request.accept_encodings['gzip']:
+        # Strumień kompresowany jest tylko gzip; jakość 0 (gzip;q=0) oznacza odmowę
+        headers['Content-Encoding'] = 'gzip'
+        chunks = gzip_chunks(chunks)
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
+
+
+class _QueueWriter:
+    """Plik dla copy_expert, który przekazuje dane do kolejki fragmentami po EXPORT_CHUNK_BYTES."""
+
+    def __init__(self, put):
+        self._put = put
+        self._buffer = io.BytesIO()
+
+    def write(self, data):
+        self._buffer.write(data.encode() if isinstance(data, str) else data)
+        if self._buffer.tell() >= EXPORT_CHUNK_BYTES:
+            self.flush()
+
+    def flush(self):
+        if self._buffer.tell():
+            self._put(self._buffer.getvalue())
+            self._buffer = io.BytesIO()
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def copy_chunks(conn, copy_sql):
+    """Zwraca wynik COPY ... TO STDOUT fragmentami, bez wczytywania całości do pamięci.
+
+    copy_expert działa w osobnym wątku i zapisuje do ograniczonej kolejki, więc wolny klient
+    wstrzymuje odczyt z bazy. Przerwanie pobierania anuluje zapytanie.
+    """
+    chunks = queue.Queue(maxsize=EXPORT_QUEUE_SIZE)
+    cancelled = threading.Event()
+
+    def put(item):
+        while not cancelled.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise ExportCancelled()
+
+    def produce():
+        try:
+            writer = _QueueWriter(put)
+            with conn.cursor() as cursor:
+                cursor.copy_expert(copy_sql, writer)
+            writer.flush()
+            conn.commit()
+            put(None)
+        except Exception as e:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
+            if not isinstance(e, ExportCancelled):
+                try:
+                    put(e)
+                except ExportCancelled:
+                    pass
+
+    thread = threading.Thread(target=produce, name='export', daemon=True)
+    thread.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                app.logger.error("Błąd eksportu danych: %s", chunk)
+                raise chunk
+            yield chunk
+    finally:
+        cancelled.set()
+        if thread.is_alive():
+            try:
+                conn.cancel()
+            except (psycopg2.Error, AttributeError):
+                pass
+        thread.join()
+
+
+PLOT_CSV_HEADER = ['Okres', 'Data początkowa', 'Data końcowa', 'Czas', 'Średnia liczba samochodów',
+                   'Typ samochodu', 'Numer MR']
+
+
+def plot_csv_rows(profiles, params):
+    df1_hourly, df2_hourly, odcinek_numer = profiles
+    car_type_translation = CAR_TYPE_TRANSLATION.get(params['car_type'], params['car_type'])
+    yield PLOT_CSV_HEADER
     # Pętla iterująca przez dane z obu okresów
     for df, (start_date, end_date), period in zip(
             [df1_hourly, df2_hourly],
-            [(start_date_1, end_date_1), (start_date_2, end_date_2)],
+            [(params['start_date_1'], params['end_date_1']), (params['start_date_2'], params['end_date_2'])],
             ['Okres 1', 'Okres 2']
     ):
         if df is not None:
-            for _, row in df.iterrows():
-                csv_writer.writerow([
-                    period, start_date, end_date, row['Czas'], row['Liczba samochodów'],
-                    car_type_translation, odcinek_numer
-                ])
+            for hour, cars in zip(df['Czas'], df['Liczba samochodów']):
+                yield [period, start_date, end_date, hour, cars, car_type_translation, odcinek_numer]
+
+
+def section_csv_rows(profiles, params):
+    car_type_translation = CAR_TYPE_TRANSLATION.get(params['car_type'], params['car_type'])
+    dates = {period: (start_date, end_date) for period, start_date, end_date in plot_periods(params)}
+    yield PLOT_CSV_HEADER
+    for period, section, hour, cars in zip(profiles['Okres'], profiles['numer_odcinka'], profiles['godzina'],
+                                           profiles['Liczba samochodów']):
+        yield [period, *dates[period], dt_time(int(hour)), cars, car_type_translation, section]
+
+
+@app.route('/export/plot.csv', methods=['GET'])
+def export_plot_csv():
+    """Dane wykresu /plot jako CSV; parametry zapytania są takie same jak pola formularza wykresu."""
+    if 'db_name' not in session:
+        return jsonify(error="Brak przypisanej bazy danych."), 400
+    params, error = plot_parameters(request.args)
+    if error:
+        return jsonify(error=error), 400
+    if plot_series_mode(params):
+        profiles, error = plot_section_profiles(params)
+        rows = section_csv_rows
+    else:
+        profiles, error = plot_profiles(params)
+        rows = plot_csv_rows
+    if error:
+        return jsonify(error=error), 404
+
+    # Fragmenty CSV są wysyłane w miarę tworzenia, tak jak w /export/pojazdy.csv
+    return csv_response(timed_chunks('csv_build', csv_row_chunks(rows(profiles, params))), 'dane_samochody.csv')
+
+
+@app.route('/export/pojazdy.csv', methods=['GET'])
+def export_pojazdy_csv():
+    """Surowe wiersze tabeli pojazdy dla odcinka i zakresu dat, przesyłane przez COPY ... TO STDOUT."""
+    if 'db_name' not in session:
+        return jsonify(error="Brak przypisanej bazy danych."), 400
+    start_date, end_date = request.args.get('start_date'), request.args.get('end_date')
+    section_number = request.args.get('section_number')
+    try:
+        for date in [start_date, end_date]:
+            datetime.strptime(date or '', '%Y-%m-%d')
+    except ValueError:
+        return jsonify(error="Nieprawidłowy format daty. Użyj formatu RRRR-MM-DD."), 400
+
+    section_reverse = None
+    if section_number:
+        section_reverse, error = reverse_format_section(resource_path_mr_number_info(), section_number)
+        if not section_reverse:
+            return jsonify(error=f"Nie znaleziono odcinka: {section_number}"), 400
+
+    try:
+        conn = connect_db()
+    except psycopg2.Error as e:
+        return jsonify(error=str(e)), 500
+
+    conditions, params = _rollup_filters('numer_odcinka', 'data_15min', section_reverse, start_date, end_date)
+    with conn.cursor() as cursor:
+        # COPY nie przyjmuje parametrów, więc zapytanie jest składane przez mogrify
+        query = cursor.mogrify(f"SELECT {_pojazdy_column_list} FROM pojazdy WHERE {' AND '.join(conditions)} "
+                               f"ORDER BY numer_odcinka, data_15min", params)
+    if isinstance(query, bytes):
+        query = query.decode()
+    file_name = f"pojazdy_{section_reverse or 'wszystkie'}_{start_date}_{end_date}.csv"
+    return csv_response(copy_chunks(conn, f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)"), file_name)
+
+
+@app.route('/plot/cache', methods=['GET'])
+def plot_cache_stats():
+    return jsonify(plot_cache.stats())
+
+
+def render_metrics():
+    """Zwraca metryki procesu w formacie tekstowym Prometheus."""
+    lines = stage_durations.render() + stage_rows.render()
+
+    cache = plot_cache.stats()
+    for name, kind, description in [
+        ('hits', 'counter', "Odpowiedzi /plot z pamięci podręcznej."),
+        ('misses', 'counter', "Odpowiedzi /plot spoza pamięci podręcznej."),
+        ('evictions', 'counter', "Wpisy usunięte z powodu limitu pamięci."),
+        ('invalidations', 'counter', "Wpisy usunięte po zapisie nowych danych."),
+        ('entries', 'gauge', "Liczba wpisów w pamięci podręcznej."),
+        ('bytes', 'gauge', "Rozmiar pamięci podręcznej w bajtach."),
+    ]:
+        metric = f"inz_plot_cache_{name}_total" if kind == 'counter' else f"inz_plot_cache_{name}"
+        lines += [f"# HELP {metric} {description}", f"# TYPE {metric} {kind}", f"{metric} {cache[name]}"]
+
+    cache = parse_cache.stats()
+    for name, kind, description in [
+        ('hits', 'counter', "Pliki wczytane z dyskowej pamięci podręcznej."),
+        ('misses', 'counter', "Pliki wczytane i zagregowane od nowa."),
+        ('evictions', 'counter', "Wpisy usunięte z powodu limitu rozmiaru."),
+        ('entries', 'gauge', "Liczba wpisów w pamięci podręcznej."),
+        ('bytes', 'gauge', "Rozmiar pamięci podręcznej w bajtach."),
+    ]:
+        metric = f"inz_parse_cache_{name}_total" if kind == 'counter' else f"inz_parse_cache_{name}"
+        lines += [f"# HELP {metric} {description}", f"# TYPE {metric} {kind}", f"{metric} {cache[name]}"]
+
+    with _jobs_lock:
+        statuses = [job.status for job in _jobs.values()]
+    lines += ["# HELP inz_jobs Liczba zadań wczytywania według stanu.", "# TYPE inz_jobs gauge"]
+    for status in ['queued', 'running', 'awaiting_confirmation', 'done', 'failed']:
+        lines.append(f'inz_jobs{{status="{status}"}} {statuses.count(status)}')
+    return '\n'.join(lines) + '\n'
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return render_metrics(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+def _cli_database_options(command):
+    """Opcje połączenia z bazą dla poleceń wiersza poleceń (flask --app wykres ...)."""
+    options = [
+        click.option('--db-name', required=True),
+        click.option('--db-user', required=True),
+        click.option('--db-password', envvar='DB_PASSWORD', prompt=True, hide_input=True),
+        click.option('--db-host', default='localhost'),
+        click.option('--db-port', default='5432'),
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
+
+
+def _use_cli_database(db_name, db_user, db_password, db_host, db_port):
+    # Polecenia działają w kontekście aplikacji, tak jak zadania w tle
+    g.db_credentials = (db_name, db_user, cipher.encrypt(db_password.encode()).decode(), db_host, db_port)
 
-    csv_data = csv_output.getvalue()
 
-    return jsonify(chart_data=chart_data, csv_data=csv_data)
+@app.cli.command('rollup-backfill')
+@_cli_database_options
+@click.option('--section', default=None, help="Numer odcinka (domyślnie wszystkie).")
+@click.option('--start-date', default=None, help="RRRR-MM-DD")
+@click.option('--end-date', default=None, help="RRRR-MM-DD")
+def rollup_backfill_command(db_name, db_user, db_password, db_host, db_port, section, start_date, end_date):
+    """Odbudowuje tabele agregatów godzinowych i dziennych z tabeli pojazdy."""
+    _use_cli_database(db_name, db_user, db_password, db_host, db_port)
+    conn = connect_db()
+    cursor = conn.cursor()
+    ensure_rollup_tables(cursor)
+    rebuild_rollups(cursor, section, start_date, end_date)
+    conn.commit()
+    cursor.close()
+    conn.close()
+    click.echo("Agregaty zostały odbudowane.")
+
+
+@app.cli.command('rollup-check')
+@_cli_database_options
+@click.option('--section', default=None, help="Numer odcinka (domyślnie wszystkie).")
+@click.option('--start-date', default=None, help="RRRR-MM-DD")
+@click.option('--end-date', default=None, help="RRRR-MM-DD")
+def rollup_check_command(db_name, db_user, db_password, db_host, db_port, section, start_date, end_date):
+    """Porównuje tabele agregatów z danymi w tabeli pojazdy."""
+    _use_cli_database(db_name, db_user, db_password, db_host, db_port)
+    conn = connect_db()
+    cursor = conn.cursor()
+    mismatches = check_rollups(cursor, section, start_date, end_date)
+    cursor.close()
+    conn.close()
+
+    if not mismatches:
+        click.echo("Agregaty są zgodne z tabelą pojazdy.")
+        return
+    for table, period, section_number in mismatches[:20]:
+        click.echo(f"{table}: {section_number} {period}")
+    click.echo(f"Niezgodnych agregatów: {len(mismatches)}. Uruchom rollup-backfill, aby je odbudować.")
+    raise SystemExit(1)
 
 
 if __name__ == '__main__':